@@ -0,0 +1,82 @@
+import os
+import subprocess
+import time
+
+# Never give up on a capture sooner than this, however fast the trace rate
+MIN_PROGRESS_TIMEOUT = 30.0
+
+
+class AcquisitionTimeout(Exception):
+    """The acquisition process stopped producing data and was killed."""
+
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+def directory_size(directory):
+    """(number of files, total bytes) in a directory; (0, 0) if it is missing."""
+    count = total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        count += 1
+                        total += entry.stat().st_size
+                except OSError:
+                    continue  # removed while scanning
+    except OSError:
+        pass
+    return count, total
+
+
+def progress_timeout(config, nrefls):
+    """Seconds without output growth after which the acquisition counts as hung.
+
+    'acquisition_timeout' in the config wins; otherwise three times the time one
+    capture file takes at the reflectogram rate (files are written in one go once
+    all nrefls traces are in), but at least MIN_PROGRESS_TIMEOUT.
+    """
+    if config.get('acquisition_timeout'):
+        return float(config['acquisition_timeout'])
+    rate = float(config.get('trace_rate', config.get('freq_send_data', 0)) or 0)
+    per_file = int(nrefls) / rate if rate > 0 else 0.0
+    return max(MIN_PROGRESS_TIMEOUT, 3.0 * per_file)
+
+
+def run_acquisition(args, output_dir, timeout, poll=0.5):
+    """Run the acquisition program, killing it if output_dir stops growing.
+
+    Returns when the process exits with code 0. Raises CalledProcessError for a
+    nonzero exit (like check_call) and AcquisitionTimeout when neither a new file
+    nor new bytes appeared in output_dir for timeout seconds.
+    """
+    process = subprocess.Popen(args)
+    last = directory_size(output_dir)
+    last_progress = time.monotonic()
+    try:
+        while True:
+            try:
+                returncode = process.wait(timeout=poll)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            now = time.monotonic()
+            current = directory_size(output_dir)
+            if current != last:
+                last, last_progress = current, now
+            elif now - last_progress > timeout:
+                process.kill()
+                returncode = process.wait()
+                raise AcquisitionTimeout(
+                    f'no new data in {output_dir} for {timeout:.0f} s '
+                    f'({last[0]} files, {last[1]} bytes), process killed', returncode)
+    except BaseException:
+        # Never leave the program running behind us (e.g. on KeyboardInterrupt)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
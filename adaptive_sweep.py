@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+import numpy as np
+
+from experiment_catalog import PARAM_COLUMNS
+from reflectogram_reduction import StepReducer, summary_path, CHANNELS
+
+# Extra steps added by refinement per round ('adaptive_batch' in the config)
+ADAPTIVE_BATCH = 8
+# Points closer than this (as a fraction of each varied parameter's range) are
+# not split further ('adaptive_min_spacing')
+ADAPTIVE_MIN_SPACING = 1.0 / 64
+ADAPTIVE_METRICS = ('amp', 'rms', 'std')
+
+
+def params_array(steps):
+    """(n, 9) float array of step dicts in PARAM_COLUMNS order; missing values are 0"""
+    keys = [c.split('_') for c in PARAM_COLUMNS]
+    return np.array([[float(step.get(ch, {}).get(p, 0.0) or 0.0) for ch, p in keys] for step in steps],
+                    dtype=np.float64).reshape(-1, len(PARAM_COLUMNS))
+
+
+def array_steps(array):
+    """(n, 9) array -> config step dicts"""
+    steps = []
+    for row in np.asarray(array, dtype=np.float64).tolist():
+        step = {}
+        for key, value in zip(PARAM_COLUMNS, row):
+            ch, p = key.split('_')
+            step.setdefault(ch, {})[p] = value
+        steps.append(step)
+    return steps
+
+
+def response_metric(summary, metric='amp'):
+    """Scalar response of one step from its reduction summary (see StepReducer).
+
+    'amp': slow-time amplitude at the drive frequencies, averaged over the
+    fibre and the driven channels; 'rms': mean RMS trace; 'std': mean
+    standard deviation over time. NaN if the step has no usable data.
+    """
+    with np.errstate(all='ignore'):
+        if metric == 'amp':
+            values = np.asarray(summary['amp'], dtype=np.float64)
+        elif metric == 'rms':
+            values = np.asarray(summary['rms'], dtype=np.float64)
+        elif metric == 'std':
+            values = np.sqrt(np.asarray(summary['var'], dtype=np.float64))
+        else:
+            raise ValueError(f"Unknown adaptive metric {metric!r}, expected one of {ADAPTIVE_METRICS}")
+        values = values[np.isfinite(values)]
+        return float(values.mean()) if values.size else float('nan')
+
+
+class ResponseCollector:
+    """Step pipeline handler that records the response metric of every finished step.
+
+    Added after StepReducer, it reads the summary that was just written;
+    without 'reduce' it runs the reduction itself and keeps only the metric.
+    """
+
+    def __init__(self, base_config, metric='amp'):
+        self.metric = metric
+        self.reducer = StepReducer.from_config(base_config)
+        self.responses = {}  # counter -> (params row, response)
+        self._lock = threading.Lock()
+
+    def __call__(self, counter, step_dir, config):
+        path = summary_path(step_dir)
+        if os.path.exists(path):
+            with np.load(path) as summary:
+                value = response_metric(summary, self.metric)
+        else:
+            freqs = [config.get(ch, {}).get('f', 0.0) for ch in CHANNELS]
+            value = response_metric(self.reducer.reduce_dir(step_dir, freqs), self.metric)
+        with self._lock:
+            self.responses[counter] = (params_array([config])[0], value)
+
+    def results(self):
+        with self._lock:
+            items = [self.responses[c] for c in sorted(self.responses)]
+        if not items:
+            return np.zeros((0, len(PARAM_COLUMNS))), np.zeros(0)
+        return np.array([p for p, _ in items]), np.array([v for _, v in items])
+
+
+class AdaptiveRefiner:
+    """Adds steps where the measured response changes most, within a step budget.
+
+    After each pass, every measured point is joined to its nearest neighbours
+    in the space of the varied parameters, each scaled to its range in the
+    coarse sweep. A joining segment scores sqrt(length^2 + change^2), the
+    change in response scaled to its range (the usual loss of adaptive 1-D
+    sampling), so steep parts are split first while long flat gaps are not
+    ignored for ever. The midpoints of the best segments become the next
+    steps; segments shorter than twice min_spacing are not split.
+    """
+
+    def __init__(self, base_config, coarse_steps, collector, budget, batch=ADAPTIVE_BATCH,
+                 min_spacing=ADAPTIVE_MIN_SPACING):
+        self.base_config = base_config
+        self.collector = collector
+        self.budget = int(budget)
+        self.batch = max(int(batch), 1)
+        self.min_spacing = float(min_spacing)
+        self.added = 0
+        self.rounds = []
+        coarse = params_array(coarse_steps)
+        if len(coarse):
+            low, high = coarse.min(axis=0), coarse.max(axis=0)
+        else:
+            low = high = np.zeros(len(PARAM_COLUMNS))
+        # Only the parameters the coarse sweep varies are refined
+        self.axes = np.flatnonzero(high > low)
+        self.low = low[self.axes]
+        self.span = (high - low)[self.axes]
+        self.pending = np.zeros((0, len(PARAM_COLUMNS)))
+
+    @classmethod
+    def from_config(cls, base_config, coarse_steps):
+        """None unless 'adaptive_budget' asks for extra steps"""
+        budget = int(float(base_config.get('adaptive_budget', 0) or 0))
+        if budget <= 0:
+            return None
+        collector = ResponseCollector(base_config, base_config.get('adaptive_metric', 'amp'))
+        return cls(base_config, coarse_steps, collector, budget,
+                   base_config.get('adaptive_batch', ADAPTIVE_BATCH),
+                   base_config.get('adaptive_min_spacing', ADAPTIVE_MIN_SPACING))
+
+    @property
+    def remaining(self):
+        return self.budget - self.added
+
+    def _scaled(self, params):
+        return (params[:, self.axes] - self.low) / self.span
+
+    def candidates(self, params, responses):
+        """[(score, i, j)] for neighbouring measured points, best first"""
+        ok = np.isfinite(responses)
+        params, responses = params[ok], responses[ok]
+        n = len(params)
+        if n < 2 or not len(self.axes):
+            return [], params
+        x = self._scaled(params)
+        r_span = np.ptp(responses)
+        r = responses / r_span if r_span > 0 else np.zeros(n)
+        k = min(2 * len(self.axes), n - 1)
+        pairs = set()
+        for start in range(0, n, 512):
+            d2 = ((x[start:start + 512, None, :] - x[None, :, :]) ** 2).sum(axis=2)
+            for row, i in enumerate(range(start, min(start + 512, n))):
+                d2[row, i] = np.inf
+                for j in np.argpartition(d2[row], k - 1)[:k]:
+                    pairs.add((min(i, j), max(i, j)))
+        scored = []
+        for i, j in pairs:
+            length = np.sqrt(((x[i] - x[j]) ** 2).sum())
+            if length < 2 * self.min_spacing:
+                continue
+            scored.append((float(np.hypot(length, r[i] - r[j])), i, j))
+        scored.sort(reverse=True)
+        return scored, params
+
+    def propose(self):
+        """Next batch of steps (config step dicts), [] when the budget is spent or nothing is left to split"""
+        if self.remaining <= 0:
+            return []
+        params, responses = self.collector.results()
+        scored, params = self.candidates(params, responses)
+        taken = self._scaled(np.vstack([params, self.pending])) if len(params) else np.zeros((0, len(self.axes)))
+        new = []
+        for score, i, j in scored:
+            if len(new) >= min(self.batch, self.remaining):
+                break
+            mid = np.round((params[i] + params[j]) / 2.0, 4)  # the device takes 4 decimals
+            scaled = self._scaled(mid[None, :])
+            if len(taken) and ((taken - scaled) ** 2).sum(axis=1).min() < (self.min_spacing / 2) ** 2:
+                continue  # already measured or proposed
+            taken = np.vstack([taken, scaled])
+            new.append(mid)
+        if not new:
+            return []
+        new = np.array(new)
+        self.pending = np.vstack([self.pending, new])
+        self.added += len(new)
+        self.rounds.append({'round': len(self.rounds) + 1, 'steps': len(new),
+                            'measured': int(np.isfinite(responses).sum())})
+        steps = array_steps(new)
+        for step in steps:
+            step['adaptive_round'] = len(self.rounds)
+        return steps
+
+    def save(self, path):
+        """Measured points and responses with the refinement rounds, for plotting the sweep"""
+        params, responses = self.collector.results()
+        data = {
+            'metric': self.collector.metric,
+            'budget': self.budget,
+            'added': self.added,
+            'varied': [PARAM_COLUMNS[a] for a in self.axes],
+            'rounds': self.rounds,
+            'points': [dict(zip(PARAM_COLUMNS, p), response=None if not np.isfinite(v) else v)
+                       for p, v in zip(params.tolist(), responses.tolist())],
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
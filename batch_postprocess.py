@@ -0,0 +1,194 @@
+import csv
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import numpy as np
+
+from das_capture import capture_layout, list_captures, open_capture
+from repeat_stacking import STACK_MEAN, has_stack, open_stack, stack_file
+from step_manifest import read_manifest
+
+# {counter} {prefix} f=..., v=..., b=...[ {hash[:8]}]  as created by run_piezo_experiment;
+# only used for folders of old runs that have no manifest
+STEP_FOLDER_RE = re.compile(r'^(\d+) (.*) f=([^,]+), v=([^,]+), b=(.+?)(?: [0-9a-f]{8})?$')
+
+TABLE_COLUMNS = ['step', 'folder', 'f', 'v', 'b', 'file', 'n_traces',
+                 'mean', 'std', 'rms', 'peak_hz', 'peak_amp', 'amp_at_f']
+
+
+def find_step_folders(prefix_dir):
+    """Step folders of a sweep as (counter, folder, {'f','v','b'}, data folder), ordered by counter.
+
+    The step and its channel 1 parameters come from the step manifest, the
+    folder name is only parsed for folders without one. The data folder is
+    the one holding the step's captures: a reused step's manifest points at
+    the earlier result it took over.
+    """
+    steps = []
+    for name in os.listdir(prefix_dir):
+        if not os.path.isdir(os.path.join(prefix_dir, name)):
+            continue
+        manifest = read_manifest(os.path.join(prefix_dir, name))
+        if manifest is not None and 'step' in manifest:
+            ch1 = manifest.get('params', {}).get('ch1', {})
+            try:
+                params = {p: float(ch1.get(p, 0.0) or 0.0) for p in ('f', 'v', 'b')}
+            except (TypeError, ValueError):
+                continue
+            steps.append((int(manifest['step']), name, params, manifest.get('reused_from') or name))
+            continue
+        match = STEP_FOLDER_RE.match(name)
+        if match:
+            counter, _, f_, v, b = match.groups()
+            try:
+                params = {'f': float(f_), 'v': float(v), 'b': float(b)}
+            except ValueError:
+                continue
+            steps.append((int(counter), name, params, name))
+    steps.sort(key=lambda s: (s[0], s[1]))
+    return steps
+
+
+def step_sources(step_dir):
+    """(path, index, bytes) per capture of a step folder.
+
+    index is None for a capture file, else the file's row in the stacked mean
+    of a repeated step and path the step folder.
+    """
+    if has_stack(step_dir):
+        nfiles = open_stack(step_dir)[0].shape[0]
+        size = os.path.getsize(stack_file(step_dir, STACK_MEAN)) // max(nfiles, 1)
+        return [(step_dir, index, size) for index in range(nfiles)]
+    return [(path, None, os.path.getsize(path)) for path in list_captures(step_dir)]
+
+
+def _pad_rows(rows):
+    """rows as one float32 array, shorter rows padded with NaN"""
+    width = max((len(r) for r in rows), default=0)
+    out = np.full((len(rows), width), np.nan, dtype=np.float32)
+    for i, r in enumerate(rows):
+        out[i, :len(r)] = r
+    return out
+
+
+def _block_mean(values, factor):
+    """Downsample a 1-D array by averaging consecutive blocks of factor samples."""
+    if factor <= 1:
+        return values
+    n = len(values) // factor * factor
+    return values[:n].reshape(-1, factor).mean(axis=1)
+
+
+def process_file(task):
+    """Per-file work: decode, average, slow-time spectrum and downsampling.
+
+    Runs in a worker process; task is (key, step, folder, params, (path, index, bytes), options)
+    with index the row of a stacked mean (see step_sources).
+    """
+    key, step, folder, params, (path, index, _), opts = task
+    if index is None:
+        data = open_capture(path, opts['line_length'], opts['dtype'])
+        name = os.path.basename(path)
+    else:
+        data = open_stack(path)[0][index]
+        name = f'{STACK_MEAN}[{index}]'
+    n, samples = data.shape
+    row = {'step': step, 'folder': folder, 'file': name, 'n_traces': n, **params}
+    n_bins = opts['spectrum_bins']
+    if n == 0:
+        row.update(mean=np.nan, std=np.nan, rms=np.nan, peak_hz=np.nan, peak_amp=np.nan, amp_at_f=np.nan)
+        return row, np.full(samples // max(opts['decimate'], 1), np.nan), np.full(n_bins, np.nan), key
+    mean_trace = np.zeros(samples)
+    spectrum = np.zeros(n // 2 + 1)
+    sumsq = 0.0
+    # Positions in blocks so a 10000-trace file never needs more than a few MB of floats
+    for start in range(0, samples, opts['position_block']):
+        block = np.asarray(data[:, start:start + opts['position_block']], dtype=np.float32)
+        m = block.mean(axis=0)
+        mean_trace[start:start + block.shape[1]] = m
+        sumsq += float(np.einsum('ij,ij->', block, block, dtype=np.float64))
+        spectrum += np.abs(np.fft.rfft(block - m, axis=0)).sum(axis=1)
+    spectrum *= 2.0 / (n * samples)
+    freqs = np.fft.rfftfreq(n, d=1.0 / opts['trace_rate'])
+    peak = int(np.argmax(spectrum[1:]) + 1) if len(spectrum) > 1 else 0
+    f_drive = params.get('f', 0.0)
+    amp_at_f = float(np.interp(f_drive, freqs, spectrum)) if f_drive > 0 else np.nan
+    overall_mean = float(mean_trace.mean())
+    rms = float(np.sqrt(sumsq / (n * samples)))
+    row.update(mean=overall_mean, std=float(np.sqrt(max(rms ** 2 - overall_mean ** 2, 0.0))), rms=rms,
+               peak_hz=float(freqs[peak]), peak_amp=float(spectrum[peak]), amp_at_f=amp_at_f)
+    # Spectrum resampled onto a fixed number of bins so files with different nrefls stack
+    grid = np.linspace(0.0, opts['trace_rate'] / 2.0, n_bins)
+    return row, _block_mean(mean_trace, opts['decimate']), np.interp(grid, freqs, spectrum), key
+
+
+def postprocess_sweep(prefix_dir, config, out_path=None, workers=None, chunksize=None,
+                      decimate=10, spectrum_bins=512, progress=True):
+    """Process every capture of a finished sweep in a process pool.
+
+    Writes {out_path}.csv (one row per file) and {out_path}.npz (downsampled mean
+    traces and spectra, in table order). A repeated step gives one row per file
+    of its stacked mean. Returns the list of table rows.
+    """
+    line_length, dtype, trace_rate = capture_layout(config)
+    opts = {'line_length': line_length, 'dtype': dtype.str, 'trace_rate': trace_rate,
+            'decimate': decimate, 'spectrum_bins': spectrum_bins, 'position_block': 64}
+    sources = [(step, folder, params, source)
+               for step, folder, params, data_folder in find_step_folders(prefix_dir)
+               for source in step_sources(os.path.join(prefix_dir, data_folder))]
+    tasks = [(key, *item, opts) for key, item in enumerate(sources)]
+    if out_path is None:
+        out_path = os.path.join(prefix_dir, 'postprocess')
+    workers = workers or os.cpu_count() or 1
+    # A few chunks per worker keeps all cores busy without per-file IPC overhead
+    chunksize = chunksize or max(1, len(tasks) // (workers * 4))
+    results = [None] * len(tasks)
+    total_bytes = sum(t[4][2] for t in tasks)
+    done_bytes = 0
+    t0 = time.monotonic()
+    with multiprocessing.Pool(workers) as pool:
+        for done, (row, trace, spectrum, key) in enumerate(
+                pool.imap_unordered(process_file, tasks, chunksize=chunksize), 1):
+            results[key] = (row, trace, spectrum)
+            done_bytes += tasks[key][4][2]
+            if progress:
+                elapsed = max(time.monotonic() - t0, 1e-9)
+                sys.stdout.write(f'\r[postprocess] {done}/{len(tasks)} files, '
+                                 f'{done / elapsed:.1f} files/s, {done_bytes / elapsed / 1e6:.1f} MB/s '
+                                 f'({done_bytes / max(total_bytes, 1):.0%})')
+                sys.stdout.flush()
+    if progress and tasks:
+        sys.stdout.write('\n')
+    rows = [r[0] for r in results]
+    with open(out_path + '.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    if results:
+        np.savez(out_path + '.npz',
+                 steps=np.array([r['step'] for r in rows]),
+                 mean_traces=_pad_rows([r[1] for r in results]),
+                 spectra=_pad_rows([r[2] for r in results]),
+                 spectrum_freqs=np.linspace(0.0, trace_rate / 2.0, spectrum_bins))
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Post-process a finished sweep folder in parallel.')
+    parser.add_argument('prefix_dir', help='Sweep folder containing the "{counter} {prefix} f=..." step folders')
+    parser.add_argument('--config', default='config.json', help='Config used for the sweep (capture layout)')
+    parser.add_argument('--out', help='Output path without extension (default: <prefix_dir>/postprocess)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: all cores)')
+    parser.add_argument('--chunksize', type=int, help='Files per scheduling chunk')
+    parser.add_argument('--decimate', type=int, default=10, help='Mean trace downsampling factor')
+    parser.add_argument('--bins', type=int, default=512, help='Spectrum bins in the output')
+    args = parser.parse_args()
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    rows = postprocess_sweep(args.prefix_dir, config, args.out, args.workers, args.chunksize,
+                             args.decimate, args.bins)
+    print(f'[postprocess] {len(rows)} files from {len({r["step"] for r in rows})} steps')
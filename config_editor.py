@@ -1,42 +1,82 @@
 import sys
-import json
 import threading
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QLabel, QDoubleSpinBox, QComboBox, 
                             QGroupBox, QLineEdit, QGridLayout, QFrame, QScrollArea, QPushButton, QFormLayout,
-                            QTextEdit, QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView, QSizePolicy)
+                            QTextEdit, QTableView, QAbstractItemView, QHeaderView, QSizePolicy,
+                            QFileDialog, QMessageBox, QCheckBox)
 from PyQt5.QtCore import Qt, QSettings, QThread, pyqtSignal
 from PyQt5.QtGui import QFont, QIcon, QColor
 from piezo_control_service import run_piezo_experiment
+from step_model import StepTableModel, STEP_COLUMNS, PARAM_KEYS, encode_steps, save_steps, load_steps
+from sweep_generator import SweepGeneratorDialog
+from config_store import ConfigStore
+from progress_dashboard import ProgressDashboard
+from sweep_progress import EventThrottle
+from waterfall_preview import PreviewWorker, WaterfallView
+from preflight import run_preflight
+from pztlibrary.port_discovery import discover, find_controller
+from serial.tools import list_ports
+import logging
 import os
 
+log = logging.getLogger('pzt.editor')
+
+
 class ExperimentThread(QThread):
     finished = pyqtSignal()
     error = pyqtSignal(str)
+    # Batches of SweepProgress events, delivered at most every PROGRESS_INTERVAL seconds
+    progress = pyqtSignal(list)
+
+    PROGRESS_INTERVAL = 0.2
 
-    def __init__(self, sleep_time=1.0, stop_event=None):
+    def __init__(self, sleep_time=1.0, stop_event=None, profile=False, incremental=False):
         super().__init__()
         self.sleep_time = sleep_time
         self.stop_event = stop_event
+        self.profile = profile
+        self.incremental = incremental
+        self._progress_throttle = EventThrottle(self.progress.emit, self.PROGRESS_INTERVAL)
 
     def run(self):
         try:
-            run_piezo_experiment(sleep_time=self.sleep_time, stop_event=self.stop_event)
+            run_piezo_experiment(sleep_time=self.sleep_time, stop_event=self.stop_event,
+                                 progress=self._progress_throttle, profile=self.profile,
+                                 incremental=self.incremental)
+            self._progress_throttle.flush()
             self.finished.emit()
         except Exception as e:
+            self._progress_throttle.flush()
             self.error.emit(str(e))
 
+class PortDiscoveryThread(QThread):
+    """Probes all serial ports in parallel off the GUI thread."""
+    found = pyqtSignal(object, list)  # controller port (or None), probe results
+
+    def run(self):
+        port = find_controller()
+        self.found.emit(port, discover() if port is None else [])
+
+class PreflightThread(QThread):
+    """Runs the pre-flight check (including the port probe) off the GUI thread."""
+    done = pyqtSignal(object)  # PreflightReport, or the exception that stopped the check
+
+    def __init__(self, config, sleep_time):
+        super().__init__()
+        self.config = config
+        self.sleep_time = sleep_time
+
+    def run(self):
+        try:
+            self.done.emit(run_preflight(self.config, self.sleep_time))
+        except Exception as e:
+            self.done.emit(e)
+
 class ConfigEditor(QMainWindow):
     INIT_KEYS = ["Ng", "line_length", "len_udp_pack", "freq_send_data", "pulse_width"]
 
-    STEP_COLUMNS = [
-        ("step", "Step"),
-        ("ch1_v", "Ch1 V"), ("ch1_b", "Ch1 B"), ("ch1_f", "Ch1 F"),
-        ("spacer1", ""),
-        ("ch2_v", "Ch2 V"), ("ch2_b", "Ch2 B"), ("ch2_f", "Ch2 F"),
-        ("spacer2", ""),
-        ("ch3_v", "Ch3 V"), ("ch3_b", "Ch3 B"), ("ch3_f", "Ch3 F")
-    ]
+    STEP_COLUMNS = STEP_COLUMNS
 
     def __init__(self):
         super().__init__()
@@ -46,6 +86,8 @@ class ConfigEditor(QMainWindow):
         self.default_font = QFont("Segoe UI", 12)
         self.header_font = QFont("Segoe UI", 14, QFont.Bold)
         self.section_font = QFont("Segoe UI", 12, QFont.Bold)
+        # All config.json access goes through one in-memory store with debounced, atomic writes
+        self.config_store = ConfigStore('config.json', encoders={'steps': encode_steps})
 
         # Extended dark/gray modern stylesheet
         self.setStyleSheet('''
@@ -220,10 +262,11 @@ class ConfigEditor(QMainWindow):
         btn_layout.addWidget(self.move_down_btn)
         btn_layout.addStretch()
         step_layout.addLayout(btn_layout)
-        # Step Table
-        self.step_table = QTableWidget()
-        self.step_table.setColumnCount(len(self.STEP_COLUMNS))
-        self.step_table.setHorizontalHeaderLabels([label for _, label in self.STEP_COLUMNS])
+        # Step Table (model/view: values live in one numeric array, styling comes from data roles)
+        self._loading = False
+        self.step_model = StepTableModel(self)
+        self.step_table = QTableView()
+        self.step_table.setModel(self.step_model)
         self.step_table.setEditTriggers(QAbstractItemView.DoubleClicked | QAbstractItemView.SelectedClicked | QAbstractItemView.EditKeyPressed)
         self.step_table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.step_table.setSelectionMode(QAbstractItemView.SingleSelection)
@@ -239,18 +282,11 @@ class ConfigEditor(QMainWindow):
                 self.step_table.setColumnWidth(col, 110)
         self.step_table.horizontalHeader().setStretchLastSection(False)
         self.step_table.verticalHeader().setVisible(False)
+        # Fixed row height: the view never measures rows, which keeps 100k steps responsive
+        self.step_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.step_table.verticalHeader().setDefaultSectionSize(36)
         self.step_table.setAlternatingRowColors(True)
-        # Tooltips for headers
-        for col, (key, label) in enumerate(self.STEP_COLUMNS):
-            if key == "step":
-                tip = "Step number (auto)"
-            elif key.startswith("spacer"):
-                tip = ""
-            else:
-                ch, param = key.split('_')
-                tip = f"Channel {ch[-1]} {param.upper()}"
-            self.step_table.horizontalHeaderItem(col).setToolTip(tip)
-        self.step_table.itemChanged.connect(self.save_config)
+        self.step_model.stepsChanged.connect(self.save_config)
         self.step_table.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         step_layout.addWidget(self.step_table)
         step_group.setLayout(step_layout)
@@ -267,7 +303,8 @@ class ConfigEditor(QMainWindow):
         self.wave_combo.setFont(self.default_font)
         self.wave_combo.setMinimumHeight(38)
         self.wave_combo.setFixedWidth(140)
-        self.wave_combo.addItems(['Z', 'S', 'T'])
+        # Waveforms the device accepts: sine, square, triangle, sawtooth
+        self.wave_combo.addItems(['Z', 'F', 'S', 'J'])
         self.wave_combo.setToolTip("Select the waveform type for the experiment.")
         self.wave_combo.currentTextChanged.connect(self.save_config)
         self.step_table.horizontalHeader().setStyleSheet('''
@@ -281,7 +318,7 @@ class ConfigEditor(QMainWindow):
             }
         ''')
         self.step_table.setStyleSheet('''
-            QTableWidget {
+            QTableView {
                 background: #23272e;
                 color: #e0e6f0;
                 gridline-color: #3a3f4b;
@@ -290,13 +327,12 @@ class ConfigEditor(QMainWindow):
                 alternate-background-color: #262b33;
                 font-size: 15px;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background: #4f8cff;
                 color: #fff;
             }
         ''')
         self.step_table.setAlternatingRowColors(True)
-        self.step_table.itemChanged.connect(self.save_config)
         step_layout.addWidget(self.step_table)
         # Buttons for add/remove/move
         btn_layout = QHBoxLayout()
@@ -333,11 +369,23 @@ class ConfigEditor(QMainWindow):
         self.move_down_btn = QPushButton("Move Down")
         self.move_down_btn.setStyleSheet(button_style)
         self.move_down_btn.clicked.connect(self.move_step_down)
+        self.generate_btn = QPushButton("Generate...")
+        self.generate_btn.setStyleSheet(button_style)
+        self.generate_btn.clicked.connect(self.generate_steps)
+        self.import_btn = QPushButton("Import...")
+        self.import_btn.setStyleSheet(button_style)
+        self.import_btn.clicked.connect(self.import_steps)
+        self.export_btn = QPushButton("Export...")
+        self.export_btn.setStyleSheet(button_style)
+        self.export_btn.clicked.connect(self.export_steps)
         btn_layout.addWidget(self.add_step_btn)
         btn_layout.addWidget(self.remove_step_btn)
         btn_layout.addWidget(self.move_up_btn)
         btn_layout.addWidget(self.move_down_btn)
         btn_layout.addStretch()
+        btn_layout.addWidget(self.generate_btn)
+        btn_layout.addWidget(self.import_btn)
+        btn_layout.addWidget(self.export_btn)
         step_layout.addLayout(btn_layout)
         step_group.setLayout(step_layout)
         main_layout.addWidget(step_group)
@@ -353,7 +401,8 @@ class ConfigEditor(QMainWindow):
         self.wave_combo.setFont(self.default_font)
         self.wave_combo.setMinimumHeight(38)
         self.wave_combo.setFixedWidth(140)
-        self.wave_combo.addItems(['Z', 'S', 'T'])
+        # Waveforms the device accepts: sine, square, triangle, sawtooth
+        self.wave_combo.addItems(['Z', 'F', 'S', 'J'])
         self.wave_combo.setToolTip("Select the waveform type for the experiment.")
         self.wave_combo.currentTextChanged.connect(self.save_config)
         wave_layout.addWidget(QLabel("Type:"))
@@ -390,10 +439,16 @@ class ConfigEditor(QMainWindow):
         self.port_input.setFont(self.default_font)
         self.port_input.setMinimumHeight(38)
         self.port_input.setFixedWidth(180)
-        self.port_input.setToolTip("Serial port for the experiment (e.g., COM4, /dev/ttyUSB0)")
+        self.port_input.setToolTip("Serial port for the experiment (e.g., COM4, /dev/ttyUSB0), "
+                                   "or 'auto' to find the controller at start")
         self.port_input.textChanged.connect(self.save_config)
+        self.detect_port_btn = QPushButton("Detect")
+        self.detect_port_btn.setToolTip("Probe all serial ports for the piezo controller")
+        self.detect_port_btn.clicked.connect(self.detect_port)
+        self.port_discovery = None
         port_layout.addWidget(QLabel("Port:"))
         port_layout.addWidget(self.port_input)
+        port_layout.addWidget(self.detect_port_btn)
         port_layout.addStretch()
         port_group.setLayout(port_layout)
         main_layout.addWidget(port_group)
@@ -405,13 +460,33 @@ class ConfigEditor(QMainWindow):
         self.stop_button = QPushButton("Stop Experiment")
         self.stop_button.clicked.connect(self.on_stop_experiment)
         self.stop_button.setEnabled(False)
+        self.profile_checkbox = QCheckBox("Profile run")
+        self.profile_checkbox.setToolTip("Write cProfile, thread stack samples and top allocations "
+                                         "to a profile_<time> folder in the run folder")
+        self.incremental_checkbox = QCheckBox("Only new/changed steps")
+        self.incremental_checkbox.setToolTip("Reuse valid results of earlier runs under the same prefix for steps "
+                                             "whose parameters, INIT and acquisition settings are unchanged")
         self.status_label = QLabel("")
         self.status_label.setFont(self.default_font)
         button_layout.addWidget(self.start_button)
         button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.profile_checkbox)
+        button_layout.addWidget(self.incremental_checkbox)
         button_layout.addWidget(self.status_label)
         button_layout.addStretch()
         main_layout.addLayout(button_layout)
+        self.progress_dashboard = ProgressDashboard()
+        self.progress_dashboard.setFont(self.section_font)
+        main_layout.addWidget(self.progress_dashboard)
+        # Live waterfall of the newest capture (decimated on a low-priority thread)
+        preview_group = QGroupBox("Live Preview")
+        preview_group.setFont(self.section_font)
+        preview_layout = QVBoxLayout()
+        self.waterfall = WaterfallView()
+        preview_layout.addWidget(self.waterfall)
+        preview_group.setLayout(preview_layout)
+        main_layout.addWidget(preview_group)
+        self.preview_worker = None
 
         # Ensure INIT and UDP_DAS params are present in config.json (import from INIT or set defaults if missing)
         self.ensure_init_params_in_config()
@@ -439,13 +514,15 @@ class ConfigEditor(QMainWindow):
         udp_group.setFont(self.section_font)
         udp_layout = QFormLayout()
         self.udp_param_widgets = {}
-        for key in ['dir', 'nfiles', 'nrefls']:
+        for key in ['dir', 'nfiles', 'nrefls', 'repeats']:
             widget = QLineEdit(str(self.udp_params.get(key, '')))
             widget.setFont(self.default_font)
             widget.setMinimumHeight(32)
             widget.editingFinished.connect(self.save_udp_params)
             udp_layout.addRow(QLabel(key), widget)
             self.udp_param_widgets[key] = widget
+        self.udp_param_widgets['repeats'].setToolTip("Acquisitions per step with the piezo state unchanged, "
+                                                     "stacked into one mean (1 = no stacking)")
         udp_group.setLayout(udp_layout)
         main_layout.addWidget(udp_group)
 
@@ -454,112 +531,76 @@ class ConfigEditor(QMainWindow):
         self.resize(1100, 1050)
 
     def add_step(self):
-        row = self.step_table.rowCount()
-        self.step_table.insertRow(row)
-        for col, (key, _) in enumerate(self.STEP_COLUMNS):
-            if key == "step":
-                item = QTableWidgetItem(str(row + 1))
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-            elif key.startswith("spacer"):
-                item = QTableWidgetItem("")
-                item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-            else:
-                item = QTableWidgetItem("")
-                item.setTextAlignment(Qt.AlignCenter)
-            self.step_table.setItem(row, col, item)
-        self.renumber_steps()
-        self.style_step_table()
-        self.save_config()
+        self.step_model.append_steps(count=1)
+        self.step_table.scrollToBottom()
 
     def remove_step(self):
-        row = self.step_table.currentRow()
+        row = self.step_table.currentIndex().row()
         if row >= 0:
-            self.step_table.removeRow(row)
-            self.renumber_steps()
-            self.style_step_table()
-            self.save_config()
+            self.step_model.removeRows(row, 1)
 
     def move_step_up(self):
-        row = self.step_table.currentRow()
+        row = self.step_table.currentIndex().row()
         if row > 0:
-            self.swap_rows(row, row - 1)
+            self.step_model.move_step(row, row - 1)
             self.step_table.selectRow(row - 1)
-            self.renumber_steps()
-            self.style_step_table()
-            self.save_config()
 
     def move_step_down(self):
-        row = self.step_table.currentRow()
-        if row < self.step_table.rowCount() - 1 and row >= 0:
-            self.swap_rows(row, row + 1)
+        row = self.step_table.currentIndex().row()
+        if row < self.step_model.rowCount() - 1 and row >= 0:
+            self.step_model.move_step(row, row + 1)
             self.step_table.selectRow(row + 1)
-            self.renumber_steps()
-            self.style_step_table()
-            self.save_config()
 
-    def swap_rows(self, row1, row2):
-        for col, (key, _) in enumerate(self.STEP_COLUMNS):
-            item1 = self.step_table.item(row1, col)
-            item2 = self.step_table.item(row2, col)
-            text1 = item1.text() if item1 else ""
-            text2 = item2.text() if item2 else ""
-            new_item1 = QTableWidgetItem(text2)
-            new_item2 = QTableWidgetItem(text1)
-            if key == "step":
-                new_item1.setFlags(new_item1.flags() & ~Qt.ItemIsEditable)
-                new_item2.setFlags(new_item2.flags() & ~Qt.ItemIsEditable)
-            elif key.startswith("spacer"):
-                new_item1.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-                new_item2.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-            else:
-                new_item1.setTextAlignment(Qt.AlignCenter)
-                new_item2.setTextAlignment(Qt.AlignCenter)
-            self.step_table.setItem(row1, col, new_item1)
-            self.step_table.setItem(row2, col, new_item2)
-        self.style_step_table()
-
-    def renumber_steps(self):
-        for row in range(self.step_table.rowCount()):
-            item = self.step_table.item(row, 0)
-            if not item:
-                item = QTableWidgetItem(str(row + 1))
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.step_table.setItem(row, 0, item)
-            else:
-                item.setText(str(row + 1))
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-        self.style_step_table()
+    def generate_steps(self):
+        dialog = SweepGeneratorDialog(self)
+        row = self.step_table.currentIndex().row()
+        if row >= 0:
+            dialog.set_base(dict(zip(PARAM_KEYS, self.step_model.array()[row])))
+        if dialog.exec_() != SweepGeneratorDialog.Accepted:
+            return
+        try:
+            steps = dialog.steps()
+        except ValueError as e:
+            QMessageBox.warning(self, "Generate Sweep", str(e))
+            return
+        if dialog.replace():
+            self.step_model.set_array(steps)
+        else:
+            self.step_model.append_steps(steps)
+        self.status_label.setText(f"Generated {len(steps)} steps")
+
+    def import_steps(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import Steps", "", "Steps (*.csv *.npy);;All files (*)")
+        if not path:
+            return
+        try:
+            steps = load_steps(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Import Steps", f"Could not read {path}:\n{e}")
+            return
+        self.step_model.set_array(steps)
+        self.status_label.setText(f"Imported {len(steps)} steps")
+
+    def export_steps(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Steps", "steps.csv", "CSV (*.csv);;NumPy (*.npy)")
+        if not path:
+            return
+        try:
+            save_steps(path, self.step_model.array())
+        except OSError as e:
+            QMessageBox.warning(self, "Export Steps", f"Could not write {path}:\n{e}")
+            return
+        self.status_label.setText(f"Exported {self.step_model.rowCount()} steps")
 
     def load_config(self):
         try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
+            config = self.config_store.data()
             # --- Load steps table ---
-            self.step_table.blockSignals(True)
-            self.step_table.setRowCount(0)
-            steps = config.get('steps', [])
-            for i, step in enumerate(steps):
-                row = self.step_table.rowCount()
-                self.step_table.insertRow(row)
-                for col, (key, _) in enumerate(self.STEP_COLUMNS):
-                    if key == "step":
-                        item = QTableWidgetItem(str(row + 1))
-                        item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                    elif key.startswith("spacer"):
-                        item = QTableWidgetItem("")
-                        item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-                    else:
-                        # Only split if not step or spacer
-                        if '_' in key:
-                            ch, param = key.split('_')
-                            value = step.get(ch, {}).get(param, "")
-                        else:
-                            value = ""
-                        item = QTableWidgetItem(str(value))
-                        item.setTextAlignment(Qt.AlignCenter)
-                    self.step_table.setItem(row, col, item)
-            self.step_table.blockSignals(False)
-            self.style_step_table()
+            self._loading = True
+            try:
+                self.step_model.set_steps(config.get('steps', []))
+            finally:
+                self._loading = False
             # --- Load other params ---
             if 'wave_type' in config:
                 self.wave_combo.setCurrentText(config['wave_type'])
@@ -567,51 +608,102 @@ class ConfigEditor(QMainWindow):
                 self.prefix_input.setText(config['prefix'])
             if 'port' in config:
                 self.port_input.setText(config['port'])
+            self.use_cached_port()
         except Exception as e:
-            print(f"Error loading configuration: {e}")
+            log.error('Error loading configuration: %s', e)
 
     def save_config(self):
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-        except Exception:
-            config = {}
-        # --- Save steps table ---
-        steps = []
-        for row in range(self.step_table.rowCount()):
-            step = {"ch1": {}, "ch2": {}, "ch3": {}}
-            for col, (key, _) in enumerate(self.STEP_COLUMNS):
-                if key == "step" or key.startswith("spacer"):
-                    continue
-                # Only split if not step or spacer
-                if '_' in key:
-                    ch, param = key.split('_')
-                    item = self.step_table.item(row, col)
-                    try:
-                        value = float(item.text()) if item and item.text().strip() != '' else 0.0
-                    except ValueError:
-                        value = 0.0
-                    step[ch][param] = value
-            steps.append(step)
-        config['steps'] = steps
-        config['wave_type'] = self.wave_combo.currentText()
-        config['prefix'] = self.prefix_input.text()
-        config['port'] = self.port_input.text()
-        try:
-            with open('config.json', 'w') as f:
-                json.dump(config, f, indent=4)
-        except Exception as e:
-            print(f"Error saving configuration: {e}")
+        if self._loading:
+            return
+        # Steps are handed over as an array snapshot plus their extra keys; the
+        # store turns them into JSON on its writer thread once edits settle
+        self.config_store.update({
+            'steps': self.step_model.snapshot(),
+            'wave_type': self.wave_combo.currentText(),
+            'prefix': self.prefix_input.text(),
+            'port': self.port_input.text(),
+        })
+
+    def detect_port(self):
+        self.detect_port_btn.setEnabled(False)
+        self.status_label.setText("Searching for the piezo controller...")
+        self.port_discovery = PortDiscoveryThread()
+        self.port_discovery.found.connect(self.on_port_detected)
+        self.port_discovery.start()
+
+    def on_port_detected(self, port, results):
+        self.detect_port_btn.setEnabled(True)
+        if port is not None:
+            self.port_input.setText(port)
+            self.status_label.setText(f"Piezo controller on {port}")
+        elif results:
+            self.status_label.setText("No controller answered on " + ", ".join(r['port'] for r in results))
+        else:
+            self.status_label.setText("No serial ports found")
+
+    def use_cached_port(self):
+        """If the configured port is gone, switch to the adapter known to be the controller (no probing)."""
+        port = self.port_input.text().strip()
+        if port.lower() == 'auto':
+            return
+        if port and port in {info.device for info in list_ports.comports()}:
+            return
+        cached = find_controller(probe=False)
+        if cached is not None and cached != port:
+            log.info('%s configured, using known controller on %s', port or 'No port', cached)
+            self.port_input.setText(cached)
 
     def on_start_experiment(self):
+        # The runner reads config.json itself, so pending edits must be on disk
+        self.config_store.flush()
         self.start_button.setEnabled(False)
+        self.status_label.setText("Checking sweep...")
+        self.preflight_thread = PreflightThread(self.config_store.data(), sleep_time=5.0)
+        self.preflight_thread.done.connect(self.on_preflight_done)
+        self.preflight_thread.start()
+
+    def on_preflight_done(self, report):
+        sleep_time = self.preflight_thread.sleep_time
+        self.status_label.setText("")
+        if not self.confirm_preflight(report):
+            self.start_button.setEnabled(True)
+            return
         self.stop_button.setEnabled(True)
         self.status_label.setText("Running...")
         self.stop_event = threading.Event()
-        self.thread = ExperimentThread(sleep_time=5.0, stop_event=self.stop_event)
+        self.thread = ExperimentThread(sleep_time=sleep_time, stop_event=self.stop_event,
+                                       profile=self.profile_checkbox.isChecked(),
+                                       incremental=self.incremental_checkbox.isChecked())
         self.thread.finished.connect(self.on_experiment_finished)
         self.thread.error.connect(self.on_experiment_error)
+        self.thread.progress.connect(self.progress_dashboard.on_events)
         self.thread.start()
+        self.start_preview()
+
+    def confirm_preflight(self, report):
+        """Errors of the pre-flight check block the run, otherwise ask."""
+        if isinstance(report, Exception):
+            QMessageBox.critical(self, "Pre-flight Check", f"The sweep could not be checked:\n\n{report}")
+            return False
+        if not report.ok:
+            QMessageBox.critical(self, "Pre-flight Check", "The sweep cannot run:\n\n" + report.summary())
+            return False
+        answer = QMessageBox.question(self, "Pre-flight Check", report.summary() + "\n\nStart the experiment?",
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        return answer == QMessageBox.Yes
+
+    def start_preview(self):
+        self.stop_preview()
+        self.waterfall.clear()
+        self.preview_worker = PreviewWorker(self.config_store.data())
+        self.preview_worker.frame.connect(self.waterfall.add_rows)
+        self.preview_worker.start()
+
+    def stop_preview(self):
+        if self.preview_worker is not None:
+            self.preview_worker.stop()
+            self.preview_worker.wait()
+            self.preview_worker = None
 
     def on_stop_experiment(self):
         if hasattr(self, 'stop_event') and self.stop_event is not None:
@@ -620,67 +712,38 @@ class ConfigEditor(QMainWindow):
         self.stop_button.setEnabled(False)
 
     def on_experiment_finished(self):
+        self.stop_preview()
         self.status_label.setText("Finished")
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
 
     def on_experiment_error(self, msg):
+        self.stop_preview()
         self.status_label.setText(f"Error: {msg}")
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
 
     def load_init_param_from_config(self, key):
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-            return config.get(key, '')
-        except Exception:
-            return ''
+        return self.config_store.get(key, '')
 
     def save_init_params(self):
         # Save to config.json and INIT file (always keep in sync)
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-        except Exception:
-            config = {}
-        for k, w in self.init_param_widgets.items():
-            config[k] = w.text()
-        with open('config.json', 'w') as f:
-            json.dump(config, f, indent=4)
-        # Also sync to INIT file
-        with open('INIT', 'w') as f:
+        self.config_store.update({k: w.text() for k, w in self.init_param_widgets.items()})
+        tmp_path = 'INIT.tmp'
+        with open(tmp_path, 'w') as f:
             for k in self.INIT_KEYS:
                 v = self.init_param_widgets[k].text()
                 f.write(f'{k} = {v}\n')
+        os.replace(tmp_path, 'INIT')
 
     def load_udp_params(self):
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-            return {k: config.get(k, '') for k in ['dir', 'nfiles', 'nrefls']}
-        except Exception:
-            return {'dir': '', 'nfiles': '', 'nrefls': ''}
+        return {k: self.config_store.get(k, '') for k in ['dir', 'nfiles', 'nrefls', 'repeats']}
 
     def save_udp_params(self):
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-        except Exception:
-            config = {}
-        for k, w in self.udp_param_widgets.items():
-            config[k] = w.text()
-        with open('config.json', 'w') as f:
-            json.dump(config, f, indent=4)
+        self.config_store.update({k: w.text() for k, w in self.udp_param_widgets.items()})
 
     def ensure_init_params_in_config(self):
         """Ensure all INIT_KEYS are present in config.json, importing from INIT file if missing."""
-        config = {}
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-        except Exception:
-            config = {}
         # Read INIT file if present
         init_values = {}
         if os.path.exists('INIT'):
@@ -689,67 +752,29 @@ class ConfigEditor(QMainWindow):
                     if '=' in line:
                         k, v = line.strip().split('=', 1)
                         init_values[k.strip()] = v.strip()
-        changed = False
-        for k in self.INIT_KEYS:
-            if k not in config or config[k] == '':
-                config[k] = init_values.get(k, '')
-                changed = True
-        if changed:
-            with open('config.json', 'w') as f:
-                json.dump(config, f, indent=4)
+        missing = {k: init_values.get(k, '') for k in self.INIT_KEYS
+                   if self.config_store.get(k, '') == ''}
+        if missing:
+            self.config_store.update(missing)
 
     def ensure_udp_params_in_config(self):
         """Ensure UDP_DAS params are present in config.json, set defaults if missing."""
-        config = {}
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-        except Exception:
-            config = {}
-        defaults = {'dir': 'refls1', 'nfiles': 3, 'nrefls': 10000}
-        changed = False
-        for k, v in defaults.items():
-            if k not in config or config[k] == '':
-                config[k] = v
-                changed = True
-        if changed:
-            with open('config.json', 'w') as f:
-                json.dump(config, f, indent=4)
-
-    def style_step_table(self):
-        # Define colors for each channel group
-        ch1_bg = QColor('#232b36')  # blueish dark
-        ch2_bg = QColor('#233026')  # greenish dark
-        ch3_bg = QColor('#2b2323')  # reddish dark
-        step_bg = QColor('#22232a')  # Step column
-        spacer_bg = QColor('#18191c')
-        for row in range(self.step_table.rowCount()):
-            for col, (key, _) in enumerate(self.STEP_COLUMNS):
-                item = self.step_table.item(row, col)
-                if not item:
-                    continue
-                # Step column
-                if key == 'step':
-                    item.setBackground(step_bg)
-                    item.setForeground(QColor('#b0b0b0'))
-                    item.setFont(QFont("Segoe UI", 13, QFont.Bold))
-                elif key.startswith('spacer'):
-                    item.setBackground(spacer_bg)
-                    item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-                # Channel 1
-                elif key.startswith('ch1_'):
-                    item.setBackground(ch1_bg)
-                # Channel 2
-                elif key.startswith('ch2_'):
-                    item.setBackground(ch2_bg)
-                # Channel 3
-                elif key.startswith('ch3_'):
-                    item.setBackground(ch3_bg)
+        defaults = {'dir': 'refls1', 'nfiles': 3, 'nrefls': 10000, 'repeats': 1}
+        missing = {k: v for k, v in defaults.items() if self.config_store.get(k, '') == ''}
+        if missing:
+            self.config_store.update(missing)
+
+    def closeEvent(self, event):
+        self.stop_preview()
+        self.config_store.close()
+        super().closeEvent(event)
 
 # Force Fusion style for full dark theme support
 if __name__ == '__main__':
     from PyQt5.QtWidgets import QApplication
     import sys
+    from pztlibrary.log_pipeline import configure_logging
+    configure_logging()
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
     window = ConfigEditor()
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger('pzt.config')
+
+
+def dump_config(config, f):
+    """Write config as indented JSON with one step per line.
+
+    Indenting every value of a large 'steps' list makes the file megabytes long
+    and forces the slow pure-Python encoder; steps on single lines keep the file
+    readable and let the C encoder do the work.
+    """
+    f.write('{\n')
+    items = list(config.items())
+    for i, (key, value) in enumerate(items):
+        f.write(f'    {json.dumps(key)}: ')
+        if key == 'steps' and isinstance(value, list):
+            if value:
+                f.write('[\n')
+                f.write(',\n'.join('        ' + json.dumps(step) for step in value))
+                f.write('\n    ]')
+            else:
+                f.write('[]')
+        else:
+            f.write(json.dumps(value, indent=4).replace('\n', '\n    '))
+        f.write(',\n' if i < len(items) - 1 else '\n')
+    f.write('}\n')
+
+
+class ConfigStore:
+    """Single owner of config.json for the GUI.
+
+    Holds the config in memory, notifies listeners on every change and writes the
+    file on a background timer once changes stop arriving for `debounce` seconds,
+    so a burst of edits costs one write. Writes go to a temporary file that is
+    then renamed over config.json, so readers never see a partial file.
+
+    encoders maps a key to a function turning the stored value into its JSON form
+    at write time (e.g. a steps array into a list of dicts), off the caller's thread.
+    """
+
+    def __init__(self, path='config.json', debounce=0.5, encoders=None):
+        self.path = path
+        self.debounce = debounce
+        self.encoders = dict(encoders or {})
+        self._data = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """(Re)read the file; a missing or broken file gives an empty config."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                data = {}
+        except (OSError, ValueError):
+            data = {}
+        with self._lock:
+            self._data = data
+        return data
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def data(self):
+        """Shallow copy of the current config in its JSON form (encoders applied)."""
+        with self._lock:
+            snapshot = dict(self._data)
+        return self._encode(snapshot)
+
+    def _encode(self, snapshot):
+        for key, encode in self.encoders.items():
+            if key in snapshot:
+                snapshot[key] = encode(snapshot[key])
+        return snapshot
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def add_listener(self, callback):
+        """callback(changed) is called with a dict of the changed keys and values."""
+        self._listeners.append(callback)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        with self._lock:
+            self._data.update(values)
+            self._dirty = True
+            self._schedule()
+        for callback in self._listeners:
+            callback(values)
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.debounce, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Write pending changes now (no-op when nothing changed)."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                snapshot = dict(self._data)
+                self._dirty = False
+            snapshot = self._encode(snapshot)
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    dump_config(snapshot, f)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                log.error('Error saving configuration: %s', e)
+
+    def close(self):
+        self.flush()
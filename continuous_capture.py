@@ -0,0 +1,223 @@
+import json
+import math
+import os
+import time
+import numpy as np
+
+from das_capture import capture_layout, expected_capture_size, list_captures, open_capture, file_checksum
+from step_manifest import write_manifest
+
+# Side channel written next to the stream: one JSON object per line,
+# {'time', 'event', 'step', ['params']}, event one of 'start', 'configure',
+# 'settled', 'end'. 'configure' is logged right after configure_channels returned.
+MARKERS_NAME = 'markers.jsonl'
+
+
+class StepMarkerLog:
+    """Writes timestamped step markers to a new JSON-lines file, flushed per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'w')
+
+    def mark(self, event, step=None, params=None):
+        marker = {'time': time.time(), 'event': event, 'step': step}
+        if params is not None:
+            marker['params'] = {k: params[k] for k in ('ch1', 'ch2', 'ch3', 'wave_type') if k in params}
+        self._f.write(json.dumps(marker) + '\n')
+        self._f.flush()
+        return marker
+
+    def close(self):
+        self._f.close()
+
+
+def read_markers(path):
+    markers = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        markers.append(json.loads(line))
+                    except ValueError:
+                        pass  # torn last line
+    return markers
+
+
+def step_bounds(markers):
+    """[(step, params, t_configure, t_settled, t_next)] from a marker list.
+
+    t_next is the next step's configure time (or the 'end' marker); None while
+    the step is still running. Only the markers after the last 'start' count,
+    so a file holding several runs gives the steps of the newest.
+    """
+    steps = []
+    for m in markers:
+        if m['event'] == 'start':
+            steps = []
+        elif m['event'] == 'configure':
+            if steps and steps[-1][4] is None:
+                steps[-1][4] = m['time']
+            steps.append([m['step'], m.get('params', {}), m['time'], None, None])
+        elif m['event'] == 'settled' and steps and steps[-1][0] == m['step']:
+            steps[-1][3] = m['time']
+        elif m['event'] == 'end' and steps and steps[-1][4] is None:
+            steps[-1][4] = m['time']
+    return [tuple(s) for s in steps]
+
+
+class StreamClock:
+    """Maps wall-clock time to trace index in a continuous capture.
+
+    Each capture file is written in one go once its traces are in, so a file's
+    mtime is the time of its last trace. The trace period is fitted over the
+    complete files (nominal 1/trace_rate with fewer than three) and the offset
+    is the median residual, which keeps single late writes from skewing it.
+    """
+
+    def __init__(self, ends, mtimes, trace_rate):
+        ends = np.asarray(ends, dtype=np.float64)
+        mtimes = np.asarray(mtimes, dtype=np.float64)
+        self.period = 1.0 / trace_rate
+        if len(ends) >= 3:
+            fitted = np.polyfit(ends, mtimes, 1)[0]
+            if fitted > 0:
+                self.period = fitted
+        self.offset = float(np.median(mtimes - self.period * ends)) if len(ends) else 0.0
+
+    def trace_at(self, t):
+        return (t - self.offset) / self.period
+
+    def time_of(self, trace):
+        return self.offset + self.period * trace
+
+
+class StreamSplitter:
+    """Cuts a continuous capture into per-step segments, offline or while it runs.
+
+    Steps are cut at their 'configure' markers, so each segment starts with the
+    transient after reconfiguring; the number of settle traces is recorded in the
+    step manifest. Segments are written in the usual capture layout (files of at
+    most nrefls traces) so the step pipeline and batch tools read them unchanged.
+    """
+
+    def __init__(self, stream_dir, config, markers_path=None):
+        self.stream_dir = stream_dir
+        self.markers_path = markers_path or os.path.join(stream_dir, MARKERS_NAME)
+        self.line_length, self.dtype, self.trace_rate = capture_layout(config)
+        self.nrefls = int(config.get('nrefls', 10000))
+        self.trace_bytes = (self.line_length // self.dtype.itemsize) * self.dtype.itemsize
+        self.done = set()
+        self.failed = set()  # steps cut with problems (e.g. no traces)
+
+    def _stream(self, final=False):
+        """Complete capture files with their cumulative trace end and mtime.
+
+        With final the capture has stopped, so a short last file (cut off when
+        the recording was stopped) is read up to its last whole trace.
+        """
+        files, ends, mtimes, total = [], [], [], 0
+        expected = expected_capture_size(self.nrefls, self.line_length)
+        for path in list_captures(self.stream_dir):
+            st = os.stat(path)
+            if st.st_size != expected and not (final and st.st_size >= self.trace_bytes):
+                break  # being written
+            total += st.st_size // self.trace_bytes
+            files.append((path, total - st.st_size // self.trace_bytes, total))
+            ends.append(total)
+            mtimes.append(st.st_mtime)
+            if st.st_size != expected:
+                break
+        return files, ends, mtimes, total
+
+    def split_ready(self, folder_for, final=False):
+        """Write every finished step that the captured data fully covers.
+
+        folder_for(step, params) gives the destination folder of a step. With
+        final, steps are cut at whatever data exists. Returns a list of
+        (step, params, folder, manifest) for the steps written by this call.
+        """
+        files, ends, mtimes, total = self._stream(final)
+        if not files:
+            return []
+        clock = StreamClock(ends, mtimes, self.trace_rate)
+        covered = mtimes[-1]
+        written = []
+        for step, params, t_conf, t_settled, t_next in step_bounds(read_markers(self.markers_path)):
+            if step in self.done or (t_next is None and not final):
+                continue
+            if t_next is not None and t_next > covered and not final:
+                continue  # the data for this step is not on disk yet
+            first = min(max(int(math.ceil(clock.trace_at(t_conf))), 0), total)
+            last = total if t_next is None else min(max(int(math.ceil(clock.trace_at(t_next))), first), total)
+            settle = 0 if t_settled is None else min(max(int(math.ceil(clock.trace_at(t_settled))) - first, 0),
+                                                     last - first)
+            folder = folder_for(step, params)
+            manifest = self._write_segment(step, params, folder, files, first, last, settle, clock)
+            self.done.add(step)
+            if manifest['problems']:
+                self.failed.add(step)
+            written.append((step, params, folder, manifest))
+        return written
+
+    def _write_segment(self, step, params, folder, files, first, last, settle, clock):
+        os.makedirs(folder, exist_ok=True)
+        out_files, problems = [], []
+        for index, start in enumerate(range(first, last, self.nrefls)):
+            stop = min(start + self.nrefls, last)
+            name = f'DASdata_{index:08d}_seg_{start}_{stop - start}.bin'
+            path = os.path.join(folder, name)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as out:
+                for src, f_first, f_last in files:
+                    lo, hi = max(start, f_first), min(stop, f_last)
+                    if lo < hi:
+                        traces = open_capture(src, self.line_length, self.dtype)
+                        out.write(np.ascontiguousarray(traces[lo - f_first:hi - f_first]).tobytes())
+            os.replace(tmp_path, path)
+            out_files.append({'name': name, 'size': os.path.getsize(path), 'checksum': file_checksum(path)})
+        if last <= first:
+            problems.append('no captured traces for this step')
+        elif last - first - settle <= 0:
+            problems.append('no traces after settling')
+        manifest = {
+            'step': step,
+            'params': params,
+            'mode': 'continuous',
+            'segment': {
+                'first_trace': first, 'n_traces': last - first, 'settle_traces': settle,
+                't_start': clock.time_of(first), 't_end': clock.time_of(last),
+            },
+            'problems': problems,
+            'valid': not problems,
+            'files': out_files,
+        }
+        write_manifest(folder, manifest)
+        return manifest
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Cut a kept continuous capture into per-step folders.')
+    parser.add_argument('stream_dir', help='folder with the stream captures and markers.jsonl')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--out', help='output folder (default: the config prefix)')
+    args = parser.parse_args()
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    prefix = config.get('prefix', 'experiment')
+    out = args.out or prefix
+
+    def folder_for(step, params):
+        ch1 = params.get('ch1', {})
+        return os.path.join(out, f"{step} {prefix} f={ch1.get('f')}, v={ch1.get('v')}, b={ch1.get('b')}")
+
+    for step, _, folder, manifest in StreamSplitter(args.stream_dir, config).split_ready(folder_for, final=True):
+        seg = manifest['segment']
+        print(f"[StreamSplitter] step {step}: {seg['n_traces']} traces ({seg['settle_traces']} settling) -> {folder}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import os
+import zlib
+import numpy as np
+
+from step_archive import archive_codec, read_archive
+
+# udp_das_cringe.exe writes every capture as a single raw block:
+#   {dir}/DASdata_{counter:08d}_{timestamp}_{...}.bin
+# holding nrefls reflectograms of line_length bytes each, back to back.
+# step_archive may have compressed it to {name}.bin{codec extension} since.
+CAPTURE_EXT = '.bin'
+
+
+def capture_layout(config):
+    """Return (line_length, dtype, trace_rate) describing captures made with this config.
+
+    line_length is the reflectogram length in bytes (INIT), dtype the sample type
+    ('sample_dtype', uint8 by default) and trace_rate the reflectogram rate in Hz,
+    taken from freq_send_data unless 'trace_rate' is set explicitly.
+    """
+    line_length = int(float(config.get('line_length', 1000)))
+    dtype = np.dtype(config.get('sample_dtype', 'uint8'))
+    trace_rate = float(config.get('trace_rate', config.get('freq_send_data', 1000)))
+    return line_length, dtype, trace_rate
+
+
+def expected_capture_size(nrefls, line_length):
+    """Size in bytes of one complete capture file."""
+    return int(nrefls) * int(line_length)
+
+
+def _capture_name(name):
+    """Name of the capture a directory entry holds (the archive's original), else None"""
+    if name.endswith(CAPTURE_EXT):
+        return name
+    stem, ext = os.path.splitext(name)
+    if stem.endswith(CAPTURE_EXT) and archive_codec(name) is not None:
+        return stem
+    return None
+
+
+def list_captures(directory):
+    """Capture files in a directory, in acquisition order.
+
+    Archived captures are listed by their archive path; where both a capture
+    and its archive exist (archiving was interrupted) the capture is listed.
+    """
+    if not os.path.isdir(directory):
+        return []
+    captures = {}
+    for name in os.listdir(directory):
+        capture = _capture_name(name)
+        if capture is not None and os.path.isfile(os.path.join(directory, name)):
+            if capture not in captures or name == capture:
+                captures[capture] = name
+    return [os.path.join(directory, captures[capture]) for capture in sorted(captures)]
+
+
+def open_capture(path, line_length, dtype='uint8'):
+    """Memory-map a capture file as a read-only (nrefls, samples) array.
+
+    A trailing partial reflectogram (short capture) is ignored. An archived
+    capture (see list_captures) is decompressed into memory instead.
+    """
+    dtype = np.dtype(dtype)
+    samples = int(line_length) // dtype.itemsize
+    if not path.endswith(CAPTURE_EXT):
+        data = read_archive(path)
+        nrefls = len(data) // (samples * dtype.itemsize) if samples else 0
+        return np.frombuffer(data, dtype=dtype, count=nrefls * samples).reshape(nrefls, samples)
+    nrefls = os.path.getsize(path) // (samples * dtype.itemsize) if samples else 0
+    if nrefls == 0:
+        return np.zeros((0, samples), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(nrefls, samples))
+
+
+def read_capture(path, line_length, dtype='uint8'):
+    """Read a capture file into memory as a (nrefls, samples) array.
+
+    Unlike open_capture no mapping is left open, so the file can be moved or
+    removed right after (Windows refuses that for a mapped file).
+    """
+    dtype = np.dtype(dtype)
+    if not path.endswith(CAPTURE_EXT):
+        return open_capture(path, line_length, dtype)
+    samples = int(line_length) // dtype.itemsize
+    data = np.fromfile(path, dtype=dtype)
+    nrefls = len(data) // samples if samples else 0
+    return data[:nrefls * samples].reshape(nrefls, samples)
+
+
+def file_checksum(path, block_size=1 << 20):
+    """CRC32 of a file as 'crc32:xxxxxxxx', read in blocks."""
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+    return f'crc32:{crc:08x}'
+
+
+def verify_captures(directory, nfiles, expected_size):
+    """Check a finished acquisition: nfiles captures of expected_size bytes each.
+
+    Returns a list of problems, empty when the capture is complete.
+    """
+    problems = []
+    paths = list_captures(directory)
+    if len(paths) != int(nfiles):
+        problems.append(f'expected {nfiles} files, found {len(paths)}')
+    for path in paths:
+        size = os.path.getsize(path)
+        if size != expected_size:
+            problems.append(f'{os.path.basename(path)}: {size} bytes, expected {expected_size}')
+    return problems
+
+
+def move_with_checksum(src, dst, block_size=1 << 20):
+    """Move a file; returns its checksum when a copy was needed, None for a rename.
+
+    A rename within one volume never reads the data. Across volumes the file is
+    copied block by block and the CRC32 is computed from the same blocks, so the
+    data is read exactly once; the source is removed only after the copy is
+    complete and has the right size.
+    """
+    try:
+        os.replace(src, dst)
+        return None
+    except OSError:
+        pass
+    crc = 0
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            block = fin.read(block_size)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            fout.write(block)
+    if os.path.getsize(dst) != os.path.getsize(src):
+        raise OSError(f'Copy of {src} to {dst} is incomplete')
+    os.remove(src)
+    return f'crc32:{crc:08x}'
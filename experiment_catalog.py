@@ -0,0 +1,271 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from das_capture import list_captures
+from step_manifest import read_manifest
+
+CHANNELS = ['ch1', 'ch2', 'ch3']
+PARAMS = ['v', 'b', 'f']
+PARAM_COLUMNS = [f'{ch}_{p}' for ch in CHANNELS for p in PARAMS]
+STAGES = ['configure', 'settle', 'acquire', 'collect']
+INIT_KEYS = ["Ng", "line_length", "len_udp_pack", "freq_send_data", "pulse_width"]
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT NOT NULL DEFAULT 'running',
+    config TEXT NOT NULL,
+    init TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    counter INTEGER NOT NULL,
+    folder TEXT,
+    wave_type TEXT,
+    {', '.join(f'{c} REAL' for c in PARAM_COLUMNS)},
+    started REAL,
+    {', '.join(f'{s}_s REAL' for s in STAGES)},
+    exit_code INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    step_id INTEGER NOT NULL REFERENCES steps(id),
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    checksum TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_prefix ON runs(prefix, started);
+CREATE INDEX IF NOT EXISTS steps_run ON steps(run_id, counter);
+CREATE INDEX IF NOT EXISTS files_step ON files(step_id);
+{''.join(f'CREATE INDEX IF NOT EXISTS steps_{c} ON steps({c});' for c in PARAM_COLUMNS)}
+'''
+
+
+def read_init_file(path='INIT'):
+    """Parse the 'key = value' INIT file used by udp_das_cringe.exe."""
+    values = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                if '=' in line:
+                    k, v = line.strip().split('=', 1)
+                    values[k.strip()] = v.strip()
+    return values
+
+
+class ExperimentCatalog:
+    """Indexed SQLite catalog of runs, steps and the files each step produced.
+
+    Safe to share between the sweep thread and the step pipeline worker.
+    """
+
+    def __init__(self, path='experiments.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        """Catalog named by 'catalog' in the config; None when disabled (empty path)."""
+        path = config.get('catalog', 'experiments.sqlite')
+        return cls(path) if path else None
+
+    def begin_run(self, config, init_values=None):
+        init_values = dict(init_values or {})
+        for k in INIT_KEYS:
+            init_values.setdefault(k, config.get(k, ''))
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO runs (prefix, started, config, init) VALUES (?, ?, ?, ?)',
+                (config.get('prefix', 'experiment'), time.time(),
+                 json.dumps(config), json.dumps(init_values)))
+        return cur.lastrowid
+
+    def finish_run(self, run_id, status='finished'):
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE runs SET finished = ?, status = ? WHERE id = ?',
+                              (time.time(), status, run_id))
+
+    def record_step(self, run_id, counter, step, folder=None, files=()):
+        """Store a step and its files.
+
+        step is the sweep step dict (ch1..ch3, wave_type) optionally carrying
+        'started', 'timings' ({stage: seconds}) and 'exit_code'. files is an
+        iterable of (path, checksum) pairs; checksum may be None.
+        """
+        timings = step.get('timings', {})
+        values = [run_id, counter, folder, step.get('wave_type')]
+        values += [step.get(ch, {}).get(p) for ch in CHANNELS for p in PARAMS]
+        values += [step.get('started')] + [timings.get(s) for s in STAGES] + [step.get('exit_code')]
+        columns = ['run_id', 'counter', 'folder', 'wave_type'] + PARAM_COLUMNS + \
+            ['started'] + [f'{s}_s' for s in STAGES] + ['exit_code']
+        rows = [(os.path.basename(p), os.path.abspath(p), os.path.getsize(p), c) for p, c in files]
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                f'INSERT INTO steps ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                values)
+            step_id = cur.lastrowid
+            self.conn.executemany(
+                'INSERT INTO files (step_id, name, path, size, checksum) VALUES (?, ?, ?, ?, ?)',
+                [(step_id,) + r for r in rows])
+        return step_id
+
+    def record_archive(self, step_dir, archived, checksums=None):
+        """Point the file rows of a compressed step at its archives.
+
+        archived is the 'files' part of the manifest's 'archive' block,
+        {name: {'archive', 'size'}}. The checksum stays that of the original
+        data; checksums ({name: checksum}, taken while archiving) fills it in
+        where the step was cataloged without one.
+        """
+        checksums = checksums or {}
+        rows = [(os.path.basename(item['archive']), os.path.abspath(os.path.join(step_dir, item['archive'])),
+                 item['size'], checksums.get(name), os.path.abspath(os.path.join(step_dir, name)))
+                for name, item in archived.items()]
+        with self._lock, self.conn:
+            self.conn.executemany('UPDATE files SET name = ?, path = ?, size = ?, checksum = COALESCE(checksum, ?) '
+                                  'WHERE path = ?', rows)
+
+    def find_steps(self, prefix=None, run_id=None, **ranges):
+        """Steps matching parameter ranges, e.g. find_steps(ch2_f=(10, 20), ch1_v=2.0).
+
+        A tuple is an inclusive (low, high) range, None on either side leaves it
+        open; any other value is an exact match.
+        """
+        where, args = [], []
+        if prefix is not None:
+            where.append('runs.prefix = ?')
+            args.append(prefix)
+        if run_id is not None:
+            where.append('steps.run_id = ?')
+            args.append(run_id)
+        for column, value in ranges.items():
+            if column not in PARAM_COLUMNS:
+                raise ValueError(f'Unknown step parameter {column!r}, expected one of {PARAM_COLUMNS}')
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    where.append(f'steps.{column} >= ?')
+                    args.append(low)
+                if high is not None:
+                    where.append(f'steps.{column} <= ?')
+                    args.append(high)
+            else:
+                where.append(f'steps.{column} = ?')
+                args.append(value)
+        sql = ('SELECT steps.*, runs.prefix FROM steps JOIN runs ON runs.id = steps.run_id'
+               + (' WHERE ' + ' AND '.join(where) if where else '')
+               + ' ORDER BY steps.run_id, steps.counter')
+        with self._lock:
+            return [dict(r) for r in self.conn.execute(sql, args)]
+
+    def runs(self, prefix=None):
+        sql = 'SELECT * FROM runs' + (' WHERE prefix = ?' if prefix is not None else '') + ' ORDER BY started'
+        with self._lock:
+            return [dict(r) for r in self.conn.execute(sql, () if prefix is None else (prefix,))]
+
+    def files(self, step_id):
+        with self._lock:
+            return [dict(r) for r in self.conn.execute(
+                'SELECT * FROM files WHERE step_id = ? ORDER BY name', (step_id,))]
+
+    def stage_timings(self, nfiles=None, nrefls=None, limit=500):
+        """Median seconds per stage over the most recent successful steps.
+
+        Only runs made with the same nfiles/nrefls are considered when given.
+        Returns {stage: seconds} for the stages with data, {} when there is none.
+        """
+        where, args = ['(steps.exit_code IS NULL OR steps.exit_code = 0)'], []
+        for key, value in (('nfiles', nfiles), ('nrefls', nrefls)):
+            if value is not None:
+                where.append(f"CAST(json_extract(runs.config, '$.{key}') AS REAL) = ?")
+                args.append(float(value))
+        sql = (f'SELECT {", ".join(f"steps.{s}_s" for s in STAGES)} FROM steps '
+               'JOIN runs ON runs.id = steps.run_id WHERE ' + ' AND '.join(where)
+               + ' ORDER BY steps.id DESC LIMIT ?')
+        with self._lock:
+            rows = self.conn.execute(sql, args + [limit]).fetchall()
+        timings = {}
+        for i, stage in enumerate(STAGES):
+            values = sorted(r[i] for r in rows if r[i] is not None)
+            if values:
+                timings[stage] = values[len(values) // 2]
+        return timings
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CatalogRecorder:
+    """Step pipeline handler that catalogs each finished step with file checksums.
+
+    The files and checksums are those of the step manifest, taken while the
+    step was collected (none for a capture that was only renamed); files are
+    not read again. Rejected captures and scratch files are left out. A reused
+    step is cataloged with the folder and files of the result it references,
+    its archives if that was compressed since. archived() is the StepArchiver callback that moves the rows
+    to the archives.
+    """
+
+    def __init__(self, catalog, run_id):
+        self.catalog = catalog
+        self.run_id = run_id
+
+    def __call__(self, counter, step_dir, step):
+        manifest = read_manifest(step_dir)
+        if manifest is None:
+            files = [(p, None) for p in list_captures(step_dir)]
+        else:
+            archived = manifest.get('archive', {}).get('files', {})
+            names = [(f['name'], f.get('checksum')) for f in manifest.get('files', [])]
+            files = [(os.path.join(step_dir, archived[n]['archive'] if n in archived else n), c) for n, c in names]
+        self.catalog.record_step(self.run_id, counter, step, os.path.basename(step_dir), files)
+
+    def archived(self, step_dir):
+        manifest = read_manifest(step_dir) or {}
+        if manifest.get('archive'):
+            self.catalog.record_archive(step_dir, manifest['archive']['files'],
+                                        {f['name']: f.get('checksum') for f in manifest.get('files', [])})
+
+
+def _parse_range(text):
+    if ':' in text:
+        low, high = text.split(':', 1)
+        return (float(low) if low else None, float(high) if high else None)
+    return float(text)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Query the experiment catalog.')
+    parser.add_argument('filters', nargs='*', help="e.g. ch2_f=10:20 ch1_v=2.0 (low:high, open ends allowed)")
+    parser.add_argument('--db', default='experiments.sqlite')
+    parser.add_argument('--prefix')
+    args = parser.parse_args()
+    ranges = {}
+    for item in args.filters:
+        key, value = item.split('=', 1)
+        ranges[key] = _parse_range(value)
+    with ExperimentCatalog(args.db) as catalog:
+        for row in catalog.find_steps(prefix=args.prefix, **ranges):
+            params = ' '.join(f'{c}={row[c]}' for c in PARAM_COLUMNS)
+            print(f"run {row['run_id']} step {row['counter']} [{row['prefix']}] {params} exit={row['exit_code']}")
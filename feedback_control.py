@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+import numpy as np
+
+from das_capture import capture_layout, expected_capture_size, list_captures, open_capture
+
+log = logging.getLogger('pzt.feedback')
+
+# The 'feedback' block of config.json; anything left out takes these values
+FEEDBACK_DEFAULTS = {
+    'enabled': True,
+    'channel': 'ch1',      # channel whose setting is controlled
+    'control': 'v',        # 'v' (voltage) or 'b' (bias)
+    'position': 0,         # fibre sample index the measurement is taken at
+    'width': 1,            # samples averaged around position
+    'metric': 'amp',       # 'amp': amplitude at the channel's drive frequency, 'std': standard deviation
+    'setpoint': 0.0,
+    'kp': 0.0,
+    'ki': 0.0,
+    'min': 0.0,            # output limits
+    'max': 100.0,
+    'period': 0.25,        # loop period in seconds
+    'nrefls': None,        # traces per capture file; default one period of traces
+    'duration': 60.0,      # seconds the loop runs
+    'keep_stream': False,  # keep the consumed capture files
+}
+
+
+def feedback_settings(config):
+    """Merged feedback settings, or None when the config has no enabled 'feedback' block"""
+    block = config.get('feedback')
+    if not isinstance(block, dict) or not block.get('enabled', True):
+        return None
+    settings = dict(FEEDBACK_DEFAULTS)
+    settings.update(block)
+    return settings
+
+
+def feedback_nrefls(settings, trace_rate):
+    return int(settings['nrefls'] or max(int(round(float(settings['period']) * trace_rate)), 16))
+
+
+def measure(traces, position, width, freq, trace_rate, metric='amp'):
+    """Reduce one capture to a scalar at a fibre position.
+
+    The samples position .. position+width-1 are averaged into one slow-time
+    series; 'amp' is its amplitude at freq (single-bin DFT of the mean-removed
+    series), 'std' its standard deviation.
+    """
+    series = np.asarray(traces[:, position:position + width], dtype=np.float64).mean(axis=1)
+    series -= series.mean()
+    if metric == 'std' or freq <= 0:
+        return float(series.std())
+    phase = 2.0 * np.pi * freq / trace_rate * np.arange(len(series))
+    return float(2.0 * np.hypot(series @ np.cos(phase), series @ np.sin(phase)) / len(series))
+
+
+class PIController:
+    """PI controller around a starting output, clamped to [low, high].
+
+    The integral only runs into a limit as far as that limit, and only moves
+    past it when the change (the sign of ki * error, so either sign of gain
+    works) leads back into the range, so a long saturation does not wind it up.
+    A non-finite measurement leaves the integral alone and keeps the last output.
+    """
+
+    def __init__(self, setpoint, kp, ki, output, low, high):
+        self.setpoint = setpoint
+        self.kp = kp
+        self.ki = ki
+        self.base = output
+        self.low = low
+        self.high = high
+        self.integral = 0.0
+        self.output = min(max(output, low), high)
+
+    def update(self, measurement, dt):
+        if not np.isfinite(measurement):
+            return self.output, float('nan')
+        error = self.setpoint - measurement
+        integral = self.integral + error * dt
+        output = self.base + self.kp * error + self.ki * integral
+        if self.low <= output <= self.high or (output > self.high) != (self.ki * error > 0):
+            self.integral = integral
+        elif self.ki:
+            # Integrate only as far as the limit it runs into
+            limit = self.high if output > self.high else self.low
+            lo, hi = sorted((self.integral, integral))
+            self.integral = min(max((limit - self.base - self.kp * error) / self.ki, lo), hi)
+        output = self.base + self.kp * error + self.ki * self.integral
+        self.output = min(max(output, self.low), self.high)
+        return self.output, error
+
+
+class CaptureStream:
+    """Newest complete capture of a running udp_das_cringe.exe session.
+
+    Files older than the one handed out are skipped and, unless keep, deleted,
+    so the capture directory stays small however long the loop runs.
+    """
+
+    def __init__(self, directory, nrefls, line_length, dtype, keep=False):
+        self.directory = directory
+        self.line_length = line_length
+        self.dtype = dtype
+        self.expected = expected_capture_size(nrefls, line_length)
+        self.keep = keep
+        self.last = None
+        self.skipped = 0
+
+    def newest(self):
+        """(path, mtime, traces) of a capture newer than the last one, or None"""
+        complete = []
+        for path in list_captures(self.directory):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size == self.expected and (self.last is None or path > self.last):
+                complete.append((path, st.st_mtime))
+        if not complete:
+            return None
+        path, mtime = complete[-1]
+        traces = np.array(open_capture(path, self.line_length, self.dtype))
+        self.skipped += len(complete) - 1
+        self.last = path
+        if not self.keep:
+            for old, _ in complete:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass  # still open on Windows; removed on a later pass or at the end
+        return path, mtime, traces
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values) * 1000.0
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+            'max': float(values.max())}
+
+
+def run_feedback(sc, base_config, start, stop_event=None, tracker=None, out_dir='.'):
+    """Closed-loop control of one channel setting from a fast DAS measurement.
+
+    One udp_das_cringe.exe session streams short captures (one loop period of
+    traces each). Every period the newest capture is reduced to a scalar at
+    the configured fibre position, a PI controller turns the error against the
+    setpoint into a new voltage or bias and it is sent through sc. Each
+    iteration is logged to {out_dir}/feedback_<time>.jsonl with its latency
+    (end of the newest trace to command sent) and timing; a summary with
+    latency percentiles and period jitter goes to feedback_<time>.summary.json.
+    Returns the run status.
+    """
+    settings = feedback_settings(base_config)
+    udp_dir = base_config.get('dir', 'refls1')
+    line_length, dtype, trace_rate = capture_layout(base_config)
+    period = float(settings['period'])
+    nrefls = feedback_nrefls(settings, trace_rate)
+    duration = float(settings['duration'])
+    channel, control = settings['channel'], settings['control']
+    position, width = int(settings['position']), max(int(settings['width']), 1)
+    config = {ch: dict(start.get(ch, {'v': 0.0, 'b': 0.0, 'f': 0.0})) for ch in ('ch1', 'ch2', 'ch3')}
+    config['wave_type'] = start.get('wave_type', base_config.get('wave_type', 'Z'))
+    freq = float(config[channel].get('f', 0.0))
+    controller = PIController(float(settings['setpoint']), float(settings['kp']), float(settings['ki']),
+                              float(config[channel].get(control, 0.0)), float(settings['min']),
+                              float(settings['max']))
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    record_path = os.path.join(out_dir, f'feedback_{stamp}.jsonl')
+    stream = CaptureStream(udp_dir, nrefls, line_length, dtype, settings['keep_stream'])
+    os.makedirs(udp_dir, exist_ok=True)
+    leftovers = list_captures(udp_dir)
+    if leftovers:
+        # Old captures would be taken for fresh data
+        os.makedirs(os.path.join(out_dir, 'leftover captures'), exist_ok=True)
+        for path in leftovers:
+            shutil.move(path, os.path.join(out_dir, 'leftover captures', os.path.basename(path)))
+    # Stale data for this long means the capture has died
+    stall = max(10 * period, 5 * nrefls / trace_rate)
+    iterations = int(duration / period)
+
+    sc.configure_channels(config)
+    if tracker is not None:
+        tracker.start(iterations)
+    log.info('Feedback on %s.%s at sample %d: setpoint %g, kp %g, ki %g, period %.3f s, %d traces per capture',
+             channel, control, position, controller.setpoint, controller.kp, controller.ki, period, nrefls)
+    process = subprocess.Popen(['./udp_das_cringe.exe', '--dir', udp_dir,
+                                '--nfiles', str(int(duration * trace_rate / nrefls) + 4), '--nrefls', str(nrefls)])
+    latencies, reduce_times, command_times, intervals, errors = [], [], [], [], []
+    missed = overruns = 0
+    status = 'finished'
+    try:
+        with open(record_path, 'w') as record:
+            t_start = time.monotonic()
+            deadline = t_start + period
+            last_data = last_command = None
+            iteration = 0
+            while iteration < iterations:
+                if stop_event is not None and stop_event.is_set():
+                    status = 'stopped'
+                    break
+                if process.poll() is not None:
+                    log.error('udp_das_cringe.exe exited early with code %s', process.returncode)
+                    status = 'acquisition_failed'
+                    break
+                frame = stream.newest()
+                now = time.monotonic()
+                if frame is None:
+                    if now < deadline:
+                        time.sleep(min(0.002, deadline - now))
+                        continue
+                    missed += 1
+                    if now - (last_data or t_start) > stall:
+                        log.error('No new capture for %.1f s, stopping the feedback loop', now - (last_data or t_start))
+                        status = 'acquisition_failed'
+                        break
+                    deadline += period
+                    continue
+                iteration += 1
+                last_data = now
+                _, mtime, traces = frame
+                measurement = measure(traces, position, width, freq, trace_rate, settings['metric'])
+                if not np.isfinite(measurement):
+                    # A NaN would stick in the integral: count the period as missed, keep the output
+                    log.warning('Non-finite measurement at iteration %d, keeping output %g',
+                                iteration, controller.output)
+                    missed += 1
+                    deadline = max(deadline + period, now)
+                    continue
+                t_reduced = time.monotonic()
+                dt = now - last_command if last_command is not None else period
+                output, error = controller.update(measurement, dt)
+                config[channel][control] = round(output, 4)  # the device takes 4 decimals
+                sc.configure_channels(config)
+                t_sent = time.monotonic()
+                latency = time.time() - mtime
+                if last_command is not None:
+                    intervals.append(t_sent - last_command)
+                last_command = t_sent
+                latencies.append(latency)
+                reduce_times.append(t_reduced - now)
+                command_times.append(t_sent - t_reduced)
+                errors.append(error)
+                late = t_sent > deadline
+                overruns += late
+                record.write(json.dumps({
+                    'i': iteration, 'time': time.time(), 'measurement': measurement, 'error': error,
+                    'output': config[channel][control], 'latency': latency,
+                    'reduce': t_reduced - now, 'command': t_sent - t_reduced, 'late': late,
+                }) + '\n')
+                if tracker is not None and iteration % max(int(1.0 / period), 1) == 0:
+                    tracker.stage(iteration, 'feedback', config)
+                # Next deadline one period on; after an overrun, from now
+                deadline = max(deadline + period, t_sent)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        if not settings['keep_stream']:
+            for path in list_captures(udp_dir):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    summary = {
+        'iterations': len(latencies), 'missed': missed, 'overruns': overruns, 'skipped_captures': stream.skipped,
+        'period': period, 'nrefls': nrefls,
+        'latency_ms': _percentiles(latencies),
+        'reduce_ms': _percentiles(reduce_times),
+        'command_ms': _percentiles(command_times),
+        'jitter_ms': float(np.std(intervals) * 1000.0) if intervals else None,
+        'mean_interval_ms': float(np.mean(intervals) * 1000.0) if intervals else None,
+        'rms_error': float(np.sqrt(np.mean(np.square(errors)))) if errors else None,
+        'final_output': config[channel][control],
+        'status': status,
+    }
+    with open(os.path.join(out_dir, f'feedback_{stamp}.summary.json'), 'w') as f:
+        json.dump(summary, f, indent=4)
+    if latencies:
+        log.info('Feedback: %d iterations, latency p50 %.1f ms / p95 %.1f ms, jitter %.1f ms, '
+                 '%d missed, %d overruns, rms error %.4g',
+                 summary['iterations'], summary['latency_ms']['p50'], summary['latency_ms']['p95'],
+                 summary['jitter_ms'] or 0.0, missed, overruns, summary['rms_error'])
+    return status
@@ -1,9 +1,11 @@
 import sys
 from PyQt5.QtWidgets import QApplication
 from config_editor import ConfigEditor
+from pztlibrary.log_pipeline import configure_logging
 import os
 
 def main():
+    configure_logging()
     app = QApplication(sys.argv)
     # Load and apply stylesheet from style.qss
     style_path = os.path.join(os.path.dirname(__file__), 'style.qss')
@@ -1,10 +1,39 @@
-from pztlibrary.usart_lib import SerialConfigurator, load_configuration, USARTError
+from pztlibrary.usart_lib import SerialConfigurator
+from pztlibrary.traffic_recorder import TrafficRecorder
+from pztlibrary.log_pipeline import configure_logging
 import json
+import logging
 import time
-import threading
 import subprocess
 import os
-import shutil
+from step_pipeline import StepPipeline
+from experiment_catalog import ExperimentCatalog, CatalogRecorder, read_init_file
+from das_capture import capture_layout, expected_capture_size, verify_captures, move_with_checksum, list_captures
+from step_manifest import read_manifest, write_manifest, write_run_manifest
+from sweep_progress import SweepProgress
+from preflight import run_preflight, PreflightError
+from acquisition_watchdog import run_acquisition, progress_timeout, AcquisitionTimeout, directory_size
+from continuous_capture import StepMarkerLog, StreamSplitter, MARKERS_NAME
+from repeat_stacking import StackAccumulator, step_repeats, STACK_MEAN, STACK_VAR
+from adaptive_sweep import AdaptiveRefiner
+from resource_sampler import ResourceSampler, RESOURCE_INTERVAL
+from feedback_control import feedback_settings, run_feedback
+from step_cache import StepIndex, acquisition_settings, step_hash, reuse_manifest
+from step_archive import StepArchiver
+
+# A step whose acquisition fails (nonzero exit, hang or bad capture) is acquired
+# again up to this many attempts in total ('acquisition_attempts' in the config)
+ACQUISITION_ATTEMPTS = 2
+# The sweep is aborted after this many steps in a row without a successful
+# acquisition ('max_failed_steps' in the config); isolated failures are skipped
+MAX_FAILED_STEPS = 3
+
+log = logging.getLogger('pzt.sweep')
+
+def format_step(step):
+    return ', '.join(f"{ch}: v={step.get(ch, {}).get('v', 0.0)}, b={step.get(ch, {}).get('b', 0.0)}, "
+                     f"f={step.get(ch, {}).get('f', 0.0)}" for ch in ('ch1', 'ch2', 'ch3'))
+
 
 class PiezoSweepIterator:
     def __init__(self, config_path='config.json'):
@@ -16,14 +45,10 @@ class PiezoSweepIterator:
         self.steps = self.base_config.get('steps', [])
         self.current_step = 0
         self.finished = False
-        print(f'[PiezoSweepIterator] Loaded {len(self.steps)} steps from config')
-        for i, step in enumerate(self.steps):
-            print(f'Step {i+1}:')
-            for ch in ['ch1', 'ch2', 'ch3']:
-                v = step.get(ch, {}).get('v', 0.0)
-                b = step.get(ch, {}).get('b', 0.0)
-                f_ = step.get(ch, {}).get('f', 0.0)
-                print(f'  {ch}: v={v}, b={b}, f={f_}')
+        log.info('Loaded %d steps from config', len(self.steps))
+        if log.isEnabledFor(logging.DEBUG):
+            for i, step in enumerate(self.steps):
+                log.debug('Step %d: %s', i + 1, format_step(step))
 
     def __iter__(self):
         self._reset_state()
@@ -31,21 +56,26 @@ class PiezoSweepIterator:
 
     def __next__(self):
         if self.finished or self.current_step >= len(self.steps):
-            print('[PiezoSweepIterator] Iteration finished.')
+            log.info('Iteration finished.')
             raise StopIteration
         result = self.steps[self.current_step].copy()
         result['wave_type'] = self.base_config.get('wave_type', 'Z')
-        print(f'[PiezoSweepIterator] Executing step {self.current_step + 1}:')
-        for ch in ['ch1', 'ch2', 'ch3']:
-            v = result.get(ch, {}).get('v', 0.0)
-            b = result.get(ch, {}).get('b', 0.0)
-            f_ = result.get(ch, {}).get('f', 0.0)
-            print(f'  {ch}: v={v}, b={b}, f={f_}')
+        if log.isEnabledFor(logging.INFO):
+            log.info('Executing step %d: %s', self.current_step + 1, format_step(result),
+                     extra={'step': self.current_step + 1})
         self.current_step += 1
         if self.current_step >= len(self.steps):
             self.finished = True
         return result
 
+    def remaining(self):
+        return len(self.steps) - self.current_step
+
+    def extend(self, steps):
+        """Append steps to a running sweep (adaptive refinement)"""
+        self.steps = self.steps + list(steps)
+        self.finished = False
+
 # Singleton for sweep iterator
 _sweep_iter = None
 
@@ -66,11 +96,208 @@ def initialize_piezo(port: str):
     with SerialConfigurator(port=port) as sc:
         sc.start_monitoring()
 
-def run_piezo_experiment(sleep_time=5.0, config_path='config.json', stop_event=None):
-    """Run the piezo sweep experiment, nullify at the end or on error or stop."""
+def collect_captures(udp_dir, dest_dir):
+    """Move every file of udp_dir into dest_dir; returns manifest entries."""
+    os.makedirs(dest_dir, exist_ok=True)
+    files = []
+    if not os.path.isdir(udp_dir):
+        return files  # the acquisition failed before writing anything
+    for fname in sorted(os.listdir(udp_dir)):
+        src_path = os.path.join(udp_dir, fname)
+        dst_path = os.path.join(dest_dir, fname)
+        if os.path.isfile(src_path):
+            checksum = move_with_checksum(src_path, dst_path)
+            files.append({'name': fname, 'size': os.path.getsize(dst_path), 'checksum': checksum})
+    return files
+
+def step_folder(prefix, counter, config):
+    """{prefix}/{counter} {prefix} f=..., v=..., b=... (channel 1 parameters)"""
+    v = config['ch1']['v']
+    b = config['ch1']['b']
+    f_ = config['ch1']['f']
+    return os.path.join(prefix, f"{counter} {prefix} f={f_}, v={v}, b={b}")
+
+def claim_step_folder(dest_dir, digest, referenced, index=None):
+    """dest_dir, or dest_dir with ' {digest[:8]}' appended where it holds a result to keep.
+
+    That is a result this run reuses (referenced) or, in incremental runs, one
+    the index may still hand out or any valid result of other step parameters.
+    """
+    name = os.path.basename(dest_dir)
+    keep = name in referenced
+    if index is not None and not keep:
+        manifest = read_manifest(dest_dir)
+        keep = name in index.sources or bool(
+            manifest and manifest.get('valid') and manifest.get('step_hash') != digest)
+    return f'{dest_dir} {digest[:8]}' if keep else dest_dir
+
+
+def build_step_pipeline(base_config):
+    """Post-acquisition handlers enabled in the config, run for every finished step."""
+    pipeline = StepPipeline()
+    if base_config.get('reduce', False):
+        from reflectogram_reduction import StepReducer
+        pipeline.add(StepReducer.from_config(base_config))
+    if base_config.get('store', False):
+        from sweep_store import SweepStoreWriter
+        pipeline.add(SweepStoreWriter.from_config(base_config))
+    return pipeline
+
+def run_continuous_sweep(sc, sweep, base_config, sleep_time, stop_event, tracker, pipeline, catalog, run_id,
+                         hash_settings, run_steps):
+    """One udp_das_cringe.exe session for the whole sweep, cut into steps by markers.
+
+    Each step is configured, marked, left to settle and then held for
+    'step_duration' seconds (default: the time nfiles x nrefls traces take)
+    while the capture keeps running. StreamSplitter writes the finished steps
+    into their usual folders as the data arrives; each gets its step hash and
+    an entry in run_steps. A step whose segment has problems is only cataloged,
+    like a failed acquisition. Returns the run status.
+    """
+    udp_dir = base_config.get('dir', 'refls1')
+    prefix = base_config.get('prefix', 'experiment')
+    nrefls = int(base_config.get('nrefls', 10000))
+    _, _, trace_rate = capture_layout(base_config)
+    dwell = float(base_config.get('step_duration') or
+                  int(base_config.get('nfiles', 3)) * nrefls / trace_rate)
+    # One folder per run: its markers and, if kept, its raw stream
+    stream_dir = os.path.join(prefix, f"stream_{time.strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(stream_dir, exist_ok=True)
+    if step_repeats({}, base_config) > 1 or any(step_repeats(step, {}) > 1 for step in sweep.steps):
+        log.warning("'repeats' is ignored in continuous mode, set a longer 'step_duration' instead")
+    if os.path.isdir(udp_dir) and os.listdir(udp_dir):
+        # Old captures would be taken for the start of the stream
+        collect_captures(udp_dir, os.path.join(prefix, 'leftover captures'))
+    # Enough files for the whole sweep with some slack; the process is stopped after the last step
+    total_files = int(len(sweep.steps) * (sleep_time + dwell + 1.0) * trace_rate / nrefls) + 2
+    markers = StepMarkerLog(os.path.join(stream_dir, MARKERS_NAME))
+    splitter = StreamSplitter(udp_dir, base_config, markers.path)
+    timeout = progress_timeout(base_config, nrefls)
+    # A segment is not an nfiles x nrefls acquisition: never the same result as a discrete step
+    hash_settings = dict(hash_settings, mode='continuous', step_duration=dwell)
+    steps, digests = {}, {}
+
+    def folder_for(counter, params):
+        return step_folder(prefix, counter, params)
+
+    def deliver(final=False):
+        t0 = time.monotonic()
+        for counter, _, dest_dir, manifest in splitter.split_ready(folder_for, final):
+            config = steps[counter]
+            config['timings']['collect'] = time.monotonic() - t0
+            config['segment'] = manifest['segment']
+            manifest['step_hash'] = digests[counter]
+            write_manifest(dest_dir, manifest)
+            run_steps.append({'step': counter, 'folder': os.path.basename(dest_dir),
+                              'step_hash': digests[counter], 'reused': False, 'valid': manifest['valid']})
+            tracker.step_done(counter, config, config['timings'], manifest['files'])
+            if manifest['valid']:
+                pipeline.submit(counter, dest_dir, config)
+            elif catalog is not None:
+                catalog.record_step(run_id, counter, config, os.path.basename(dest_dir))
+
+    process = subprocess.Popen(['./udp_das_cringe.exe', '--dir', udp_dir,
+                                '--nfiles', str(total_files), '--nrefls', str(nrefls)])
+    last_size, last_growth = directory_size(udp_dir), time.monotonic()
+
+    def hold(seconds):
+        """Wait while the capture runs; returns a failure status or None."""
+        nonlocal last_size, last_growth
+        end = time.monotonic() + seconds
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                return 'stopped'
+            if process.poll() is not None:
+                log.error('udp_das_cringe.exe exited early with code %s', process.returncode)
+                return 'acquisition_failed'
+            size = directory_size(udp_dir)
+            if size != last_size:
+                last_size, last_growth = size, time.monotonic()
+            elif time.monotonic() - last_growth > timeout:
+                log.error('No new data for %.0f s, stopping the capture', timeout)
+                return 'acquisition_failed'
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(0.5, remaining))
+
+    status = 'finished'
+    try:
+        markers.mark('start')
+        for counter, config in enumerate(sweep, start=1):
+            config['started'] = time.time()
+            digests[counter] = step_hash(config, hash_settings, base_config)
+            timings = config['timings'] = {}
+            steps[counter] = config
+            t0 = time.monotonic()
+            tracker.stage(counter, 'configure', config)
+            if sc.recorder is not None:
+                sc.recorder.step = counter
+            sc.configure_channels(config)
+            markers.mark('configure', counter, config)
+            t1 = time.monotonic()
+            timings['configure'] = t1 - t0
+            tracker.stage(counter, 'settle', config)
+            failure = hold(sleep_time)
+            markers.mark('settled', counter)
+            t2 = time.monotonic()
+            timings['settle'] = t2 - t1
+            if failure is None:
+                tracker.stage(counter, 'acquire', config)
+                failure = hold(dwell)
+            timings['acquire'] = time.monotonic() - t2
+            deliver()
+            if failure is not None:
+                status = failure
+                break
+        markers.mark('end')
+        if status == 'finished':
+            # Wait for the file holding the end marker, then stop recording
+            deadline = time.monotonic() + timeout
+            while len(splitter.done) < len(steps) and time.monotonic() < deadline and process.poll() is None:
+                time.sleep(0.5)
+                deliver()
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        markers.close()
+    deliver(final=True)
+    # The step segments hold all data from the first step on; the raw stream is only
+    # kept when asked for ('keep_stream') or when some step could not be cut from it
+    if base_config.get('keep_stream', False) or len(splitter.done) < len(steps) or splitter.failed:
+        collect_captures(udp_dir, stream_dir)
+    else:
+        for name in os.listdir(udp_dir):
+            os.remove(os.path.join(udp_dir, name))
+    return status
+
+def run_piezo_experiment(sleep_time=5.0, config_path='config.json', stop_event=None, progress=None,
+                         preflight=True, profile=False, incremental=False):
+    """Run the piezo sweep experiment, nullify at the end or on error or stop.
+
+    progress, if given, is called with structured progress events (see SweepProgress).
+    With preflight the whole sweep is checked first and PreflightError is raised,
+    before the device is touched, if the run could not complete.
+    profile (True or a dict of RunProfiler options) writes cProfile, stack-sample
+    and allocation artefacts to {prefix}/profile_<time>; off, nothing is set up.
+    incremental (or 'incremental' in the config) reuses the valid results of
+    earlier runs under the same prefix for steps whose hash (parameters, INIT
+    and acquisition settings) matches, and acquires only the others.
+    {prefix}/run_<time>.json lists every step of the run with the folder
+    holding its result.
+    """
     with open(config_path, 'r') as f:
         base_config = json.load(f)
-    port = base_config.get('port', 'com4')
+    configure_logging(base_config.get('logging'))
+    if preflight:
+        # The port is opened right below anyway, so it is not probed separately
+        report = run_preflight(base_config, sleep_time, port_probe=False)
+        log.info('Pre-flight check:\n%s', report.summary())
+        if not report.ok:
+            raise PreflightError(report)
+    # Empty or 'auto' lets SerialConfigurator find the controller (cached per adapter)
+    port = base_config.get('port') or None
     nullify_config = {
         'ch1': {'v': 0, 'b': 0, 'f': 0},
         'ch2': {'v': 0, 'b': 0, 'f': 0},
@@ -80,60 +307,284 @@ def run_piezo_experiment(sleep_time=5.0, config_path='config.json', stop_event=N
     udp_dir = base_config.get('dir', 'refls1')
     udp_nfiles = str(base_config.get('nfiles', 3))
     udp_nrefls = str(base_config.get('nrefls', 10000))
+    expected_size = expected_capture_size(udp_nrefls, capture_layout(base_config)[0])
+    attempts = int(base_config.get('acquisition_attempts', ACQUISITION_ATTEMPTS))
+    if attempts < 1:
+        # Checked by the pre-flight too; without an attempt no step would be acquired
+        raise ValueError(f'acquisition_attempts must be at least 1, got {attempts}')
+    max_failed_steps = int(base_config.get('max_failed_steps', MAX_FAILED_STEPS))
+    keep_raw_repeats = bool(base_config.get('keep_raw_repeats', False))
+    stack_variance = bool(base_config.get('stack_variance', True))
+    timeout = progress_timeout(base_config, udp_nrefls)
+    failed_steps = 0
     prefix = base_config.get('prefix', 'experiment')
     os.makedirs(prefix, exist_ok=True)
+    pipeline = build_step_pipeline(base_config)
+    catalog = ExperimentCatalog.from_config(base_config)
+    run_id = None
+    init_values = read_init_file()
+    hash_settings = acquisition_settings(base_config, init_values, sleep_time)
+    index = None
+    if incremental or base_config.get('incremental', False):
+        index = StepIndex(prefix)
+        log.info('Incremental run: %d earlier step results under %s can be reused', len(index), prefix)
+    run_steps = []
+    referenced = set()
+    run_started = time.strftime('%Y%m%d_%H%M%S')
+    catalog_recorder = None
+    if catalog is not None:
+        run_id = catalog.begin_run(base_config, init_values)
+        catalog_recorder = CatalogRecorder(catalog, run_id)
+        pipeline.add(catalog_recorder)
+    tracker = SweepProgress(progress)
+    recorder = None
+    if base_config.get('record_traffic', False):
+        # Every TX/RX frame with its step; inspect or replay with pztlibrary/traffic_recorder.py
+        recorder = TrafficRecorder(os.path.join(prefix, f"serial_{time.strftime('%Y%m%d_%H%M%S')}.pztraf"))
+    status = 'error'
     counter = 1
+    sampler = None
+    resource_interval = float(base_config.get('resource_interval', RESOURCE_INTERVAL))
+    if resource_interval > 0:
+        # Host load next to the run, tagged with the step and stage the runner is in
+        sampler = ResourceSampler(os.path.join(prefix, f"resources_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"),
+                                  prefix, udp_dir, resource_interval, lambda: tracker.position).start()
+    profiler = None
+    if profile:
+        # Only profiled runs load cProfile, pstats and tracemalloc
+        from run_profiler import RunProfiler
+        profiler = RunProfiler(os.path.join(prefix, f"profile_{time.strftime('%Y%m%d_%H%M%S')}"),
+                               **(profile if isinstance(profile, dict) else {})).start()
     try:
-        with SerialConfigurator(port=port) as sc:
+        with SerialConfigurator(port=port, recorder=recorder) as sc:
             sc.start_monitoring()
             sweep = PiezoSweepIterator(config_path)
+            tracker.start(len(sweep.steps))
+            if feedback_settings(base_config) is not None:
+                # The first step, if any, is the operating point the loop starts from
+                start = dict(sweep.steps[0]) if sweep.steps else dict(nullify_config)
+                start['wave_type'] = nullify_config['wave_type']
+                status = run_feedback(sc, base_config, start, stop_event, tracker, prefix)
+                sc.configure_channels(nullify_config)
+                time.sleep(5)
+                return
+            refiner = AdaptiveRefiner.from_config(base_config, sweep.steps)
+            if refiner is not None:
+                if base_config.get('continuous', False):
+                    log.warning("'adaptive_budget' is ignored in continuous mode")
+                    refiner = None
+                else:
+                    pipeline.add(refiner.collector)
+            archiver = None
+            if base_config.get('archive', False):
+                # Last, so every other handler still reads the raw captures
+                archiver = StepArchiver.from_config(
+                    base_config, on_archived=catalog_recorder.archived if catalog_recorder is not None else None)
+                pipeline.add(archiver)
+            if base_config.get('continuous', False):
+                if archiver is not None:
+                    archiver.pause()  # the capture runs the whole time; archive once it has stopped
+                status = run_continuous_sweep(sc, sweep, base_config, sleep_time, stop_event,
+                                              tracker, pipeline, catalog, run_id, hash_settings, run_steps)
+                sc.configure_channels(nullify_config)
+                time.sleep(5)
+                return
+
+            def end_of_pass(config):
+                if refiner is not None and sweep.remaining() == 0:
+                    # End of a pass: wait for the responses, then refine where they change most
+                    tracker.stage(counter - 1, 'refine', config)
+                    pipeline.drain()
+                    new_steps = refiner.propose()
+                    refiner.save(os.path.join(prefix, 'adaptive_sweep.json'))
+                    if new_steps:
+                        log.info('Adaptive round %d: %d new steps, %d of %d left in the budget',
+                                 len(refiner.rounds), len(new_steps), refiner.remaining, refiner.budget)
+                        sweep.extend(new_steps)
+                        tracker.total += len(new_steps)
+
             for config in sweep:
                 if stop_event is not None and stop_event.is_set():
-                    print('[PiezoSweepIterator] Stopped by user.')
+                    log.info('Stopped by user.')
+                    status = 'stopped'
                     sc.configure_channels(nullify_config)
                     time.sleep(5)
                     return
+                digest = step_hash(config, hash_settings, base_config)
+                reused = index.lookup(digest) if index is not None else None
+                if reused is not None:
+                    # Same parameters and settings as a valid earlier result: reference it
+                    source, previous = reused
+                    source_dir = os.path.join(prefix, source)
+                    dest_dir = step_folder(prefix, counter, config)
+                    if os.path.normpath(dest_dir) != os.path.normpath(source_dir):
+                        # Never write the reference over a result that is still needed
+                        dest_dir = claim_step_folder(dest_dir, digest, referenced, index)
+                    if os.path.normpath(dest_dir) != os.path.normpath(source_dir):
+                        os.makedirs(dest_dir, exist_ok=True)
+                        write_manifest(dest_dir, reuse_manifest(
+                            counter, {k: config[k] for k in ('ch1', 'ch2', 'ch3', 'wave_type') if k in config},
+                            digest, source, previous))
+                    log.info('Step %d reuses %s', counter, source, extra={'step': counter})
+                    config['reused'] = source
+                    referenced.add(source)
+                    run_steps.append({'step': counter, 'folder': source, 'step_hash': digest,
+                                      'reused': True, 'valid': True})
+                    tracker.step_done(counter, config, {})
+                    pipeline.submit(counter, source_dir, config)
+                    counter += 1
+                    end_of_pass(config)
+                    continue
+                config['started'] = time.time()
+                timings = config['timings'] = {}
+                t0 = time.monotonic()
+                tracker.stage(counter, 'configure', config)
+                if recorder is not None:
+                    recorder.step = counter
                 sc.configure_channels(config)
+                t1 = time.monotonic()
+                timings['configure'] = t1 - t0
+                tracker.stage(counter, 'settle', config)
                 time.sleep(sleep_time)
-                # Call udp_das_cringe.exe and wait for code 0
-                try:
-                    subprocess.check_call([
-                        './udp_das_cringe.exe',
-                        '--dir', udp_dir,
-                        '--nfiles', udp_nfiles,
-                        '--nrefls', udp_nrefls
-                    ])
-                except subprocess.CalledProcessError as e:
-                    print(f'[PiezoSweepIterator] udp_das_cringe.exe failed with code {e.returncode}')
-                    sc.configure_channels(nullify_config)
-                    time.sleep(5)
-                    return
+                t2 = time.monotonic()
+                timings['settle'] = t2 - t1
+                # Not over a result this run reuses, or in incremental runs any other kept result
+                dest_dir = claim_step_folder(step_folder(prefix, counter, config), digest, referenced, index)
+                # Run udp_das_cringe.exe under the watchdog, then check the capture.
+                # Repeated steps are acquired again with the piezo state unchanged and
+                # stacked into one mean (and variance); their raw captures are dropped unless kept.
+                tracker.stage(counter, 'acquire', config)
+                if archiver is not None:
+                    archiver.pause()
+                repeats = step_repeats(config, base_config)
+                stack = None
+                if repeats > 1:
+                    stack = StackAccumulator(dest_dir, udp_nfiles, udp_nrefls, *capture_layout(base_config)[:2],
+                                             variance=stack_variance)
+                raw_files = []
+                total_attempts = 0
+                for repeat in range(1, repeats + 1):
+                    for attempt in range(1, attempts + 1):
+                        total_attempts += 1
+                        failure = None
+                        try:
+                            run_acquisition([
+                                './udp_das_cringe.exe',
+                                '--dir', udp_dir,
+                                '--nfiles', udp_nfiles,
+                                '--nrefls', udp_nrefls
+                            ], udp_dir, timeout)
+                            config['exit_code'] = 0
+                        except subprocess.CalledProcessError as e:
+                            failure = f'udp_das_cringe.exe failed with code {e.returncode}'
+                            config['exit_code'] = e.returncode
+                        except AcquisitionTimeout as e:
+                            failure = f'udp_das_cringe.exe hung: {e}'
+                            config['exit_code'] = e.returncode
+                        problems = [failure] if failure else verify_captures(udp_dir, udp_nfiles, expected_size)
+                        if not problems:
+                            break
+                        log.warning('Step %d acquisition failed (attempt %d/%d): %s',
+                                    counter, attempt, attempts, '; '.join(problems), extra={'step': counter})
+                        if attempt < attempts and os.path.isdir(udp_dir) and os.listdir(udp_dir):
+                            # Keep the bad capture for inspection, out of the step's data
+                            rejected = f'rejected {attempt}' if stack is None else f'rejected {repeat}.{attempt}'
+                            collect_captures(udp_dir, os.path.join(dest_dir, rejected))
+                    if problems or stack is None:
+                        break
+                    stack.add(list_captures(udp_dir))
+                    if keep_raw_repeats:
+                        raw_dir = f'repeat {repeat}'
+                        raw_files += [dict(f, name=f"{raw_dir}/{f['name']}")
+                                      for f in collect_captures(udp_dir, os.path.join(dest_dir, raw_dir))]
+                    else:
+                        for path in list_captures(udp_dir):
+                            os.remove(path)
+                t3 = time.monotonic()
+                timings['acquire'] = t3 - t2
+                if archiver is not None:
+                    archiver.resume()
                 # After process, move files to {prefix}/{counter} {prefix} f=..., v=..., b=...
-                v = config['ch1']['v']
-                b = config['ch1']['b']
-                f_ = config['ch1']['f']
-                folder_name = f"{counter} {prefix} f={f_}, v={v}, b={b}"
-                dest_dir = os.path.join(prefix, folder_name)
-                os.makedirs(dest_dir, exist_ok=True)
-                # Move all files from udp_dir to dest_dir
-                for fname in os.listdir(udp_dir):
-                    src_path = os.path.join(udp_dir, fname)
-                    dst_path = os.path.join(dest_dir, fname)
-                    if os.path.isfile(src_path):
-                        shutil.move(src_path, dst_path)
+                tracker.stage(counter, 'collect', config)
+                # What is left after a failed acquisition stays with the step for inspection
+                files = collect_captures(udp_dir, dest_dir)
+                manifest = {
+                    'step': counter,
+                    'params': {k: config[k] for k in ('ch1', 'ch2', 'ch3', 'wave_type') if k in config},
+                    'step_hash': digest,
+                    'expected': {'nfiles': int(udp_nfiles), 'size': expected_size},
+                    'attempts': total_attempts,
+                    'exit_code': config['exit_code'],
+                    'problems': problems,
+                    'valid': not problems,
+                    'files': files,
+                }
+                if stack is not None:
+                    stacked = stack.count
+                    if stacked:
+                        files += stack.finish() + raw_files
+                    else:
+                        stack.discard()
+                    if problems:
+                        problems.append(f'{stacked} of {repeats} repeats stacked')
+                    manifest['repeats'] = {'requested': repeats, 'stacked': stacked, 'raw_kept': keep_raw_repeats,
+                                           'mean': STACK_MEAN, 'var': STACK_VAR if stack_variance else None}
+                write_manifest(dest_dir, manifest)
+                run_steps.append({'step': counter, 'folder': os.path.basename(dest_dir), 'step_hash': digest,
+                                  'reused': False, 'valid': not problems})
+                timings['collect'] = time.monotonic() - t3
+                tracker.step_done(counter, config, timings, files)
+                if not problems:
+                    failed_steps = 0
+                    pipeline.submit(counter, dest_dir, config)
+                else:
+                    # No usable capture (the exe failed or its captures did not verify):
+                    # record the failure and move on, unless the rig looks dead
+                    failed_steps += 1
+                    if catalog is not None:
+                        catalog.record_step(run_id, counter, config, os.path.basename(dest_dir))
+                    if failed_steps >= max_failed_steps:
+                        log.error('%d steps in a row failed, aborting sweep.', failed_steps)
+                        status = 'acquisition_failed'
+                        sc.configure_channels(nullify_config)
+                        time.sleep(5)
+                        return
                 counter += 1
+                end_of_pass(config)
             # Nullify at the end
+            status = 'finished'
             sc.configure_channels(nullify_config)
             time.sleep(5)
             return
     except Exception as e:
         # Nullify on error
         try:
-            with SerialConfigurator(port=port) as sc:
+            if recorder is not None:
+                recorder.step = None
+            with SerialConfigurator(port=port, recorder=recorder) as sc:
                 sc.start_monitoring()
                 sc.configure_channels(nullify_config)
                 time.sleep(5)
                 return
         except Exception:
             pass
-        raise
\ No newline at end of file
+        raise
+    finally:
+        if recorder is not None:
+            recorder.close()
+        pipeline.close()
+        if catalog is not None:
+            catalog.finish_run(run_id, status)
+            catalog.close()
+        if sampler is not None:
+            sampler.stop()
+        if run_steps:
+            write_run_manifest(os.path.join(prefix, f'run_{run_started}.json'), {
+                'started': run_started, 'status': status, 'incremental': index is not None,
+                'acquired': sum(1 for s in run_steps if not s['reused']),
+                'reused': sum(1 for s in run_steps if s['reused']),
+                'steps': run_steps,
+            })
+        tracker.finish(status)
+        if profiler is not None:
+            log.info('Profile written to %s', profiler.stop())
\ No newline at end of file
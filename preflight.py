@@ -0,0 +1,368 @@
+import os
+import shutil
+import numpy as np
+import serial
+
+from pztlibrary.usart_lib import SerialConfigurator
+from pztlibrary.port_discovery import find_controller
+from pztlibrary.protocol import MAX_ENCODABLE
+from das_capture import capture_layout, expected_capture_size
+from experiment_catalog import ExperimentCatalog, PARAM_COLUMNS
+from repeat_stacking import stack_dtype, step_repeats
+from adaptive_sweep import ADAPTIVE_METRICS
+from feedback_control import feedback_settings, feedback_nrefls
+from step_archive import CODECS
+
+ACQUISITION_EXE = './udp_das_cringe.exe'
+# Every run ends by nullifying the channels and waiting this long
+FINISH_S = 5.0
+# Stage durations assumed when the catalog has no comparable steps
+DEFAULT_CONFIGURE_S = 0.2
+DEFAULT_COLLECT_BYTES_PER_S = 200e6
+# Free space that must remain after the run, as a fraction of the estimate
+DISK_MARGIN = 0.05
+
+
+class PreflightError(Exception):
+    """Raised when a sweep fails its pre-flight check; carries the report."""
+
+    def __init__(self, report):
+        super().__init__(report.summary())
+        self.report = report
+
+
+class PreflightReport:
+    """Outcome of run_preflight: errors block the run, warnings do not."""
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self.steps = 0
+        self.adaptive_steps = 0
+        self.duration_s = None
+        self.timing_source = ''
+        self.disk_bytes = None
+        self.free_bytes = None
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def summary(self):
+        lines = [f"{self.steps} steps" + (f" + up to {self.adaptive_steps} adaptive" if self.adaptive_steps else "")]
+        if self.duration_s is not None:
+            lines.append(f"Estimated duration: {self.duration_s / 3600:.2f} h ({self.timing_source})")
+        if self.disk_bytes is not None:
+            free = f", {self.free_bytes / 1e9:.1f} GB free" if self.free_bytes is not None else ""
+            lines.append(f"Estimated disk usage: {self.disk_bytes / 1e9:.2f} GB{free}")
+        lines += [f"ERROR: {e}" for e in self.errors]
+        lines += [f"Warning: {w}" for w in self.warnings]
+        return '\n'.join(lines)
+
+
+def _positive_int(value):
+    """int for a positive integer (or its string form), else None."""
+    text = str(value).strip()
+    return int(text) if text.isdigit() and int(text) > 0 else None
+
+
+def _step_list(rows, limit=5):
+    numbers = ', '.join(str(r + 1) for r in rows[:limit])
+    return numbers + (', ...' if len(rows) > limit else '')
+
+
+def steps_array(steps, report):
+    """(n, 9) array of the sweep in PARAM_COLUMNS order.
+
+    Malformed steps are reported as errors and come back as rows of NaN.
+    """
+    keys = [c.split('_') for c in PARAM_COLUMNS]
+    try:
+        return np.array([[step[ch][p] for ch, p in keys] for step in steps],
+                        dtype=np.float64).reshape(-1, len(PARAM_COLUMNS))
+    except (KeyError, TypeError, ValueError):
+        pass
+    array = np.full((len(steps), len(PARAM_COLUMNS)), np.nan)
+    bad = []
+    for row, step in enumerate(steps):
+        try:
+            array[row] = [float(step[ch][p]) for ch, p in keys]
+        except (KeyError, TypeError, ValueError):
+            bad.append(row)
+    report.errors.append(f"{len(bad)} steps have missing or non-numeric parameters "
+                         f"(steps {_step_list(bad)}); the device would silently get 0 for them")
+    return array
+
+
+def check_steps(config, report):
+    """Validate every step at once: finite, encodable, non-negative frequency, optional limits.
+
+    config may carry 'param_limits', e.g. {"v": [0, 10], "ch2_f": [0, 500]}; a bare
+    parameter name applies to all three channels.
+    """
+    steps = config.get('steps', [])
+    report.steps = len(steps)
+    if not steps:
+        report.errors.append("The sweep has no steps")
+        return
+    array = steps_array(steps, report)
+    malformed = np.isnan(array).all(axis=1)
+    names = np.array(PARAM_COLUMNS)
+    negative_f = np.zeros_like(array, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        negative_f[:, 2::3] = array[:, 2::3] < 0
+        checks = [
+            (~np.isfinite(array) & ~malformed[:, None], "is not a finite number"),
+            (np.isfinite(array) & (np.abs(array) >= MAX_ENCODABLE), f"is too large to encode for the device (|value| >= {MAX_ENCODABLE})"),
+            (negative_f, "is a negative frequency"),
+        ]
+        for key, (low, high) in dict(config.get('param_limits', {})).items():
+            columns = [i for i, c in enumerate(PARAM_COLUMNS) if key in (c, c.split('_')[1])]
+            if not columns:
+                report.warnings.append(f"param_limits: unknown parameter {key!r}")
+                continue
+            mask = np.zeros_like(array, dtype=bool)
+            mask[:, columns] = (array[:, columns] < low) | (array[:, columns] > high)
+            checks.append((mask, f"is outside [{low}, {high}]"))
+    for mask, problem in checks:
+        rows = np.flatnonzero(mask.any(axis=1))
+        if len(rows):
+            params = ', '.join(names[mask.any(axis=0)])
+            report.errors.append(f"{len(rows)} steps: {params} {problem} (steps {_step_list(rows)})")
+
+
+def check_settings(config, report):
+    """Wave type and the acquisition counts as they will be passed on."""
+    wave = str(config.get('wave_type', 'Z')).upper()
+    if wave not in SerialConfigurator.VALID_WAVEFORMS:
+        report.errors.append(f"Wave type {config.get('wave_type')!r} is not one of "
+                             f"{sorted(SerialConfigurator.VALID_WAVEFORMS)}; the device would get 'Z' instead")
+    for key in ('nfiles', 'nrefls'):
+        if _positive_int(config.get(key, '')) is None:
+            report.errors.append(f"{key} must be a positive integer, got {config.get(key)!r}")
+    if config.get('repeats', '') not in ('', None) and _positive_int(config['repeats']) is None:
+        report.errors.append(f"repeats must be a positive integer, got {config.get('repeats')!r}")
+    if 'acquisition_attempts' in config and _positive_int(config['acquisition_attempts']) is None:
+        report.errors.append(f"acquisition_attempts must be a positive integer, "
+                             f"got {config.get('acquisition_attempts')!r}")
+    if _adaptive_budget(config) and config.get('adaptive_metric', 'amp') not in ADAPTIVE_METRICS:
+        report.errors.append(f"adaptive_metric must be one of {list(ADAPTIVE_METRICS)}, "
+                             f"got {config.get('adaptive_metric')!r}")
+    if config.get('archive', False) and config.get('archive_codec', 'zlib') not in CODECS:
+        report.errors.append(f"archive_codec {config.get('archive_codec')!r} is not available here; "
+                             f"use one of {sorted(CODECS)}")
+    try:
+        line_length, dtype, trace_rate = capture_layout(config)
+        if line_length <= 0 or line_length % dtype.itemsize:
+            report.errors.append(f"line_length {line_length} is not a positive multiple of the "
+                                 f"{dtype} sample size")
+        if trace_rate <= 0:
+            report.errors.append(f"Reflectogram rate must be positive, got {trace_rate}")
+    except (TypeError, ValueError) as e:
+        report.errors.append(f"Bad capture layout (line_length / sample_dtype / trace_rate): {e}")
+    prefix = config.get('prefix', 'experiment')
+    if not str(prefix).strip():
+        report.errors.append("The folder prefix is empty")
+
+
+def probe_binary(report, path=ACQUISITION_EXE):
+    if not os.path.isfile(path):
+        report.errors.append(f"Acquisition program {path} not found")
+    elif os.name != 'nt' and not os.access(path, os.X_OK):
+        report.errors.append(f"Acquisition program {path} is not executable")
+
+
+def probe_port(report, port):
+    """Open and close the serial port once, so a wrong or busy port shows up now."""
+    if not port or port.lower() == 'auto':
+        if find_controller() is None:
+            report.errors.append("Port is 'auto' but no piezo controller answered on any serial port")
+        return
+    try:
+        serial.Serial(port=port, baudrate=115200, timeout=0).close()
+    except (serial.SerialException, ValueError) as e:
+        report.errors.append(f"Serial port {port} cannot be opened: {e}")
+
+
+def _existing_dir(path):
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def estimate(config, report, sleep_time, catalog=None):
+    """Fill in duration and disk estimates and compare disk usage with free space."""
+    nfiles = _positive_int(config.get('nfiles', ''))
+    nrefls = _positive_int(config.get('nrefls', ''))
+    if nfiles is None or nrefls is None or not report.steps:
+        return
+    try:
+        line_length, _, trace_rate = capture_layout(config)
+    except (TypeError, ValueError):
+        return
+    step_bytes = nfiles * expected_capture_size(nrefls, line_length)
+    acquire_s = nfiles * nrefls / trace_rate if trace_rate > 0 else 0.0
+    # Acquisitions in the whole sweep; a repeated step keeps a mean (and unless stack_variance is off
+    # a variance) per sample instead of its captures (plus the captures with keep_raw_repeats)
+    steps = config.get('steps')
+    repeats = [step_repeats(step if isinstance(step, dict) else {}, config) for step in steps] \
+        if isinstance(steps, list) and len(steps) == report.steps else [step_repeats({}, config)] * report.steps
+    acquisitions = sum(repeats)
+    stacked_steps = sum(1 for r in repeats if r > 1)
+    sample_dtype = capture_layout(config)[1]
+    stack_bytes = nfiles * nrefls * (line_length // sample_dtype.itemsize) * stack_dtype(sample_dtype).itemsize \
+        * (2 if config.get('stack_variance', True) else 1)
+    if config.get('continuous', False) and trace_rate > 0:
+        # The capture also runs while settling; segments are copies of the stream
+        acquire_s = float(config.get('step_duration') or acquire_s)
+        step_bytes = int((sleep_time + acquire_s) * trace_rate) * line_length
+        if config.get('keep_stream', False):
+            step_bytes *= 2
+
+    timings = catalog.stage_timings(nfiles, nrefls) if catalog is not None else {}
+    if timings:
+        report.timing_source = 'measured in earlier runs'
+    else:
+        report.timing_source = 'no earlier runs, nominal timings'
+    timings.setdefault('configure', DEFAULT_CONFIGURE_S)
+    timings.setdefault('settle', sleep_time)
+    timings.setdefault('acquire', acquire_s)
+    timings.setdefault('collect', step_bytes / DEFAULT_COLLECT_BYTES_PER_S)
+    # settle is a fixed sleep, so the configured value beats any measurement
+    timings['settle'] = sleep_time
+    if config.get('continuous', False):
+        acquisitions, stacked_steps = report.steps, 0  # repeats are ignored there
+    report.duration_s = (report.steps * (timings['configure'] + timings['settle']) +
+                         acquisitions * (timings['acquire'] + timings['collect']) + FINISH_S)
+
+    report.disk_bytes = (report.steps - stacked_steps) * step_bytes + stacked_steps * stack_bytes
+    if config.get('keep_raw_repeats', False):
+        report.disk_bytes += (acquisitions - report.steps + stacked_steps) * step_bytes
+    extra = 0 if config.get('continuous', False) else _adaptive_budget(config)
+    report.adaptive_steps = extra
+    if extra:
+        # Refinement adds up to this many steps, costed like an average step of the grid
+        report.duration_s += (report.duration_s - FINISH_S) / report.steps * extra
+        report.disk_bytes += report.disk_bytes // report.steps * extra
+    if config.get('store', False):
+        report.disk_bytes *= 2  # the container holds a (compressed) copy, count it uncompressed
+    prefix_dir = _existing_dir(config.get('prefix', 'experiment'))
+    udp_dir = _existing_dir(config.get('dir', 'refls1'))
+    report.free_bytes = shutil.disk_usage(prefix_dir).free
+    if report.disk_bytes * (1 + DISK_MARGIN) > report.free_bytes:
+        report.errors.append(
+            f"Not enough disk space: the sweep needs about {report.disk_bytes / 1e9:.2f} GB, "
+            f"{report.free_bytes / 1e9:.2f} GB free; it would fill the disk around step "
+            f"{int(report.free_bytes / (report.disk_bytes / report.steps)) + 1}")
+    if os.stat(udp_dir).st_dev != os.stat(prefix_dir).st_dev:
+        free = shutil.disk_usage(udp_dir).free
+        if step_bytes * 2 > free:
+            report.errors.append(f"Capture directory has {free / 1e9:.2f} GB free, "
+                                 f"one step needs {step_bytes / 1e9:.2f} GB")
+        report.warnings.append("Capture and output directories are on different disks; "
+                               "every file is copied instead of renamed")
+
+
+def check_feedback(config, settings, report):
+    """The 'feedback' block: controlled setting, fibre position, gains, limits and timing."""
+    if settings['channel'] not in ('ch1', 'ch2', 'ch3') or settings['control'] not in ('v', 'b'):
+        report.errors.append(f"feedback controls {settings['channel']!r}.{settings['control']!r}; "
+                             f"expected a channel ch1..ch3 and 'v' or 'b'")
+    try:
+        numbers = {key: float(settings[key]) for key in ('setpoint', 'kp', 'ki', 'min', 'max', 'period', 'duration')}
+        position, width = int(settings['position']), int(settings['width'])
+    except (TypeError, ValueError) as e:
+        report.errors.append(f"feedback settings must be numbers: {e}")
+        return
+    if numbers['kp'] == 0 and numbers['ki'] == 0:
+        report.errors.append("feedback gains kp and ki are both 0; the output would never change")
+    if not 0.0 <= numbers['min'] < numbers['max'] < MAX_ENCODABLE:
+        report.errors.append(f"feedback output limits [{numbers['min']}, {numbers['max']}] are not an "
+                             f"increasing range within [0, {MAX_ENCODABLE})")
+    if numbers['period'] <= 0 or numbers['duration'] < numbers['period']:
+        report.errors.append(f"feedback period {numbers['period']} s must be positive and not longer "
+                             f"than the duration {numbers['duration']} s")
+        return
+    if numbers['period'] > 1.0:
+        report.warnings.append(f"feedback period {numbers['period']} s is slower than the one-second loop it is meant for")
+    try:
+        line_length, dtype, trace_rate = capture_layout(config)
+    except (TypeError, ValueError):
+        return  # reported by check_settings
+    samples = line_length // dtype.itemsize
+    if position < 0 or width < 1 or position + width > samples:
+        report.errors.append(f"feedback position {position} (width {width}) is outside the {samples} fibre samples")
+    if trace_rate <= 0:
+        return  # reported by check_settings
+    nrefls = feedback_nrefls(settings, trace_rate)
+    if nrefls / trace_rate > numbers['period']:
+        report.warnings.append(f"one feedback capture ({nrefls} traces) takes longer than the loop period; "
+                               f"commands will follow the capture rate")
+    step = config.get('steps', [{}])[0] if config.get('steps') else {}
+    freq = float(step.get(settings['channel'], {}).get('f', 0.0) or 0.0) if isinstance(step, dict) else 0.0
+    if settings['metric'] == 'amp' and freq > 0 and freq * nrefls / trace_rate < 2:
+        report.warnings.append(f"one feedback capture holds fewer than 2 periods of the {freq} Hz drive; "
+                               f"the amplitude will be noisy")
+
+
+def estimate_feedback(config, settings, report):
+    """A feedback run lasts its duration and keeps only a few short captures on disk."""
+    try:
+        line_length, _, trace_rate = capture_layout(config)
+        duration = float(settings['duration'])
+        nrefls = feedback_nrefls(settings, trace_rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return
+    report.duration_s = duration + FINISH_S
+    report.timing_source = 'feedback duration'
+    files = int(duration * trace_rate / nrefls) + 4 if settings['keep_stream'] else 4
+    report.disk_bytes = files * expected_capture_size(nrefls, line_length)
+    report.free_bytes = shutil.disk_usage(_existing_dir(config.get('prefix', 'experiment'))).free
+    if report.disk_bytes * (1 + DISK_MARGIN) > report.free_bytes:
+        report.errors.append(f"Not enough disk space: the feedback run needs {report.disk_bytes / 1e9:.2f} GB, "
+                             f"{report.free_bytes / 1e9:.2f} GB are free")
+
+
+def _adaptive_budget(config):
+    try:
+        return max(int(float(config.get('adaptive_budget', 0) or 0)), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def run_preflight(config, sleep_time=5.0, port_probe=True, catalog=None, exe=ACQUISITION_EXE):
+    """Check a sweep before it starts; returns a PreflightReport.
+
+    Timings come from catalog (an ExperimentCatalog) or, if not given, from the
+    catalog named in the config when that file already exists.
+    """
+    report = PreflightReport()
+    check_settings(config, report)
+    feedback = feedback_settings(config)
+    if feedback is None:
+        check_steps(config, report)
+    else:
+        # Steps are optional in feedback mode; the first one is the starting point
+        check_feedback(config, feedback, report)
+        if config.get('steps'):
+            check_steps(config, report)
+    probe_binary(report, exe)
+    if port_probe:
+        probe_port(report, config.get('port'))
+    own_catalog = None
+    if catalog is None and config.get('catalog', 'experiments.sqlite') \
+            and os.path.exists(config.get('catalog', 'experiments.sqlite')):
+        catalog = own_catalog = ExperimentCatalog.from_config(config)
+    try:
+        if feedback is None:
+            estimate(config, report, sleep_time, catalog)
+        else:
+            estimate_feedback(config, feedback, report)
+    finally:
+        if own_catalog is not None:
+            own_catalog.close()
+    return report
@@ -0,0 +1,123 @@
+from collections import deque
+from PyQt5.QtWidgets import QGroupBox, QGridLayout, QLabel, QProgressBar, QWidget, QSizePolicy
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QColor, QPainter, QFont
+
+STAGES = ['configure', 'settle', 'acquire', 'collect']
+STAGE_COLORS = {
+    'configure': QColor('#4f8cff'),
+    'settle': QColor('#8a8f9c'),
+    'acquire': QColor('#3fbf7f'),
+    'collect': QColor('#e0a040'),
+}
+
+
+def format_duration(seconds):
+    seconds = int(max(seconds, 0))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+class StepTimingChart(QWidget):
+    """Stacked bars of per-stage durations for the most recent steps."""
+
+    def __init__(self, max_steps=120, parent=None):
+        super().__init__(parent)
+        self.steps = deque(maxlen=max_steps)
+        self.setMinimumHeight(140)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
+    def clear(self):
+        self.steps.clear()
+        self.update()
+
+    def add_step(self, index, timings):
+        self.steps.append((index, timings))
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('#23272e'))
+        legend_h = 18
+        area = QRectF(4, legend_h + 4, self.width() - 8, self.height() - legend_h - 8)
+        painter.setFont(QFont("Segoe UI", 8))
+        x = 6
+        for stage in STAGES:
+            painter.fillRect(QRectF(x, 5, 10, 10), STAGE_COLORS[stage])
+            painter.setPen(QColor('#e0e6f0'))
+            painter.drawText(int(x + 14), 14, stage)
+            x += 80
+        if not self.steps:
+            painter.end()
+            return
+        longest = max(sum(t.get(s, 0.0) for s in STAGES) for _, t in self.steps) or 1.0
+        painter.drawText(int(area.right() - 70), 14, f"max {longest:.1f} s")
+        bar_w = area.width() / self.steps.maxlen
+        for i, (_, timings) in enumerate(self.steps):
+            y = area.bottom()
+            for stage in STAGES:
+                h = timings.get(stage, 0.0) / longest * area.height()
+                if h > 0:
+                    painter.fillRect(QRectF(area.left() + i * bar_w, y - h, max(bar_w - 1, 1), h),
+                                     STAGE_COLORS[stage])
+                    y -= h
+        painter.end()
+
+
+class ProgressDashboard(QGroupBox):
+    """Live sweep progress fed by batches of SweepProgress events."""
+
+    def __init__(self, parent=None):
+        super().__init__("Progress", parent)
+        layout = QGridLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat("%v / %m steps")
+        self.step_label = QLabel("Idle")
+        self.params_label = QLabel("")
+        self.time_label = QLabel("")
+        self.throughput_label = QLabel("")
+        self.chart = StepTimingChart()
+        layout.addWidget(self.progress_bar, 0, 0, 1, 2)
+        layout.addWidget(self.step_label, 1, 0)
+        layout.addWidget(self.time_label, 1, 1, Qt.AlignRight)
+        layout.addWidget(self.params_label, 2, 0)
+        layout.addWidget(self.throughput_label, 2, 1, Qt.AlignRight)
+        layout.addWidget(self.chart, 3, 0, 1, 2)
+        self.setLayout(layout)
+
+    def on_events(self, events):
+        """Apply a batch of events; only the latest state matters for the labels."""
+        for event in events:
+            kind = event.get('type')
+            if kind == 'start':
+                self.chart.clear()
+                self.progress_bar.setRange(0, max(event['total'], 1))
+                self.progress_bar.setValue(0)
+                self.step_label.setText("Starting...")
+                self.time_label.setText("")
+                self.throughput_label.setText("")
+            elif kind == 'stage':
+                self.step_label.setText(f"Step {event['index']}/{event['total']}: {event['stage']}")
+                self.params_label.setText(self._format_params(event['params']))
+            elif kind == 'step':
+                self.progress_bar.setValue(event['index'])
+                self.chart.add_step(event['index'], event['timings'])
+                self.time_label.setText(
+                    f"Elapsed {format_duration(event['elapsed'])}, ETA {format_duration(event['eta'])}")
+                self.throughput_label.setText(
+                    f"{event['steps_per_hour']:.0f} steps/h, {event['bytes_per_s'] / 1e6:.1f} MB/s, "
+                    f"{event['files']} files last step")
+            elif kind == 'finish':
+                self.step_label.setText(
+                    f"{event['status'].capitalize()}: {event['completed']} steps in "
+                    f"{format_duration(event['elapsed'])}")
+
+    @staticmethod
+    def _format_params(params):
+        parts = []
+        for ch in ('ch1', 'ch2', 'ch3'):
+            if ch in params:
+                p = params[ch]
+                parts.append(f"{ch} v={p.get('v')} b={p.get('b')} f={p.get('f')}")
+        return "   ".join(parts)
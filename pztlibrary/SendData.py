@@ -2,21 +2,42 @@
 import json
 import serial
 import struct
-import binascii
 from time import sleep
 import threading #开启线程 接收串口数据 20230505  Open thread, receive serial port data 20230505
 import datetime
-import time
+import logging
 
-# Init serial port
+try:
+    from . import protocol
+    from .log_pipeline import configure_logging
+except ImportError:
+    import protocol
+    from log_pipeline import configure_logging
+
+log = logging.getLogger('pzt.senddata')
+
+# Serial port, configured but not opened: importing this module does no I/O.
+# It is opened on first use (open_port / any send function).
 Usart = serial.Serial()
-Usart = serial.Serial(
-    #port='/dev/ttyUSB0',  # 串口 linux 开启串口 Serial port,linux Enables the serial port
-    port='com4',  # 串口 依据实际情况开启串口 Serial port,enable the serial port as required
-    baudrate=115200,  # 波特率 Baud rate
-    timeout=0.001)
-time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-print(time)
+#Usart.port = '/dev/ttyUSB0'  # 串口 linux 开启串口 Serial port,linux Enables the serial port
+Usart.port = 'com4'  # 串口 依据实际情况开启串口 Serial port,enable the serial port as required
+Usart.baudrate = 115200  # 波特率 Baud rate
+Usart.timeout = 0.001
+
+
+# 打开串口 Opens the serial port (once)
+def open_port(port=None):
+    if port is not None and port != Usart.port:
+        Usart.port = port
+    if not Usart.isOpen():
+        Usart.open()
+        # 判断串口是否打开成功 Check whether the serial port is successfully enabled
+        time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if Usart.isOpen():
+            print("open success,串口打开成功 " + time)
+        else:
+            print("open failed,串口打开失败 " + time)
+    return Usart
 
 #关闭串口  Closes the serial port
 def port_close():
@@ -30,145 +51,33 @@ def port_close():
 
 #将浮点数转化为4个unsigned char 类型的数据 Converts the floating-point number to four unsigned char types
 def DataAnla(f):
-    kk = [0xA4, 0x03, 0x08, 0x23]  # 需要发送的串口包 Serial port packet to be sent
-    print(kk)
-   # kk = struct.pack("%dB" % (len(kk)), *kk)  # 解析成16进制 Parse into hexadecimal
-   # print(kk)
-
-    print(f)
-    if f < 0:    #f中的内容为负数 The contents of f are negative
-        f = abs(f)  # 将F中的内容转换为正数 Convert the contents of F to positive numbers
-        a = int(f)
-        print(a)
-        kk[0] = int(a / 256) + 0x80    # 将F中的内容转换为负数 Convert the contents of F to a negative number
-        print(int(a / 256) + 0x80)
-        print(kk[0])
-        kk[1] = a % 256
-        print(kk[1])
-        print("f;")
-        print(f);
-        print("a=")
-        print(a);
-        a = int((f-a+0.00001) * 10000) #减小误差 error reduction
-        print("f - a")
-        print(a)
-        kk[2] = int(a / 256)
-        print(kk[2])
-        kk[3] = a % 256
-        print(kk[3])
-        kk = struct.pack("%dB" % (len(kk)), *kk)  # 解析成16进制 Parse into hexadecimal
-        #Usart.write(kk)
-        #print(kk)
-    else:
-        a = int(f)
-        print(a)
-        kk[0] = int(a / 256)
-        print(int(a/256))
-        print(kk[0])
-        kk[1] = a % 256
-        print(kk[1])
-        print((f-a))
-        a = int((f-a+0.00001) * 10000) #减小误差 error reduction
-        print(a)
-        kk[2] = int (a / 256)
-        print(kk[2])
-        kk[3] = a % 256
-        print(kk[3])
-
-    kk = struct.pack("%dB" % (len(kk)), *kk)  # 解析成16进制 Parse into hexadecimal
-    #Usart.write(kk)
-    print(kk)
-    return kk #将浮点数转化为4个unsigned char 类型的数据 Converts the floating-point number to four unsigned char types
+    return protocol.encode_float(f)
 
-def sendVf(f, channel_num: int):
-    sendArr = [0xaa, 0x01, 0x0b, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-    if  channel_num == 0:
-        pass
+
+def _channel_byte(channel_num: int) -> int:
+    # 0 -> 0, 1 -> 1, anything else -> 2
+    if channel_num == 0:
+        return 0x00
     elif channel_num == 1:
-        sendArr[5] = 0x01
-    else:
-        sendArr[5] = 0x02
-    kk = DataAnla(f) #将浮点数 编码 Encode floating-point numbers
-    sendArr[6] = kk[0]
-    sendArr[7] = kk[1]
-    sendArr[8] = kk[2]
-    sendArr[9] = kk[3]
-    print(sendArr)
-    Xor = 0x00
-    # 抑或校验位 BCC(Block Check Character）
-    for i in range(0,10):
-        #print(i)
-        Xor = sendArr[i] ^ Xor
-        print(Xor)
-    sendArr[10]= Xor
-    print("2SendArr")
-    print(sendArr)
-    sendArr = struct.pack("%dB" % (len(sendArr)), *sendArr)  # 解析成16进制 Parse into hexadecimal
-    Usart.write(sendArr)
-    print(sendArr)
+        return 0x01
+    return 0x02
+
+
+def sendVf(f, channel_num: int):
+    sendArr = protocol.voltage_packet(f, _channel_byte(channel_num))  # 含抑或校验位 with BCC
+    open_port().write(sendArr)
+    log.debug('TX %s', sendArr)
 
 
 def sendMovef(f, channel_num: int):
-    sendArr = [0xaa, 0x01, 0x0b, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-    if  channel_num == 0:
-        pass
-    elif channel_num == 1:
-        sendArr[5] = 0x01
-    else:
-        sendArr[5] = 0x02
-    kk = DataAnla(f) #将浮点数 编码 Encode floating-point numbers
-    sendArr[6] = kk[0]
-    sendArr[7] = kk[1]
-    sendArr[8] = kk[2]
-    sendArr[9] = kk[3]
-    print(sendArr)
-    # 抑或校验位 BCC(Block Check Character）
-    Xor = 0x00
-    for i in range(0,10):
-        #print(i)
-        Xor = sendArr[i] ^ Xor
-        print(Xor)
-    sendArr[10]= Xor
-    print("2SendArr")
-    print(sendArr)
-    sendArr = struct.pack("%dB" % (len(sendArr)), *sendArr)  # 解析成16进制 Parse into hexadecimal
-    Usart.write(sendArr)
-    print(sendArr)
+    sendArr = protocol.bias_packet(f, _channel_byte(channel_num))  # 含抑或校验位 with BCC
+    open_port().write(sendArr)
+    log.debug('TX %s', sendArr)
 
 def sendLowSpeedVoltageFreq(f, f2, waveform_type: str, channel_num: int):
-    sendArr = [0xaa, 0x01, 0x14, 0x0F, 0x00, 0x00, ord(waveform_type), 0x00, 0x00, 0x00,
-               0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-    if  channel_num == 0:
-        pass
-    elif channel_num == 1:
-        sendArr[5] = 0x01
-    else:
-        sendArr[5] = 0x02
-    kk = DataAnla(f) #将浮点数 编码 Encode floating-point numbers
-    sendArr[7] = kk[0]
-    sendArr[8] = kk[1]
-    sendArr[9] = kk[2]
-    sendArr[10] = kk[3]
-
-    kk = DataAnla(f2) #将浮点数 编码 Encode floating-point numbers
-    sendArr[11] = kk[0]
-    sendArr[12] = kk[1]
-    sendArr[13] = kk[2]
-    sendArr[14] = kk[3]
-
-    print(sendArr)
-    # 抑或校验位 BCC(Block Check Character）
-    Xor = 0x00
-    for i in range(0,20):
-        #print(i)
-        Xor = sendArr[i] ^ Xor
-        print(Xor)
-    sendArr[19]= Xor
-    print("[Waveform]2SendArr")
-    print(sendArr)
-    sendArr = struct.pack("%dB" % (len(sendArr)), *sendArr)  # 解析成16进制 Parse into hexadecimal
-    Usart.write(sendArr)
-    print(sendArr)
+    sendArr = protocol.waveform_packet(f, f2, waveform_type, _channel_byte(channel_num))
+    open_port().write(sendArr)
+    log.debug('TX %s', sendArr)
 # 串口接收数据 Parse into hexadecimal
 def recv(serial):
         while True:
@@ -225,24 +134,16 @@ def sendTest(uart):
     #    len = uart.write(chr(x).encode("utf-8"))
 
 
-
-# 判断串口是否打开成功 Check whether the serial port is successfully enabled
-if Usart.isOpen():
-    time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print("open success,串口打开成功 " + time)
-else:
-    time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print("open failed,串口打开失败 " + time)
-
 # 使用优雅的方式发送串口数据 Send serial port data in an elegant manner
 # 这里的数据可以根据你的需求进行修改 The data here can be modified to suit your needs
 
 
 def main():
+    configure_logging({'levels': {'senddata': 'DEBUG'}})
     send_data = [0xA4, 0x03, 0x08, 0x23, 0xD2]  # 需要发送的串口包 Serial port packet to be sent
 
     send_data = struct.pack("%dB" % (len(send_data)), *send_data)  # 解析成16进制 Parse into hexadecimal
-    Usart.write(send_data)
+    open_port().write(send_data)
     print(send_data)
 
     # 要发送的数据依照编码规则转化，10.001数字在开环情况下单位为电压，闭环情况下单位为微米或者或毫弧度
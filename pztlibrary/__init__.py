@@ -1,7 +1,9 @@
 """
 PZT Library for controlling piezo actuators.
 """
+from . import protocol
 from .usart_lib import SerialConfigurator, USARTError
+from .log_pipeline import configure_logging
 
 __version__ = "1.0.0"
-__all__ = ["SerialConfigurator", "USARTError"] 
\ No newline at end of file
+__all__ = ["SerialConfigurator", "USARTError", "configure_logging", "protocol"] 
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Logging pipeline
+---------------------------
+Leveled, structured logging for the library and the sweep service. Records
+are put on a queue and written by a background listener, so the serial and
+sweep threads never wait on a console or a file.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+# Every subsystem logs to a child of this logger, e.g. 'pzt.usart', 'pzt.sweep'
+ROOT = 'pzt'
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+_lock = threading.Lock()
+
+
+def get_logger(subsystem: str) -> logging.Logger:
+    return logging.getLogger(f'{ROOT}.{subsystem}')
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site (logger and message template).
+
+    Up to burst records pass at once, then rate per second; dropped records are
+    counted and reported as 'suppressed' on the next one that passes. Errors
+    always pass.
+    """
+
+    def __init__(self, rate: float = 20.0, burst: int = 50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+class ConsoleFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s', '%H:%M:%S')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += f' ({suppressed} similar messages suppressed)'
+        return text
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record; fields passed with extra={...} are kept as keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def _level(value) -> int:
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level {value!r}")
+    return level
+
+
+def configure_logging(settings: Optional[Dict] = None, console: bool = True):
+    """(Re)configure the 'pzt' loggers from the 'logging' block of config.json.
+
+    settings keys, all optional:
+    - level: default level, 'INFO'
+    - levels: per-subsystem levels, e.g. {"usart": "DEBUG", "sweep": "WARNING"}
+    - file: path of a JSON-lines log file (none by default)
+    - rate, burst: rate limit per call site in records/s and burst size (20, 50);
+      rate 0 turns it off
+
+    Records below a logger's level are dropped by the logging module before any
+    formatting, so disabled debug output costs one cached level check.
+    """
+    global _listener, _handler
+    settings = settings or {}
+    root = logging.getLogger(ROOT)
+    with _lock:
+        _stop()
+        root.setLevel(_level(settings.get('level', 'INFO')))
+        for name in list(logging.Logger.manager.loggerDict):
+            if name.startswith(ROOT + '.'):
+                logging.getLogger(name).setLevel(logging.NOTSET)
+        for subsystem, level in (settings.get('levels') or {}).items():
+            get_logger(subsystem).setLevel(_level(level))
+        root.propagate = False
+
+        handlers = []
+        if console:
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(ConsoleFormatter())
+            handlers.append(stream)
+        if settings.get('file'):
+            sink = logging.FileHandler(settings['file'], encoding='utf-8')
+            sink.setFormatter(JsonLinesFormatter())
+            handlers.append(sink)
+        if not handlers:
+            root.addHandler(logging.NullHandler())
+            _handler = root.handlers[-1]
+            return
+        log_queue = queue.SimpleQueue()
+        _handler = logging.handlers.QueueHandler(log_queue)
+        _handler.addFilter(RateLimitFilter(float(settings.get('rate', 20.0)), int(settings.get('burst', 50))))
+        root.addHandler(_handler)
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def _stop():
+    global _listener, _handler
+    root = logging.getLogger(ROOT)
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()  # drains the queue first
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def shutdown_logging():
+    """Flush everything still queued and close the sinks"""
+    with _lock:
+        _stop()
+
+
+atexit.register(shutdown_logging)
@@ -6,9 +6,11 @@ Demonstrates multichannel configuration using JSON settings
 
 import time
 from usart_lib import SerialConfigurator, load_configuration, USARTError
+from log_pipeline import configure_logging
 
 
 def main():
+    configure_logging({'levels': {'usart': 'DEBUG'}})
     try:
         # Load configuration
         config = load_configuration('config.json')
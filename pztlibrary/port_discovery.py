@@ -0,0 +1,144 @@
+"""
+Serial port discovery
+---------------------------
+Finds the piezo controller among the serial ports of the machine
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import serial
+from serial.tools import list_ports
+
+try:
+    from . import protocol
+except ImportError:
+    import protocol
+
+# "Channel 1 voltage = 0", i.e. part of the nullified state the device rests in
+# between runs. The protocol has no read-only command, so this frame is only
+# ever sent to candidate adapters (see is_candidate), never to other devices.
+PROBE_FRAME = protocol.voltage_packet(0.0, 0)
+# USB-serial bridges the controller is built with, by USB vendor ID:
+# WCH CH340, FTDI, Silicon Labs CP210x, Prolific PL2303
+CANDIDATE_VIDS = {0x1A86: 'WCH', 0x0403: 'FTDI', 0x10C4: 'Silicon Labs', 0x067B: 'Prolific'}
+# Frames from the controller start with the start byte and device address
+REPLY_HEADER = bytes([protocol.START_BYTE, protocol.DEVICE_ADDRESS])
+
+# Next to the sweep's config.json in the repository root, whatever the working directory
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serial_ports.json')
+
+log = logging.getLogger('pzt.discovery')
+
+
+def adapter_key(info) -> Optional[str]:
+    """Stable identity of a USB-serial adapter: its serial number, else VID:PID@location"""
+    if getattr(info, 'serial_number', None):
+        return info.serial_number
+    if getattr(info, 'vid', None) is not None:
+        return f"{info.vid:04X}:{info.pid:04X}@{info.location or info.device}"
+    return None
+
+
+def is_candidate(info) -> bool:
+    """Whether a port's adapter may be the controller (USB vendor in CANDIDATE_VIDS)"""
+    return getattr(info, 'vid', None) in CANDIDATE_VIDS
+
+
+def probe_port(port: str, baudrate: int = 115200, timeout: float = 0.3) -> Dict:
+    """Send PROBE_FRAME and collect whatever comes back within timeout"""
+    result = {'port': port, 'answered': False, 'reply': '', 'error': None}
+    try:
+        ser = serial.Serial(port=port, baudrate=baudrate, timeout=0, write_timeout=timeout)
+    except (serial.SerialException, OSError, ValueError) as e:
+        result['error'] = str(e)
+        return result
+    try:
+        ser.reset_input_buffer()
+        ser.write(PROBE_FRAME)
+        reply = b''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and len(reply) < 64:
+            reply += ser.read(64)
+            if REPLY_HEADER in reply:
+                break
+            time.sleep(0.01)
+        result['reply'] = reply.hex()
+        result['answered'] = REPLY_HEADER in reply
+    except (serial.SerialException, OSError) as e:
+        result['error'] = str(e)
+    finally:
+        ser.close()
+    return result
+
+
+def discover(ports: Optional[List[str]] = None, timeout: float = 0.3, max_workers: int = 16) -> List[Dict]:
+    """Probe the given ports, else those of candidate adapters, in parallel; one result per port.
+
+    Built-in, Bluetooth and other ports without a candidate USB vendor are
+    never written to unless named in ports.
+    """
+    infos = {info.device: info for info in list_ports.comports()}
+    if ports is None:
+        ports = [device for device, info in infos.items() if is_candidate(info)]
+        skipped = len(infos) - len(ports)
+        if skipped:
+            log.debug('Not probing %d ports without a candidate USB-serial adapter', skipped)
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ports))) as pool:
+        results = list(pool.map(lambda p: probe_port(p, timeout=timeout), ports))
+    for result in results:
+        info = infos.get(result['port'])
+        result['key'] = adapter_key(info) if info else None
+        result['description'] = info.description if info else ''
+    return results
+
+
+def load_cache(path: str = CACHE_PATH) -> Dict:
+    try:
+        with open(path, 'r') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache: Dict, path: str = CACHE_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def find_controller(cache_path: str = CACHE_PATH, probe: bool = True, timeout: float = 0.3) -> Optional[str]:
+    """Port of the piezo controller, or None.
+
+    An adapter that answered before (cached by adapter_key) is picked at once,
+    whatever port name it has now; otherwise the candidate adapters are probed
+    in parallel (see discover) and the first controller found is cached.
+    """
+    cache = load_cache(cache_path)
+    for info in list_ports.comports():
+        key = adapter_key(info)
+        if key is not None and key in cache:
+            if cache[key].get('port') != info.device:
+                cache[key]['port'] = info.device
+                save_cache(cache, cache_path)
+            return info.device
+    if not probe:
+        return None
+    for result in discover(timeout=timeout):
+        if result['answered']:
+            if result['key'] is not None:
+                cache[result['key']] = {'port': result['port'], 'description': result['description'],
+                                        'reply': result['reply'], 'found': datetime.now().isoformat(timespec='seconds')}
+                save_cache(cache, cache_path)
+            log.info('Found piezo controller on %s (%s)', result['port'], result['description'])
+            return result['port']
+    return None
@@ -0,0 +1,78 @@
+"""
+Protocol core
+---------------------------
+Pure packet encoding for the piezo controller, shared by SendData and
+usart_lib. No I/O and nothing happens on import.
+"""
+
+from typing import Dict, List
+
+START_BYTE = 0xAA
+DEVICE_ADDRESS = 0x01
+
+CMD_SET = 0x0B  # 11-byte packets
+SUB_VOLTAGE = 0x00
+SUB_BIAS = 0x01  # closed-loop "move"
+CMD_WAVEFORM = 0x14  # 20-byte packets
+SUB_LOW_SPEED_WAVEFORM = 0x0F
+
+# 'Z' sine, 'F' square, 'S' triangle, 'J' sawtooth
+VALID_WAVEFORMS = {'Z', 'F', 'S', 'J'}
+CHANNELS = ['ch1', 'ch2', 'ch3']
+
+# The integer part is sent in 15 bits, the top bit of the first byte is the sign
+MAX_ENCODABLE = 32768
+
+
+def encode_float(value: float) -> bytes:
+    """4-byte device encoding: sign+integer part in 2 bytes, 4 decimal digits in 2 bytes"""
+    magnitude = abs(value)
+    a = int(magnitude)
+    high = a // 256 + (0x80 if value < 0 else 0)
+    decimal = int((magnitude - a + 0.00001) * 10000)  # small offset against float error
+    return bytes([high, a % 256, decimal // 256, decimal % 256])
+
+
+def xor_checksum(data) -> int:
+    """BCC (block check character) of the given bytes"""
+    checksum = 0x00
+    for byte in data:
+        checksum ^= byte
+    return checksum
+
+
+def build_packet(command: int, subcmd: int, channel: int, data: bytes) -> bytes:
+    """Header, data and trailing XOR of everything before it"""
+    packet = bytes([START_BYTE, DEVICE_ADDRESS, command, subcmd, 0x00, channel]) + bytes(data)
+    return packet + bytes([xor_checksum(packet)])
+
+
+def voltage_packet(voltage: float, channel: int) -> bytes:
+    return build_packet(CMD_SET, SUB_VOLTAGE, channel, encode_float(voltage))
+
+
+def bias_packet(bias: float, channel: int) -> bytes:
+    return build_packet(CMD_SET, SUB_BIAS, channel, encode_float(bias))
+
+
+def waveform_packet(voltage: float, freq: float, wave_type: str, channel: int) -> bytes:
+    """20-byte low-speed waveform packet; the XOR sits in the last byte"""
+    payload = bytearray(20)
+    payload[0:6] = [START_BYTE, DEVICE_ADDRESS, CMD_WAVEFORM, SUB_LOW_SPEED_WAVEFORM, 0x00, channel]
+    payload[6] = ord(wave_type.upper())
+    payload[7:11] = encode_float(voltage)
+    payload[11:15] = encode_float(freq)
+    payload[19] = xor_checksum(payload[:19])
+    return bytes(payload)
+
+
+def channel_packets(config: Dict) -> List[bytes]:
+    """Voltage, bias and waveform packets for all 3 channels of a validated config"""
+    wave_type = config.get('wave_type', 'Z').upper()
+    packets = []
+    for ch_idx, ch_key in enumerate(CHANNELS):
+        ch = config[ch_key]
+        voltage, bias, freq = ch.get('v', 0.0), ch.get('b', 0.0), ch.get('f', 0.0)
+        packets += [voltage_packet(voltage, ch_idx), bias_packet(bias, ch_idx),
+                    waveform_packet(voltage, freq, wave_type, ch_idx)]
+    return packets
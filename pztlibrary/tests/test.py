@@ -1,5 +1,6 @@
 # tests/test_senddata.py
 
+import os
 import unittest
 from unittest.mock import MagicMock, patch
 
@@ -204,5 +205,196 @@ class TestSendTestEnhanced(unittest.TestCase):
         self.assertEqual(fake.written, first + first)
 
 
+class FlakySerial(FakeSerial):
+    """FakeSerial whose writes fail once the adapter is 'unplugged'."""
+    unplugged = False
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        if FlakySerial.unplugged:
+            raise serial.SerialException("device not found")
+        super().__init__(*args, **kwargs)
+        FlakySerial.opened += 1
+        self.is_open = True
+
+    def write(self, data):
+        if FlakySerial.unplugged:
+            raise serial.SerialException("write failed")
+        return super().write(data)
+
+    def close(self):
+        super().close()
+        self.is_open = False
+
+
+class TestSerialReconnect(unittest.TestCase):
+    STEP = {'ch1': {'v': 1.0, 'b': 2.0, 'f': 3.0}, 'ch2': {'v': 0, 'b': 0, 'f': 0},
+            'ch3': {'v': 0, 'b': 0, 'f': 0}, 'wave_type': 'Z'}
+
+    def setUp(self):
+        FlakySerial.unplugged = False
+        FlakySerial.opened = 0
+        patcher = patch('usart_lib.serial.Serial', FlakySerial)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        from usart_lib import SerialConfigurator
+        self.sc = SerialConfigurator(port='com4', reconnect_attempts=3)
+        self.opened = FlakySerial.opened
+
+    def test_write_failure_reconnects_and_resends(self):
+        self.sc.configure_channels(self.STEP)
+        FlakySerial.unplugged = True
+        replug = self.sc.reconnect
+        def glitch(restore=True):
+            FlakySerial.unplugged = False
+            return replug(restore)
+        self.sc.reconnect = glitch
+        self.sc.configure_channels(dict(self.STEP, ch1={'v': 4.0, 'b': 0.0, 'f': 1.0}))
+        self.assertEqual(FlakySerial.opened, self.opened + 1)
+        self.assertEqual(len(self.sc.ser.written), 3 * (11 + 11 + 20))
+        self.assertEqual(self.sc.last_config['ch1']['v'], 4.0)
+
+    def test_reconnect_restores_last_config(self):
+        self.sc.configure_channels(self.STEP)
+        sent = self.sc.ser.written
+        self.assertTrue(self.sc.reconnect())
+        self.assertEqual(self.sc.ser.written, sent)
+
+    def test_gives_up_after_bounded_attempts(self):
+        from usart_lib import USARTError
+        self.sc.configure_channels(self.STEP)
+        FlakySerial.unplugged = True
+        with self.assertRaises(USARTError):
+            self.sc.configure_channels(self.STEP)
+        self.assertEqual(FlakySerial.opened, self.opened)
+
+
+class TestProtocolCore(unittest.TestCase):
+    """SendData and SerialConfigurator both go through the protocol core."""
+
+    def setUp(self):
+        import protocol
+        from usart_lib import SerialConfigurator
+        self.protocol = protocol
+        self.sc = SerialConfigurator.__new__(SerialConfigurator)
+        self.fake = FakeSerial()
+        SendData.Usart = self.fake
+
+    def test_encode_matches_dataanla(self):
+        for value in (0.0, 2.0, 3.1415, -1.5, 10.001, -300.25):
+            self.assertEqual(self.protocol.encode_float(value), SendData.DataAnla(value))
+
+    def test_both_paths_build_identical_packets(self):
+        for ch in (0, 1, 2):
+            self.fake.written = b""
+            SendData.sendVf(1.23, ch)
+            SendData.sendMovef(-4.5, ch)
+            SendData.sendLowSpeedVoltageFreq(1.23, 50.0, 'S', ch)
+            expected = (self.sc.send_voltage(1.23, ch) + self.sc.send_bias(-4.5, ch)
+                        + self.sc.send_waveform(1.23, 50.0, 'S', ch))
+            self.assertEqual(self.fake.written, expected)
+
+    def test_channel_packets(self):
+        config = {'ch1': {'v': 1.0, 'b': 0.0, 'f': 2.0}, 'ch2': {'v': 0, 'b': 0, 'f': 0},
+                  'ch3': {'v': 0, 'b': 0, 'f': 0}, 'wave_type': 'z'}
+        packets = self.protocol.channel_packets(config)
+        self.assertEqual([len(p) for p in packets], [11, 11, 20] * 3)
+        self.assertEqual(packets[2][6], ord('Z'))
+        for p in packets:
+            self.assertEqual(self.protocol.xor_checksum(p[:-1]), p[-1])
+
+
+class FakePortInfo:
+    def __init__(self, device, serial_number):
+        self.device = device
+        self.serial_number = serial_number
+        self.vid, self.pid, self.location = 0x1A86, 0x7523, None
+        self.description = f"USB-SERIAL ({device})"
+
+
+class ControllerSerial(FakeSerial):
+    """FakeSerial that answers like the controller on one port only."""
+    controller_port = 'COM7'
+
+    def __init__(self, *args, port=None, **kwargs):
+        super().__init__()
+        self.port = port
+        self.is_open = True
+
+    def reset_input_buffer(self):
+        self._read_buf = b""
+
+    def write(self, data):
+        if self.port == ControllerSerial.controller_port:
+            self._read_buf += bytes([0xAA, 0x01]) + data[2:]
+        return super().write(data)
+
+
+class TestPortDiscovery(unittest.TestCase):
+    def setUp(self):
+        import tempfile, port_discovery
+        self.pd = port_discovery
+        self.cache = os.path.join(tempfile.mkdtemp(), 'ports.json')
+        self.ports = [FakePortInfo('COM3', 'A1'), FakePortInfo('COM7', 'B2')]
+        for patcher in (patch.object(port_discovery.list_ports, 'comports', lambda: self.ports),
+                        patch.object(port_discovery.serial, 'Serial', ControllerSerial)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_probe_finds_controller_and_caches_adapter(self):
+        self.assertEqual(self.pd.find_controller(self.cache, timeout=0.05), 'COM7')
+        self.assertIn('B2', self.pd.load_cache(self.cache))
+
+    def test_cached_adapter_found_under_new_name_without_probing(self):
+        self.pd.find_controller(self.cache, timeout=0.05)
+        self.ports[1].device = 'COM9'
+        ControllerSerial.controller_port = None
+        try:
+            self.assertEqual(self.pd.find_controller(self.cache, probe=False), 'COM9')
+        finally:
+            ControllerSerial.controller_port = 'COM7'
+
+    def test_only_candidate_adapters_are_probed(self):
+        self.ports[1].vid = None
+        self.assertIsNone(self.pd.find_controller(self.cache, timeout=0.05))
+        self.assertEqual([r['port'] for r in self.pd.discover(timeout=0.05)], ['COM3'])
+
+    def test_auto_port_reconnect_follows_renamed_adapter(self):
+        from usart_lib import SerialConfigurator
+        find = self.pd.find_controller
+        with patch.object(self.pd, 'find_controller', lambda probe=True: find(self.cache, probe, 0.05)):
+            sc = SerialConfigurator(port='auto', reconnect_attempts=2, reconnect_delay=0)
+            self.assertEqual(sc.port, 'COM7')
+            self.ports[1].device = 'COM9'
+            self.assertTrue(sc.reconnect(restore=False))
+        self.assertEqual(sc.port, 'COM9')
+
+
+class TestTrafficRecorder(unittest.TestCase):
+    def test_round_trip_and_replay(self):
+        import tempfile, traffic_recorder as tr
+        path = os.path.join(tempfile.mkdtemp(), 'serial.pztraf')
+        with tr.TrafficRecorder(path) as rec:
+            rec.step = 4
+            rec.tx(b'\xaa\x01')
+            rec.rx(b'OK')
+            rec.record(tr.TX, b'x' * 70000, step=5)
+        frames = list(tr.read_traffic(path))
+        self.assertEqual([(d, s) for _, d, s, _ in frames], [(tr.TX, 4), (tr.RX, 4), (tr.TX, 5), (tr.TX, 5)])
+        target = FakeSerial()
+        stats = tr.replay(path, target, speed=None, steps={5})
+        self.assertEqual((stats['frames'], stats['bytes']), (2, 70000))
+
+
+class TestLogPipeline(unittest.TestCase):
+    def test_rate_limit_per_call_site(self):
+        import logging, log_pipeline
+        limit = log_pipeline.RateLimitFilter(rate=0.001, burst=2)
+        record = lambda msg, level=logging.INFO: logging.LogRecord('pzt.usart', level, '', 0, msg, (), None)
+        self.assertEqual([limit.filter(record('TX %s')) for _ in range(4)], [True, True, False, False])
+        self.assertTrue(limit.filter(record('RX %s')))
+        self.assertTrue(limit.filter(record('TX %s', logging.ERROR)))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,182 @@
+"""
+Serial traffic recorder
+---------------------------
+Compact binary log of every TX/RX frame with monotonic timestamps and the
+sweep step, plus replay of a recorded session to a port or simulator
+"""
+
+import queue
+import struct
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+MAGIC = b'PZTRAF01'
+# wall-clock time and monotonic time at the start of the recording
+HEADER = struct.Struct('<dd')
+# seconds since start, direction, step (NO_STEP if none), payload length
+RECORD = struct.Struct('<dBIH')
+
+TX = 0
+RX = 1
+NO_STEP = 0xFFFFFFFF
+
+
+class TrafficRecorder:
+    """Appends frames to a recording from a background writer thread.
+
+    record() only timestamps the frame and puts it on a queue, so the serial
+    path never waits on the disk; the writer drains the queue in batches
+    through a buffered file and flushes at least every flush_interval seconds.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, buffer_size: int = 1 << 20):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.step: Optional[int] = None
+        self.frames = 0
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, 'wb', buffering=buffer_size)
+        self._t0 = time.monotonic()
+        self._file.write(MAGIC + HEADER.pack(time.time(), self._t0))
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def record(self, direction: int, data: bytes, step: Optional[int] = None):
+        if not data:
+            return
+        if step is None:
+            step = self.step
+        self._queue.put((time.monotonic() - self._t0, direction,
+                         NO_STEP if step is None else step, bytes(data)))
+
+    def tx(self, data: bytes):
+        self.record(TX, data)
+
+    def rx(self, data: bytes):
+        self.record(RX, data)
+
+    def _writer(self):
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            batch = [item]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    running = False
+                elif item:
+                    t, direction, step, data = item
+                    # Frames longer than a record can hold are split
+                    for i in range(0, len(data), 0xFFFF):
+                        chunk = data[i:i + 0xFFFF]
+                        self._file.write(RECORD.pack(t, direction, step, len(chunk)))
+                        self._file.write(chunk)
+                    self.frames += 1
+            if not running or time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.close()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_header(path: str) -> Tuple[float, float]:
+    """(wall-clock start, monotonic start) of a recording"""
+    with open(path, 'rb') as f:
+        head = f.read(len(MAGIC) + HEADER.size)
+    if head[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a traffic recording")
+    return HEADER.unpack(head[len(MAGIC):])
+
+
+def read_traffic(path: str) -> Iterator[Tuple[float, int, Optional[int], bytes]]:
+    """Yield (seconds since start, direction, step or None, data); a torn tail is ignored"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a traffic recording")
+    pos = len(MAGIC) + HEADER.size
+    while pos + RECORD.size <= len(data):
+        t, direction, step, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        if pos + length > len(data):
+            break
+        yield t, direction, None if step == NO_STEP else step, data[pos:pos + length]
+        pos += length
+
+
+def replay(path: str, target, speed: Optional[float] = 1.0, direction: int = TX, steps=None) -> dict:
+    """Write the recorded frames of one direction to target (anything with write()).
+
+    speed 1.0 keeps the original timing, 2.0 runs twice as fast and None sends
+    as fast as possible. steps, if given, limits the replay to those step ids.
+    Returns frame and byte counts, elapsed time and, for timed replay, the
+    worst lateness against the recorded schedule.
+    """
+    frames = [(t, d) for t, dr, step, d in read_traffic(path)
+              if dr == direction and (steps is None or step in steps)]
+    stats = {'frames': 0, 'bytes': 0, 'elapsed': 0.0, 'max_late': 0.0}
+    if not frames:
+        return stats
+    t_first = frames[0][0]
+    start = time.monotonic()
+    for t, data in frames:
+        if speed:
+            due = start + (t - t_first) / speed
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                stats['max_late'] = max(stats['max_late'], -wait)
+        target.write(data)
+        stats['frames'] += 1
+        stats['bytes'] += len(data)
+    stats['elapsed'] = time.monotonic() - start
+    return stats
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Inspect or replay a serial traffic recording")
+    sub = parser.add_subparsers(dest='command', required=True)
+    dump = sub.add_parser('dump', help="print every frame")
+    dump.add_argument('recording')
+    play = sub.add_parser('replay', help="send the recorded TX frames to a serial port")
+    play.add_argument('recording')
+    play.add_argument('port')
+    play.add_argument('--speed', default='1', help="time scale (2 = twice as fast) or 'max'")
+    play.add_argument('--baudrate', type=int, default=115200)
+    args = parser.parse_args()
+
+    if args.command == 'dump':
+        for t, direction, step, data in read_traffic(args.recording):
+            print(f"{t:12.6f} {'TX' if direction == TX else 'RX'} step={step} {data.hex()}")
+        return
+    import serial
+    speed = None if args.speed == 'max' else float(args.speed)
+    with serial.Serial(port=args.port, baudrate=args.baudrate, timeout=0) as ser:
+        stats = replay(args.recording, ser, speed)
+    print(f"Replayed {stats['frames']} frames ({stats['bytes']} bytes) in {stats['elapsed']:.3f} s, "
+          f"max lateness {stats['max_late'] * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,24 @@ Enhanced version supporting multichannel configuration
 """
 
 import json
+import logging
 import serial
-import struct
 import threading 
 from time import sleep
 from typing import Dict, List, Optional
-from datetime import datetime
+
+try:
+    from . import protocol
+except ImportError:
+    import protocol
+
+log = logging.getLogger('pzt.usart')
+
+
+def _log_packet(packet: bytes):
+    # Hex dumps only when the debug level is on for 'pzt.usart'
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('TX %s', packet.hex())
 
 
 class USARTError(Exception):
@@ -31,20 +43,51 @@ class SerialConfigurator:
     - 'J': 锯齿波 (Sawtooth waveform)
     """
 
-    VALID_WAVEFORMS = {'Z', 'F', 'S', 'J'}
-    CHANNELS = ['ch1', 'ch2', 'ch3']
+    VALID_WAVEFORMS = protocol.VALID_WAVEFORMS
+    CHANNELS = protocol.CHANNELS
 
-    def __init__(self, port: str = 'com4',
+    def __init__(self, port: Optional[str] = None,
                  baudrate: int = 115200,
-                 timeout: float = 0.000):
+                 timeout: float = 0.000,
+                 reconnect_attempts: int = 6,
+                 reconnect_delay: float = 0.5,
+                 reconnect_max_delay: float = 8.0,
+                 recorder=None):
+        # With 'auto' the port is looked up again on reconnect, as the adapter
+        # may come back under another name
+        self.auto_port = not port or port.lower() == 'auto'
+        if self.auto_port:
+            port = self._discover_port()
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
+        # A lost port is reopened up to reconnect_attempts times, waiting
+        # reconnect_delay, then twice as long each time up to reconnect_max_delay
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        # Last configuration the device accepted, re-sent after a reconnect
+        self.last_config: Optional[Dict] = None
+        # Optional traffic_recorder.TrafficRecorder that gets every TX and RX frame
+        self.recorder = recorder
+        self._lock = threading.RLock()
         self.ser = serial.Serial()
         self._init_serial()
         self.rx_thread: Optional[threading.Thread] = None
         self.running = False
 
+    @staticmethod
+    def _discover_port(probe: bool = True) -> str:
+        """Port of the piezo controller found by port_discovery (cached per adapter)"""
+        try:
+            from .port_discovery import find_controller
+        except ImportError:
+            from port_discovery import find_controller
+        port = find_controller(probe=probe)
+        if port is None:
+            raise USARTError("No piezo controller found on any serial port")
+        return port
+
     def _init_serial(self):
         """Initialize serial connection with error handling"""
         try:
@@ -57,156 +100,133 @@ class SerialConfigurator:
             if not self.ser.is_open:
                 raise USARTError(f"Failed to open {self.port}")
 
-            print(f"Connected to {self.port} @ {self.baudrate} baud")
+            log.info('Connected to %s @ %d baud', self.port, self.baudrate)
 
         except serial.SerialException as e:
             raise USARTError(f"Serial init failed: {str(e)}") from e
 
     def configure_channels(self, config: dict):
-        """EXACT reproduction of original configuration sequence"""
+        """EXACT reproduction of original configuration sequence
+
+        If the port is lost while sending, it is reopened (see reconnect) and
+        the whole configuration is sent again.
+        """
         try:
             # Validate first
-            print('1')
             safe_config = config.copy()
             self.validate_config(safe_config)
-            print('1')
-            wave_type = safe_config.get('wave_type', 'Z').upper()
-            print('1')
-            # Process all 3 channels
-            for ch_idx, ch_key in enumerate(self.CHANNELS):
-                print('2')
-                ch_config = safe_config[ch_key]
-                print('3')
-                voltage = ch_config.get('v', 0.0)
-                bias = ch_config.get('b', 0.0)
-                freq = ch_config.get('f', 0.0)
-                try:
-                    v_packet = self.send_voltage(voltage, ch_idx)
-                    self.ser.write(v_packet)
-                    b_packet = self.send_bias(bias, ch_idx)
-                    self.ser.write(b_packet)
-                    w_packet = self.send_waveform(
-                        voltage=voltage,
-                        freq=freq,
-                        wave_type=wave_type,
-                        channel=ch_idx
-                    )
-                    self.ser.write(w_packet)
-                except USARTError as e:
-                    print(f"Channel {ch_idx+1} configuration error: {str(e)}")
-                    continue
-
+            try:
+                self._send_config(safe_config)
+            except serial.SerialTimeoutException:
+                raise
+            except (serial.SerialException, OSError) as e:
+                if not self.reconnect_attempts:
+                    raise
+                log.warning('Lost %s while configuring (%s), reconnecting', self.port, e)
+                # The retry below sends the full new state, no need to restore the old one first
+                self.reconnect(restore=False)
+                self._send_config(safe_config)
+            self.last_config = safe_config
+
+        except USARTError:
+            raise
         except Exception as e:
             raise USARTError(f"Configuration failed: {str(e)}") from e
 
+    def _send_config(self, safe_config: dict):
+        """Write voltage, bias and waveform packets for all 3 channels"""
+        wave_type = safe_config.get('wave_type', 'Z').upper()
+        # Process all 3 channels
+        for ch_idx, ch_key in enumerate(self.CHANNELS):
+            ch_config = safe_config[ch_key]
+            voltage = ch_config.get('v', 0.0)
+            bias = ch_config.get('b', 0.0)
+            freq = ch_config.get('f', 0.0)
+            try:
+                v_packet = self.send_voltage(voltage, ch_idx)
+                b_packet = self.send_bias(bias, ch_idx)
+                w_packet = self.send_waveform(
+                    voltage=voltage,
+                    freq=freq,
+                    wave_type=wave_type,
+                    channel=ch_idx
+                )
+            except USARTError as e:
+                log.error('Channel %d configuration error: %s', ch_idx + 1, e)
+                continue
+            with self._lock:
+                for packet in (v_packet, b_packet, w_packet):
+                    self.ser.write(packet)
+                    if self.recorder is not None:
+                        self.recorder.tx(packet)
+
+    def reconnect(self, restore: bool = True) -> bool:
+        """Reopen a lost port with bounded exponential backoff.
+
+        With restore, the last accepted configuration is sent again once the
+        port is back. With port 'auto' each attempt first looks the cached
+        adapter up again (without probing), so a controller that re-enumerated
+        under another name is followed. Raises USARTError when every attempt failed.
+        """
+        delay = self.reconnect_delay
+        for attempt in range(1, self.reconnect_attempts + 1):
+            # Give the USB adapter time to re-enumerate before each try
+            sleep(delay)
+            with self._lock:
+                try:
+                    self.ser.close()
+                except (serial.SerialException, OSError):
+                    pass
+                try:
+                    if self.auto_port:
+                        port = self._discover_port(probe=False)
+                        if port != self.port:
+                            log.info('Controller moved from %s to %s', self.port, port)
+                            self.port = port
+                    self._init_serial()
+                    if restore and self.last_config is not None:
+                        self._send_config(self.last_config)
+                    log.info('Reconnected to %s (attempt %d/%d)', self.port, attempt, self.reconnect_attempts)
+                    return True
+                except (USARTError, serial.SerialException, OSError) as e:
+                    log.warning('Reconnect to %s failed (attempt %d/%d): %s',
+                                self.port, attempt, self.reconnect_attempts, e)
+            delay = min(delay * 2, self.reconnect_max_delay)
+        raise USARTError(f"Lost {self.port} and could not reconnect after {self.reconnect_attempts} attempts")
+
     def send_voltage(self, voltage: float, channel: int):
-        v_bytes = self._float_to_bytes(voltage)
-        return self._build_packet(
-            command=0x0B,
-            subcmd=0x00,
-            channel=channel,
-            data_bytes=v_bytes
-        )
+        send_arr = protocol.voltage_packet(voltage, channel)
+        _log_packet(send_arr)
+        return send_arr
 
     def send_bias(self, bias: float, channel: int):
         """Reproduce exact Move command structure"""
-        b_bytes = self._float_to_bytes(bias)
-        return self._build_packet(
-            command=0x0B,
-            subcmd=0x01,
-            channel=channel,
-            data_bytes=b_bytes
-        )
+        send_arr = protocol.bias_packet(bias, channel)
+        _log_packet(send_arr)
+        return send_arr
 
     def send_waveform(self, voltage: float, freq: float, wave_type: str, channel: int):
         """EXACT reproduction of original sendLowSpeedVoltageFreq"""
-        # Create 20-byte array initialized with zeros
-        payload = [0x00] * 20
-
-        # Set fixed header values
-        payload[0] = 0xAA
-        payload[1] = 0x01
-        payload[2] = 0x14  # Command
-        payload[3] = 0x0F  # Subcommand
-        payload[4] = 0x00  # Reserved
-        payload[5] = channel  # Channel selection
-
-        # Set waveform type
-        payload[6] = ord(wave_type.upper())
-
-        # Add voltage bytes at positions 7-10
-        v_bytes = self._float_to_bytes(voltage)
-        payload[7:11] = v_bytes
-
-        # Add frequency bytes at positions 11-14
-        f_bytes = self._float_to_bytes(freq)
-        payload[11:15] = f_bytes
-
-        # Calculate XOR checksum for ALL 20 bytes
-        xor = 0
-        for b in payload:
-            xor ^= b
-
-        # Set XOR at position 19
-        payload[19] = xor
-        send_arr = struct.pack("%dB" % (len(payload)), *payload)  # 解析成16进制 Parse into hexadecimal
-        print(send_arr)
+        send_arr = protocol.waveform_packet(voltage, freq, wave_type, channel)  # 解析成16进制 Parse into hexadecimal
+        _log_packet(send_arr)
         return send_arr
 
     def _build_packet(self, command: int, subcmd: int, channel: int, data_bytes: list) -> bytes:
         """Fixed packet builder with explicit parameters"""
-        header = [
-            0xAA,  # Start byte
-            0x01,  # Device address
-            command,
-            subcmd,
-            0x00,  # Reserved
-            channel
-        ]
-
-        packet = header + data_bytes
-        packet = packet  # Ensure exactly 10 bytes for XOR calculation
-
-        # Calculate XOR checksum
-        xor = 0x00
-        for b in packet:
-            xor ^= b
-
-        packet.append(xor)
-        send_arr = struct.pack("%dB" % (len(packet)), *packet)
-        print(send_arr)
+        send_arr = protocol.build_packet(command, subcmd, channel, data_bytes)
+        _log_packet(send_arr)
         return send_arr
 
     def _float_to_bytes(self, value: float) -> list:
         """EXACT reproduction of original DataAnla logic"""
         try:
-            if value < 0:
-                f_abs = abs(value)
-                a = int(f_abs)
-                byte0 = (a // 256) + 0x80
-                byte1 = a % 256
-                decimal = int((f_abs - a + 0.00001) * 10000)
-            else:
-                a = int(value)
-                byte0 = a // 256
-                byte1 = a % 256
-                decimal = int((value - a + 0.00001) * 10000)
-
-            byte2 = decimal // 256
-            byte3 = decimal % 256
-
-            return [byte0, byte1, byte2, byte3]
+            return list(protocol.encode_float(value))
         except Exception as e:
             raise USARTError(f"Float conversion failed: {str(e)}") from e
 
     def _calculate_xor(self, data: List[int]) -> int:
         """Calculate XOR checksum"""
-        print(len(data))
-        checksum = 0x00
-        for byte in data:
-            checksum ^= byte
-            print(checksum)
-        return checksum
+        return protocol.xor_checksum(data)
 
     def validate_config(self, config: Dict):
         """Validate configuration structure"""
@@ -218,36 +238,45 @@ class SerialConfigurator:
         # Ensure all channels exist
         for ch in self.CHANNELS:
             if ch not in config:
-                print(f"Warning: Missing {ch}, using defaults values like 'v': 0.0")
+                log.warning("Missing %s, using defaults values like 'v': 0.0", ch)
                 config[ch] = defaults.copy()
             else:
                 # Check individual keys
                 for key in ['v', 'b', 'f']:
                     if key not in config[ch]:
-                        print(f"Warning: {ch} missing '{key}', using 0.0")
+                        log.warning("%s missing '%s', using 0.0", ch, key)
                         config[ch][key] = 0.0
 
         # Handle waveform type
         wave = config.get('wave_type', 'Z').upper()
         if wave not in self.VALID_WAVEFORMS:
-            print(f"Invalid waveform '{wave}', defaulting to 'Z', sin waveform")
+            log.warning("Invalid waveform '%s', defaulting to 'Z', sin waveform", wave)
             config['wave_type'] = 'Z'
 
     def start_monitoring(self):
         """Start background data monitoring"""
         self.running = True
-        self.rx_thread = threading.Thread(target=self._monitor_serial, daemon=True)
+        self.rx_thread = threading.Thread(target=self._monitor_serial, name='serial-rx', daemon=True)
         self.rx_thread.start()
 
     def _monitor_serial(self):
-        """Background serial monitoring thread"""
-        while self.running and self.ser.is_open:
-            if self.ser.in_waiting:
+        """Background serial monitoring thread
+
+        Keeps running across a lost port; reconnecting is left to the writer side.
+        """
+        while self.running:
+            data = b''
+            with self._lock:
                 try:
-                    data = self.ser.read_all()
-                    print(f"RX: {datetime.now().isoformat()} - {data.hex()}")
-                except serial.SerialException:
-                    break
+                    if self.ser.is_open and self.ser.in_waiting:
+                        data = self.ser.read_all()
+                except (serial.SerialException, OSError):
+                    pass
+            if data:
+                if self.recorder is not None:
+                    self.recorder.rx(data)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug('RX %s', data.hex())
             sleep(0.01)
 
     def __enter__(self):
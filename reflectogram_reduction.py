@@ -0,0 +1,131 @@
+import os
+import numpy as np
+
+from das_capture import capture_layout, list_captures, open_capture
+from repeat_stacking import has_stack, open_stack
+
+CHANNELS = ['ch1', 'ch2', 'ch3']
+SUMMARY_SUFFIX = '.summary.npz'
+
+
+def summary_path(step_dir):
+    """Summary file that sits next to a step folder."""
+    return os.path.normpath(step_dir) + SUMMARY_SUFFIX
+
+
+class StepReducer:
+    """Single-pass reduction of one step's reflectograms.
+
+    Produces per fibre position: mean trace, variance, RMS and the amplitude of the
+    slow-time spectrum at each channel's drive frequency. Files are memory-mapped
+    and processed in blocks of chunk_traces reflectograms, so memory stays bounded
+    regardless of nrefls.
+    """
+
+    def __init__(self, line_length, dtype='uint8', trace_rate=1000.0, chunk_traces=1024):
+        self.line_length = line_length
+        self.dtype = np.dtype(dtype)
+        self.trace_rate = float(trace_rate)
+        self.chunk_traces = chunk_traces
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        line_length, dtype, trace_rate = capture_layout(config)
+        return cls(line_length, dtype, trace_rate, **kwargs)
+
+    def reduce_files(self, paths, freqs):
+        """Reduce capture files; freqs are the drive frequencies in Hz (one per channel)."""
+        return self.reduce_arrays((open_capture(path, self.line_length, self.dtype) for path in paths), freqs)
+
+    def reduce_arrays(self, arrays, freqs):
+        """Reduce (n_traces, samples) arrays, one per capture file (e.g. the files of a stack)."""
+        freqs = np.asarray(freqs, dtype=np.float64)
+        samples = self.line_length // self.dtype.itemsize
+        count = 0
+        mean = np.zeros(samples)
+        m2 = np.zeros(samples)
+        sumsq = np.zeros(samples)
+        amp_sum = np.zeros((len(freqs), samples))
+        amp_files = 0
+        for data in arrays:
+            n_file = data.shape[0]
+            if n_file == 0:
+                continue
+            # Single-bin DFT along slow time, accumulated per block; the file mean is
+            # removed at the end via the phasor sum so no second pass is needed.
+            re = np.zeros((len(freqs), samples))
+            im = np.zeros((len(freqs), samples))
+            ph_re = np.zeros(len(freqs))
+            ph_im = np.zeros(len(freqs))
+            file_sum = np.zeros(samples)
+            for start in range(0, n_file, self.chunk_traces):
+                block = np.asarray(data[start:start + self.chunk_traces], dtype=np.float64)
+                n_b = block.shape[0]
+                # Chan et al. merge of block statistics into the running mean/M2
+                b_mean = block.mean(axis=0)
+                b_m2 = ((block - b_mean) ** 2).sum(axis=0)
+                delta = b_mean - mean
+                total = count + n_b
+                mean += delta * (n_b / total)
+                m2 += b_m2 + delta ** 2 * (count * n_b / total)
+                count = total
+                sumsq += np.einsum('ij,ij->j', block, block)
+                file_sum += b_mean * n_b
+                phase = 2.0 * np.pi * np.outer(freqs, np.arange(start, start + n_b)) / self.trace_rate
+                cos, sin = np.cos(phase), np.sin(phase)
+                re += cos @ block
+                im -= sin @ block
+                ph_re += cos.sum(axis=1)
+                ph_im -= sin.sum(axis=1)
+            file_mean = file_sum / n_file
+            re -= np.outer(ph_re, file_mean)
+            im -= np.outer(ph_im, file_mean)
+            amp_sum += 2.0 * np.hypot(re, im) / n_file
+            amp_files += 1
+        if count == 0:
+            empty = np.full(samples, np.nan)
+            return {
+                'mean': empty, 'var': empty.copy(), 'rms': empty.copy(),
+                'amp': np.full((len(freqs), samples), np.nan),
+                'freqs': freqs, 'n_traces': 0, 'trace_rate': self.trace_rate,
+            }
+        amp = amp_sum / amp_files
+        amp[freqs <= 0] = np.nan
+        return {
+            'mean': mean,
+            'var': m2 / count,
+            'rms': np.sqrt(sumsq / count),
+            'amp': amp,
+            'freqs': freqs,
+            'n_traces': count,
+            'trace_rate': self.trace_rate,
+        }
+
+    def reduce_dir(self, step_dir, freqs):
+        """Reduce a step folder: its captures, or the stacked (mean) traces of a repeated step."""
+        if has_stack(step_dir):
+            return self.reduce_arrays(open_stack(step_dir)[0], freqs)
+        return self.reduce_files(list_captures(step_dir), freqs)
+
+    def reduce_step(self, step_dir, config):
+        """Reduce a step folder and write its summary next to it. Returns the summary path."""
+        freqs = [config.get(ch, {}).get('f', 0.0) for ch in CHANNELS]
+        result = self.reduce_dir(step_dir, freqs)
+        path = summary_path(step_dir)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **{k: np.asarray(v, dtype=np.float32 if np.ndim(v) else None)
+                           for k, v in result.items()})
+        os.replace(tmp_path, path)
+        return path
+
+    def __call__(self, counter, step_dir, config):
+        if config.get('reused'):
+            # An earlier run's result with the same hash, normally reduced back then
+            if os.path.exists(summary_path(step_dir)):
+                return summary_path(step_dir)
+            if not has_stack(step_dir) and not list_captures(step_dir):
+                # Never write an empty summary next to an earlier result
+                raise FileNotFoundError(f'{step_dir} has no summary and no captures to reduce')
+        return self.reduce_step(step_dir, config)
+
@@ -0,0 +1,127 @@
+import io
+import os
+import numpy as np
+
+from das_capture import open_capture, file_checksum
+from step_archive import CODECS, read_archive
+
+# Written into the step folder instead of the raw captures when a step is repeated:
+# arrays of shape (nfiles, nrefls, samples), trace i of file j stacked over all
+# repeats, in stack_dtype of the samples. The variance unless 'stack_variance' is off.
+STACK_MEAN = 'stack_mean.npy'
+STACK_VAR = 'stack_var.npy'
+
+
+def step_repeats(step, base_config):
+    """Acquisitions per step: the step's own 'repeats', else the sweep's, at least 1"""
+    try:
+        return max(int(float(step.get('repeats') or base_config.get('repeats') or 1)), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def stack_dtype(dtype):
+    """Stored dtype of a stack of dtype samples.
+
+    float16 for byte samples: a mean of values up to 255 keeps at least 1/8 of
+    a count, two bytes per sample instead of the raw capture's one per repeat.
+    Wider samples would lose whole counts in float16 and stay float32.
+    """
+    return np.dtype(np.float16 if np.dtype(dtype).itemsize == 1 else np.float32)
+
+
+def stack_file(step_dir, name):
+    """Path of a stack file, or of its step_archive archive; None if neither exists"""
+    path = os.path.join(step_dir, name)
+    if os.path.exists(path):
+        return path
+    for ext, *_ in CODECS.values():
+        if os.path.exists(path + ext):
+            return path + ext
+    return None
+
+
+def _load(path):
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    return np.load(io.BytesIO(read_archive(path)))
+
+
+def has_stack(step_dir):
+    return stack_file(step_dir, STACK_MEAN) is not None
+
+
+def open_stack(step_dir):
+    """(mean, var) of a stacked step, memory-mapped read-only; var is None if not kept.
+
+    Archived stack files are decompressed into memory instead.
+    """
+    var_path = stack_file(step_dir, STACK_VAR)
+    return _load(stack_file(step_dir, STACK_MEAN)), None if var_path is None else _load(var_path)
+
+
+class StackAccumulator:
+    """Stacks repeated acquisitions of one step trace by trace.
+
+    Each add() folds one acquisition into a running mean and, with variance,
+    sum of squared deviations (Welford), so the raw capture can be dropped
+    right after. The running sums are float32 memory-mapped scratch files;
+    finish() writes them out in stack_dtype. Captures are read in blocks of
+    chunk_traces, so memory stays bounded.
+    """
+
+    def __init__(self, step_dir, nfiles, nrefls, line_length, dtype='uint8', variance=True, chunk_traces=1024):
+        self.step_dir = step_dir
+        self.line_length = line_length
+        self.dtype = np.dtype(dtype)
+        self.chunk_traces = chunk_traces
+        self.count = 0
+        shape = (int(nfiles), int(nrefls), int(line_length) // self.dtype.itemsize)
+        os.makedirs(step_dir, exist_ok=True)
+        self._mean_tmp = os.path.join(step_dir, STACK_MEAN + '.tmp')
+        self._m2_tmp = os.path.join(step_dir, STACK_VAR + '.tmp')
+        self.mean = np.lib.format.open_memmap(self._mean_tmp, mode='w+', dtype=np.float32, shape=shape)
+        self.m2 = np.lib.format.open_memmap(self._m2_tmp, mode='w+', dtype=np.float32, shape=shape) \
+            if variance else None
+
+    def add(self, paths):
+        """Fold one acquisition (its capture files, in order) into the stack"""
+        self.count += 1
+        weight = np.float32(1.0 / self.count)
+        for index, path in enumerate(paths[:self.mean.shape[0]]):
+            data = open_capture(path, self.line_length, self.dtype)
+            n = min(data.shape[0], self.mean.shape[1])
+            for start in range(0, n, self.chunk_traces):
+                stop = min(start + self.chunk_traces, n)
+                x = np.asarray(data[start:stop], dtype=np.float32)
+                mean = self.mean[index, start:stop]
+                delta = x - mean
+                mean += delta * weight
+                if self.m2 is not None:
+                    self.m2[index, start:stop] += delta * (x - mean)
+
+    def _write(self, sums, name, scale=1.0):
+        path = os.path.join(self.step_dir, name)
+        out = np.lib.format.open_memmap(path + '.out', mode='w+', dtype=stack_dtype(self.dtype), shape=sums.shape)
+        for index in range(sums.shape[0]):
+            for start in range(0, sums.shape[1], self.chunk_traces):
+                out[index, start:start + self.chunk_traces] = sums[index, start:start + self.chunk_traces] * scale
+        out.flush()
+        del out
+        os.replace(path + '.out', path)
+        return {'name': name, 'size': os.path.getsize(path), 'checksum': file_checksum(path)}
+
+    def finish(self):
+        """Write the mean (and sample variance) in stack_dtype, drop the scratch files and list them"""
+        files = [self._write(self.mean, STACK_MEAN)]
+        if self.m2 is not None:
+            files.append(self._write(self.m2, STACK_VAR, 1.0 / max(self.count - 1, 1)))
+        self.discard()
+        return files
+
+    def discard(self):
+        """Drop the scratch files (all that is left of a stack that got no acquisition)"""
+        tmp_paths = [self._mean_tmp] + ([self._m2_tmp] if self.m2 is not None else [])
+        del self.mean, self.m2
+        for tmp_path in tmp_paths:
+            os.remove(tmp_path)
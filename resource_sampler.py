@@ -0,0 +1,242 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from acquisition_watchdog import directory_size
+
+# Seconds between samples ('resource_interval' in the config, 0 turns sampling off)
+RESOURCE_INTERVAL = 1.0
+
+
+class _ProcStats:
+    """Counters read straight from /proc and /sys (Linux without psutil)."""
+
+    source = 'proc'
+
+    def __init__(self):
+        self.tick = os.sysconf('SC_CLK_TCK')
+        self.page = os.sysconf('SC_PAGE_SIZE')
+
+    @staticmethod
+    def _read(path):
+        with open(path, 'r') as f:
+            return f.read()
+
+    def _stat(self, path):
+        # comm is in parentheses and may contain spaces; the fields after it are fixed
+        text = self._read(path)
+        name = text[text.index('(') + 1:text.rindex(')')]
+        fields = text[text.rindex(')') + 2:].split()
+        return name, (int(fields[11]) + int(fields[12])) / self.tick, int(fields[21]) * self.page
+
+    def processes(self):
+        """{pid: (name, cpu seconds, rss bytes)} for this process and its children"""
+        pids = {os.getpid()}
+        try:
+            for tid in os.listdir('/proc/self/task'):
+                pids.update(int(p) for p in self._read(f'/proc/self/task/{tid}/children').split())
+        except OSError:
+            pass
+        result = {}
+        for pid in pids:
+            try:
+                result[pid] = self._stat(f'/proc/{pid}/stat')
+            except (OSError, ValueError):
+                continue  # exited meanwhile
+        return result
+
+    def threads(self):
+        """{native thread id: cpu seconds} of this process"""
+        result = {}
+        for tid in os.listdir('/proc/self/task'):
+            try:
+                result[int(tid)] = self._stat(f'/proc/self/task/{tid}/stat')[1]
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def disk_written(self, path):
+        """Bytes written so far to the block device holding path, or None"""
+        dev = os.stat(path).st_dev
+        try:
+            fields = self._read(f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}/stat').split()
+        except OSError:
+            return None  # tmpfs, network share, ...
+        return int(fields[6]) * 512
+
+
+class _PsutilStats:
+    source = 'psutil'
+
+    def __init__(self):
+        self.process = psutil.Process()
+
+    def processes(self):
+        result = {}
+        for proc in [self.process] + self.process.children(recursive=True):
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    result[proc.pid] = (proc.name(), cpu.user + cpu.system, proc.memory_info().rss)
+            except psutil.Error:
+                continue
+        return result
+
+    def threads(self):
+        return {t.id: t.user_time + t.system_time for t in self.process.threads()}
+
+    def disk_written(self, path):
+        counters = psutil.disk_io_counters()
+        return None if counters is None else counters.write_bytes
+
+
+def host_stats():
+    """psutil where available, else /proc on Linux, else None (free space and directory size only)"""
+    if psutil is not None:
+        return _PsutilStats()
+    if os.path.exists('/proc/self/task'):
+        return _ProcStats()
+    return None
+
+
+class ResourceSampler:
+    """Writes one JSON line of host resource usage every interval seconds.
+
+    Each sample holds CPU % and RSS per process (this one and its children,
+    i.e. udp_das_cringe.exe), CPU % per thread (by Python thread name where
+    known), disk write throughput (of the output volume's device with /proc,
+    of all disks with psutil), free space on the output volume and the size
+    of the acquisition directory. position() gives the (step, stage)
+    the sample is tagged with, e.g. the runner's SweepProgress.position.
+    """
+
+    def __init__(self, path, output_dir, acquisition_dir, interval=RESOURCE_INTERVAL, position=None):
+        self.path = path
+        self.output_dir = output_dir
+        self.acquisition_dir = acquisition_dir
+        self.interval = interval
+        self.position = position
+        self.stats = host_stats()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _counters(self):
+        stats = self.stats
+        processes = threads = written = None
+        if stats is not None:
+            processes = stats.processes()
+            try:
+                threads = stats.threads()
+            except OSError:
+                threads = None
+            try:
+                written = stats.disk_written(self.output_dir)
+            except OSError:
+                written = None
+        return time.monotonic(), processes, threads, written
+
+    def _run(self):
+        with open(self.path, 'a') as f:
+            previous = self._counters()
+            while not self._stop.wait(self.interval):
+                current = self._counters()
+                f.write(json.dumps(self._sample(previous, current)) + '\n')
+                f.flush()
+                self.samples += 1
+                previous = current
+
+    def _sample(self, previous, current):
+        t0, procs0, threads0, written0 = previous
+        t1, procs1, threads1, written1 = current
+        dt = max(t1 - t0, 1e-9)
+        step, stage = self.position() if self.position is not None else (None, None)
+        files, acquired = directory_size(self.acquisition_dir)
+        sample = {'time': time.time(), 'step': step, 'stage': stage, 'pid': os.getpid(),
+                  'source': self.stats.source if self.stats is not None else None}
+        if procs1 is not None:
+            sample['processes'] = {
+                str(pid): {'name': name, 'rss': rss,
+                           'cpu': round(100.0 * (cpu - procs0[pid][1]) / dt, 1) if pid in procs0 else None}
+                for pid, (name, cpu, rss) in procs1.items()}
+        if threads1 is not None and threads0 is not None:
+            names = {t.native_id: t.name for t in threading.enumerate()}
+            sample['threads'] = {names.get(tid, f'tid-{tid}'): round(100.0 * (cpu - threads0[tid]) / dt, 1)
+                                 for tid, cpu in threads1.items() if tid in threads0}
+        if written0 is not None and written1 is not None:
+            sample['disk_write_bps'] = (written1 - written0) / dt
+        try:
+            sample['free_bytes'] = shutil.disk_usage(self.output_dir).free
+        except OSError:
+            sample['free_bytes'] = None
+        sample['acquisition_files'] = files
+        sample['acquisition_bytes'] = acquired
+        return sample
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def read_samples(path):
+    samples = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                samples.append(json.loads(line))
+            except ValueError:
+                pass  # torn last line
+    return samples
+
+
+def summarize(samples):
+    """Per step: sample count, mean/peak CPU of this process, peak RSS, mean disk writes, min free space"""
+    steps = {}
+    for s in samples:
+        if s.get('step') is None:
+            continue
+        row = steps.setdefault(s['step'], {'samples': 0, 'cpu': [], 'rss': 0, 'write': [], 'free': None})
+        row['samples'] += 1
+        own = (s.get('processes') or {}).get(str(s.get('pid'))) or {}
+        if own.get('cpu') is not None:
+            row['cpu'].append(own['cpu'])
+        row['rss'] = max(row['rss'], own.get('rss') or 0)
+        if s.get('disk_write_bps') is not None:
+            row['write'].append(s['disk_write_bps'])
+        if s.get('free_bytes') is not None:
+            row['free'] = s['free_bytes'] if row['free'] is None else min(row['free'], s['free_bytes'])
+    return {step: {'samples': r['samples'],
+                   'cpu_mean': sum(r['cpu']) / len(r['cpu']) if r['cpu'] else None,
+                   'cpu_peak': max(r['cpu']) if r['cpu'] else None,
+                   'rss_peak': r['rss'],
+                   'write_mean_bps': sum(r['write']) / len(r['write']) if r['write'] else None,
+                   'free_min': r['free']}
+            for step, r in steps.items()}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize a resources_*.jsonl file per step.')
+    parser.add_argument('path')
+    args = parser.parse_args()
+    fmt = lambda v, scale=1.0, spec='.1f': '-' if v is None else format(v / scale, spec)
+    print(f"{'step':>6} {'samples':>7} {'cpu %':>7} {'peak %':>7} {'rss MB':>8} {'write MB/s':>10} {'free GB':>8}")
+    for step, r in sorted(summarize(read_samples(args.path)).items()):
+        print(f"{step:>6} {r['samples']:>7} {fmt(r['cpu_mean']):>7} {fmt(r['cpu_peak']):>7} "
+              f"{fmt(r['rss_peak'], 1e6):>8} {fmt(r['write_mean_bps'], 1e6, '.2f'):>10} {fmt(r['free_min'], 1e9):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Artefacts written by RunProfiler.stop() into its folder
+PSTATS_NAME = 'run.pstats'
+SUMMARY_NAME = 'profile.txt'
+STACKS_NAME = 'stacks.collapsed'
+ALLOCATIONS_NAME = 'allocations.txt'
+
+
+def _frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class RunProfiler:
+    """Profiles one experiment run; nothing of this runs unless a run asks for it.
+
+    - cProfile of the thread that calls start() (the runner)
+    - a sampler thread that records the stacks of all other threads every
+      interval seconds (serial RX, GUI, pipeline workers, ...), written as
+      collapsed stacks ('thread;outer;...;inner count', flamegraph.pl and
+      speedscope read them directly)
+    - tracemalloc snapshots at start and stop: top allocations and growth
+
+    threads, if given, limits the sampler to threads with those names; the
+    calling thread is always sampled under the name 'runner'.
+    """
+
+    def __init__(self, out_dir, interval=0.01, threads=None, top=30, malloc_frames=1):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.threads = set(threads) if threads else None
+        self.top = top
+        self.malloc_frames = malloc_frames
+        self.samples = Counter()
+        self._profile = None
+        self._runner = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._own_tracemalloc = False
+        self._snapshot = None
+        self._started = None
+
+    def start(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._started = time.monotonic()
+        self._runner = threading.get_ident()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.malloc_frames)
+            self._own_tracemalloc = True
+        self._snapshot = tracemalloc.take_snapshot()
+        self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+        self._sampler.start()
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError:  # another profiler is active (e.g. an IDE)
+            self._profile = None
+        return self
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                name = 'runner' if ident == self._runner else names.get(ident, f'thread-{ident}')
+                if self.threads is not None and name != 'runner' and name not in self.threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(name)
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop everything and write the artefacts; returns the output folder."""
+        if self._profile is not None:
+            self._profile.disable()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        end = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+        elapsed = time.monotonic() - self._started
+
+        with open(os.path.join(self.out_dir, SUMMARY_NAME), 'w') as f:
+            f.write(f'Run time {elapsed:.2f} s, {sum(self.samples.values())} stack samples '
+                    f'every {self.interval * 1000:.0f} ms\n\n')
+            if self._profile is not None:
+                self._profile.dump_stats(os.path.join(self.out_dir, PSTATS_NAME))
+                text = io.StringIO()
+                pstats.Stats(self._profile, stream=text).sort_stats('cumulative').print_stats(self.top)
+                f.write(text.getvalue())
+            else:
+                f.write('cProfile was not available (another profiler active)\n')
+        with open(os.path.join(self.out_dir, STACKS_NAME), 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        end = end.filter_traces(filters)
+        with open(os.path.join(self.out_dir, ALLOCATIONS_NAME), 'w') as f:
+            f.write(f'Peak traced memory {peak / 1e6:.1f} MB\n\nTop allocations at the end of the run:\n')
+            for stat in end.statistics('lineno')[:self.top]:
+                f.write(f'{stat}\n')
+            f.write('\nGrowth during the run:\n')
+            for stat in end.compare_to(self._snapshot.filter_traces(filters), 'lineno')[:self.top]:
+                f.write(f'{stat}\n')
+        return self.out_dir
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
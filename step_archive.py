@@ -0,0 +1,342 @@
+import logging
+import lzma
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from step_manifest import read_manifest, write_manifest
+
+log = logging.getLogger('pzt.archive')
+
+# Worker processes compressing finished steps ('archive_workers' in the config)
+ARCHIVE_WORKERS = 1
+ARCHIVE_CODEC = 'zlib'
+# Niceness of the workers, so the acquisition always gets the CPU first
+ARCHIVE_NICE = 10
+BLOCK_SIZE = 1 << 20
+
+
+class _Lz4Compressor:
+    """lz4.frame with the compress/flush interface of the stdlib codecs"""
+
+    def __init__(self, level):
+        self._c = lz4frame.LZ4FrameCompressor(compression_level=level)
+        self._started = False
+
+    def compress(self, data):
+        head = b''
+        if not self._started:
+            head, self._started = self._c.begin(), True
+        return head + self._c.compress(data)
+
+    def flush(self):
+        return (b'' if self._started else self._c.begin()) + self._c.flush()
+
+
+# name -> (extension, default level, compressor(level), decompressor())
+CODECS = {
+    'zlib': ('.zz', 6, lambda level: zlib.compressobj(level), zlib.decompressobj),
+    'lzma': ('.xz', 6, lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor),
+}
+if zstandard is not None:
+    CODECS['zstd'] = ('.zst', 3, lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+                      lambda: zstandard.ZstdDecompressor().decompressobj())
+if lz4frame is not None:
+    CODECS['lz4'] = ('.lz4', 0, _Lz4Compressor, lz4frame.LZ4FrameDecompressor)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ArchiveError(f"Unknown archive codec {name!r}, available: {sorted(CODECS)}") from None
+
+
+# Set in each worker process: cleared while an acquisition runs
+_allowed = None
+
+
+def _init_worker(allowed, nice):
+    global _allowed
+    _allowed = allowed
+    try:
+        if hasattr(os, 'nice'):
+            os.nice(nice)
+        elif psutil is not None:
+            psutil.Process().nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+        if psutil is not None and hasattr(psutil.Process(), 'ionice'):
+            proc = psutil.Process()
+            proc.ionice(psutil.IOPRIO_CLASS_IDLE if hasattr(psutil, 'IOPRIO_CLASS_IDLE') else psutil.IOPRIO_VERYLOW)
+    except (OSError, AttributeError):
+        pass  # best effort; the pause between blocks still applies
+
+
+def _wait_allowed():
+    if _allowed is not None:
+        _allowed.wait()
+
+
+def compress_file(src, dst, codec, level=None):
+    """Compress src into dst and check that dst decompresses to src.
+
+    Returns (crc 'crc32:xxxxxxxx' of the original, compressed size). dst is
+    removed again if the check fails. Between blocks the worker waits while
+    an acquisition runs.
+    """
+    _, default, compressor, decompressor = _codec(codec)
+    c = compressor(default if level is None else level)
+    crc = 0
+    tmp = dst + '.tmp'
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        while True:
+            _wait_allowed()
+            block = fin.read(BLOCK_SIZE)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            fout.write(c.compress(block))
+        fout.write(c.flush())
+    d = decompressor()
+    check = 0
+    size = 0
+    with open(tmp, 'rb') as f:
+        while True:
+            _wait_allowed()
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            data = d.decompress(block)
+            check = zlib.crc32(data, check)
+            size += len(data)
+    if check != crc or size != os.path.getsize(src):
+        os.remove(tmp)
+        raise ArchiveError(f'{dst}: decompressed data does not match {src}')
+    os.replace(tmp, dst)
+    return f'crc32:{crc:08x}', os.path.getsize(dst)
+
+
+def archive_codec(path):
+    """Codec of an archive made by compress_file, from its extension; None for other files"""
+    for name, (ext, *_) in CODECS.items():
+        if path.endswith(ext):
+            return name
+    return None
+
+
+def read_archive(path):
+    """Decompressed content of an archive made by compress_file, in memory"""
+    codec = archive_codec(path)
+    if codec is None:
+        raise ArchiveError(f'{path} is not an archive of a known codec ({sorted(CODECS)})')
+    d = _codec(codec)[3]()
+    parts = []
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            parts.append(d.decompress(block))
+    return b''.join(parts)
+
+
+def decompress_file(src, dst, codec):
+    """Inverse of compress_file; returns the crc of the restored data"""
+    d = _codec(codec)[3]()
+    crc = 0
+    tmp = dst + '.tmp'
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        while True:
+            block = fin.read(BLOCK_SIZE)
+            if not block:
+                break
+            data = d.decompress(block)
+            crc = zlib.crc32(data, crc)
+            fout.write(data)
+    os.replace(tmp, dst)
+    return f'crc32:{crc:08x}'
+
+
+def archive_step(step_dir, codec=ARCHIVE_CODEC, level=None):
+    """Compress the files listed in a step's manifest and record them under 'archive'.
+
+    An original is deleted only once its archive has been read back and
+    matches it (and its manifest checksum, where the manifest has one).
+    Files already archived are skipped. Captures and stacks stay readable
+    through das_capture and repeat_stacking, which decompress archives on
+    read. Returns (original bytes, archived bytes).
+    """
+    manifest = read_manifest(step_dir)
+    if manifest is None:
+        raise ArchiveError(f'{step_dir} has no manifest')
+    ext = _codec(codec)[0]
+    archive = manifest.setdefault('archive', {'codec': codec, 'level': level, 'files': {}})
+    if archive['codec'] != codec:
+        codec, ext = archive['codec'], _codec(archive['codec'])[0]  # finish with the codec it was started with
+    original = archived = 0
+    for entry in manifest.get('files', []):
+        name = entry['name']
+        src = os.path.join(step_dir, name)
+        if name in archive['files'] or not os.path.isfile(src):
+            continue
+        size = os.path.getsize(src)
+        crc, packed = compress_file(src, src + ext, codec, level)
+        if entry.get('checksum') and entry['checksum'] != crc:
+            os.remove(src + ext)
+            raise ArchiveError(f'{src}: checksum {crc} does not match the manifest ({entry["checksum"]})')
+        entry['checksum'] = crc
+        archive['files'][name] = {'archive': name + ext, 'size': packed}
+        # Record the archive before dropping the original, so a crash leaves both
+        write_manifest(step_dir, manifest)
+        os.remove(src)
+        original += size
+        archived += packed
+    write_manifest(step_dir, manifest)
+    return original, archived
+
+
+def restore_step(step_dir):
+    """Decompress an archived step back to its original files and drop the 'archive' block"""
+    manifest = read_manifest(step_dir)
+    if manifest is None or 'archive' not in manifest:
+        return 0
+    archive = manifest['archive']
+    checksums = {e['name']: e.get('checksum') for e in manifest.get('files', [])}
+    for name, item in list(archive['files'].items()):
+        src = os.path.join(step_dir, item['archive'])
+        crc = decompress_file(src, os.path.join(step_dir, name), archive['codec'])
+        if checksums.get(name) and checksums[name] != crc:
+            raise ArchiveError(f'{src}: restored data does not match the manifest checksum')
+        os.remove(src)
+        del archive['files'][name]
+        write_manifest(step_dir, manifest)
+    del manifest['archive']
+    write_manifest(step_dir, manifest)
+    return len(checksums)
+
+
+class StepArchiver:
+    """Step pipeline handler that compresses finished steps in a process pool.
+
+    Add it last, so the handlers before it still see the raw captures. At most
+    workers steps are compressed at once, by processes of lowered CPU (and,
+    with psutil, I/O) priority; pause() makes them wait between blocks, so the
+    runner holds them off while udp_das_cringe.exe writes. close() waits for
+    the queued steps. on_archived(step_dir) is called for every step archived.
+    """
+
+    def __init__(self, codec=ARCHIVE_CODEC, level=None, workers=ARCHIVE_WORKERS, nice=ARCHIVE_NICE,
+                 on_archived=None):
+        _codec(codec)
+        self.codec = codec
+        self.level = level
+        self.on_archived = on_archived
+        self.original = 0
+        self.archived = 0
+        self.failed = []
+        # spawn: forking the runner with its serial and pipeline threads running is unsafe
+        context = multiprocessing.get_context('spawn')
+        self._allowed = context.Event()
+        self._allowed.set()
+        self._pool = ProcessPoolExecutor(max_workers=max(int(workers), 1), mp_context=context,
+                                         initializer=_init_worker, initargs=(self._allowed, nice))
+        self._futures = []
+
+    @classmethod
+    def from_config(cls, config, on_archived=None):
+        level = config.get('archive_level')
+        return cls(config.get('archive_codec', ARCHIVE_CODEC), None if level in (None, '') else int(level),
+                   config.get('archive_workers', ARCHIVE_WORKERS), on_archived=on_archived)
+
+    def pause(self):
+        self._allowed.clear()
+
+    def resume(self):
+        self._allowed.set()
+
+    def __call__(self, counter, step_dir, config):
+        if config.get('reused'):
+            return  # an earlier run's result, archived (or not) by that run
+        future = self._pool.submit(archive_step, step_dir, self.codec, self.level)
+        future.add_done_callback(lambda f, step_dir=step_dir: self._done(step_dir, f))
+        self._futures.append(future)
+
+    def _done(self, step_dir, future):
+        try:
+            original, archived = future.result()
+        except Exception as e:
+            log.error('Archiving %s failed, the originals are kept: %s', step_dir, e)
+            self.failed.append(step_dir)
+            return
+        self.original += original
+        self.archived += archived
+        log.debug('Archived %s: %d -> %d bytes', step_dir, original, archived)
+        if self.on_archived is not None:
+            try:
+                self.on_archived(step_dir)
+            except Exception as e:
+                log.error('Recording the archive of %s failed: %s', step_dir, e)
+
+    def close(self):
+        self.resume()
+        t0 = time.monotonic()
+        self._pool.shutdown(wait=True)
+        if self._futures:
+            log.info('Archived %d steps with %s in %.1f s after the run: %.2f GB -> %.2f GB, %d failed',
+                     len(self._futures) - len(self.failed), self.codec, time.monotonic() - t0,
+                     self.original / 1e9, self.archived / 1e9, len(self.failed))
+
+
+def main():
+    import argparse
+    from concurrent.futures import as_completed
+    parser = argparse.ArgumentParser(description='Compress or restore step folders (those with a manifest).')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('archive')
+    p.add_argument('dirs', nargs='+', help='step folders, or run folders holding them')
+    p.add_argument('--codec', default=ARCHIVE_CODEC, choices=sorted(CODECS))
+    p.add_argument('--level', type=int)
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    p = sub.add_parser('restore')
+    p.add_argument('dirs', nargs='+')
+    args = parser.parse_args()
+    steps = []
+    for d in args.dirs:
+        if read_manifest(d) is not None:
+            steps.append(d)
+        elif os.path.isdir(d):
+            steps += sorted(os.path.join(d, n) for n in os.listdir(d) if read_manifest(os.path.join(d, n)))
+    if args.command == 'restore':
+        for d in steps:
+            print(f'{d}: {restore_step(d)} files restored')
+        return
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(archive_step, d, args.codec, args.level): d for d in steps}
+        for future in as_completed(futures):
+            try:
+                original, archived = future.result()
+                print(f'{futures[future]}: {original / 1e6:.1f} MB -> {archived / 1e6:.1f} MB')
+            except Exception as e:
+                print(f'{futures[future]}: failed, originals kept: {e}')
+
+
+if __name__ == '__main__':
+    main()
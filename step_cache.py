@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+
+from das_capture import capture_layout
+from step_manifest import read_manifest
+from repeat_stacking import step_repeats
+
+CHANNELS = ('ch1', 'ch2', 'ch3')
+# Bumped whenever the hashed content changes meaning, so old hashes stop matching
+HASH_VERSION = 2
+
+
+def acquisition_settings(base_config, init_values=None, sleep_time=None):
+    """Everything besides the step parameters that decides what a step's data looks like"""
+    line_length, dtype, trace_rate = capture_layout(base_config)
+    return {
+        'nfiles': int(base_config.get('nfiles', 3)),
+        'nrefls': int(base_config.get('nrefls', 10000)),
+        'line_length': line_length,
+        'sample_dtype': dtype.str,
+        'trace_rate': trace_rate,
+        'settle': None if sleep_time is None else float(sleep_time),
+        'init': dict(sorted((init_values or {}).items())),
+        'stack_variance': bool(base_config.get('stack_variance', True)),
+    }
+
+
+def step_hash(step, settings, base_config=None):
+    """Hex digest identifying a step's result: its channel parameters, wave type,
+    repeats and the acquisition settings (see acquisition_settings)."""
+    params = {ch: {p: float(step.get(ch, {}).get(p, 0.0) or 0.0) for p in ('v', 'b', 'f')} for ch in CHANNELS}
+    content = {
+        'version': HASH_VERSION,
+        'params': params,
+        'wave_type': str(step.get('wave_type', (base_config or {}).get('wave_type', 'Z'))).upper(),
+        'repeats': step_repeats(step, base_config or {}),
+        'settings': settings,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _files_present(step_dir, files, archived=None):
+    archived = archived or {}
+    for entry in files:
+        try:
+            if entry['name'] in archived:
+                # Compressed by step_archive: the archive must be there instead
+                if os.path.getsize(os.path.join(step_dir, archived[entry['name']]['archive'])) \
+                        != archived[entry['name']]['size']:
+                    return False
+            elif os.path.getsize(os.path.join(step_dir, entry['name'])) != entry['size']:
+                return False
+        except (OSError, KeyError, TypeError):
+            return False
+    return True
+
+
+class StepIndex:
+    """Valid step results under a prefix, by step hash.
+
+    Built from the step manifests of earlier runs. A step that reused an older
+    result points at that result's folder, so references never chain. A result
+    only counts while the manifest in its folder still has its hash and says
+    valid, and its files are all there with their recorded sizes.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.results = {}  # hash -> (folder name, manifest)
+        self.sources = set()  # folder names holding those results
+        if not os.path.isdir(prefix):
+            return
+        found = []
+        for name in os.listdir(prefix):
+            step_dir = os.path.join(prefix, name)
+            manifest = read_manifest(step_dir) if os.path.isdir(step_dir) else None
+            if not manifest or not manifest.get('valid') or not manifest.get('step_hash'):
+                continue
+            found.append((os.path.getmtime(step_dir), name, manifest))
+        # The newest result wins where a step was acquired more than once
+        for _, name, manifest in sorted(found, key=lambda item: item[0]):
+            self.results[manifest['step_hash']] = (manifest.get('reused_from') or name, manifest)
+        self.sources = {name for name, _ in self.results.values()}
+
+    def __len__(self):
+        return len(self.results)
+
+    def lookup(self, digest):
+        """(folder name, manifest) of a reusable result, or None"""
+        entry = self.results.get(digest)
+        if entry is None:
+            return None
+        name = entry[0]
+        # The folder may have been acquired again since (same name, other parameters)
+        manifest = read_manifest(os.path.join(self.prefix, name))
+        if not manifest or not manifest.get('valid') or manifest.get('step_hash') != digest:
+            return None
+        if not _files_present(os.path.join(self.prefix, name), manifest.get('files', []),
+                              manifest.get('archive', {}).get('files')):
+            return None
+        return name, manifest
+
+
+def reuse_manifest(counter, params, digest, source, manifest):
+    """Manifest of a step that takes over the result in folder source, by reference.
+
+    File names stay relative to the source folder; 'reused_from' names it.
+    """
+    return {
+        'step': counter,
+        'params': params,
+        'step_hash': digest,
+        'expected': manifest.get('expected'),
+        'attempts': 0,
+        'exit_code': manifest.get('exit_code'),
+        'problems': [],
+        'valid': True,
+        'files': manifest.get('files', []),
+        'reused_from': source,
+        **({'repeats': manifest['repeats']} if 'repeats' in manifest else {}),
+    }
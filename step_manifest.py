@@ -0,0 +1,30 @@
+import json
+import os
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def manifest_path(step_dir):
+    return os.path.join(step_dir, MANIFEST_NAME)
+
+
+def write_manifest(step_dir, manifest):
+    """Write a step manifest atomically (temp file + rename)."""
+    write_run_manifest(manifest_path(step_dir), manifest)
+
+
+def write_run_manifest(path, manifest):
+    """Write a manifest file at path atomically (temp file + rename)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(step_dir):
+    """Manifest of a step folder, or None if it has none (or it is unreadable)."""
+    try:
+        with open(manifest_path(step_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,265 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtGui import QBrush, QColor, QFont
+
+CHANNELS = ['ch1', 'ch2', 'ch3']
+PARAMS = ['v', 'b', 'f']
+# Column order of the backing array: ch1_v, ch1_b, ch1_f, ch2_v, ...
+PARAM_KEYS = [f'{ch}_{p}' for ch in CHANNELS for p in PARAMS]
+
+STEP_COLUMNS = [
+    ("step", "Step"),
+    ("ch1_v", "Ch1 V"), ("ch1_b", "Ch1 B"), ("ch1_f", "Ch1 F"),
+    ("spacer1", ""),
+    ("ch2_v", "Ch2 V"), ("ch2_b", "Ch2 B"), ("ch2_f", "Ch2 F"),
+    ("spacer2", ""),
+    ("ch3_v", "Ch3 V"), ("ch3_b", "Ch3 B"), ("ch3_f", "Ch3 F")
+]
+
+
+def steps_to_array(steps):
+    """Config 'steps' list -> (n, 9) float array in PARAM_KEYS order."""
+    keys = [(ch, p) for ch in CHANNELS for p in PARAMS]
+    try:
+        return np.array([[step[ch][p] for ch, p in keys] for step in steps],
+                         dtype=np.float64).reshape(-1, len(PARAM_KEYS))
+    except (KeyError, TypeError, ValueError):
+        pass
+    # Slow path for hand-edited configs with missing or non-numeric values
+    array = np.zeros((len(steps), len(PARAM_KEYS)))
+    for row, step in enumerate(steps):
+        for col, (ch, param) in enumerate(keys):
+            try:
+                array[row, col] = float(step.get(ch, {}).get(param, 0.0) or 0.0)
+            except (TypeError, ValueError):
+                array[row, col] = 0.0
+    return array
+
+
+def step_extras(steps):
+    """Per-step keys other than the channel parameters (e.g. 'repeats'), one dict per step."""
+    return [{k: v for k, v in step.items() if k not in CHANNELS} if isinstance(step, dict) else {}
+            for step in steps]
+
+
+def array_to_steps(array, extras=None):
+    """(n, 9) array -> config 'steps' list; extras (see step_extras) are merged back in."""
+    rows = np.asarray(array, dtype=np.float64).tolist()
+    extras = extras if extras is not None else [{}] * len(rows)
+    return [
+        dict(extra,
+             ch1={'v': r[0], 'b': r[1], 'f': r[2]},
+             ch2={'v': r[3], 'b': r[4], 'f': r[5]},
+             ch3={'v': r[6], 'b': r[7], 'f': r[8]})
+        for r, extra in zip(rows, extras)
+    ]
+
+
+def encode_steps(value):
+    """ConfigStore encoder for 'steps': a StepTableModel.snapshot() or a step array
+    becomes the list form, a list stays as it is."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, tuple):
+        return array_to_steps(*value)
+    return array_to_steps(value)
+
+
+def save_steps(path, array):
+    """Write an (n, 9) step array to .npy, or to CSV with a PARAM_KEYS header."""
+    array = np.asarray(array, dtype=np.float64).reshape(-1, len(PARAM_KEYS))
+    if path.lower().endswith('.npy'):
+        np.save(path, array)
+    else:
+        np.savetxt(path, array, delimiter=',', fmt='%.10g', header=','.join(PARAM_KEYS), comments='')
+
+
+def load_steps(path):
+    """Read steps written by save_steps (or any CSV with named columns).
+
+    CSV columns are matched by header name, in any order; a 'step' column is
+    ignored and missing parameters are 0. Without a header the file must have
+    nine columns in PARAM_KEYS order.
+    """
+    if path.lower().endswith('.npy'):
+        return np.asarray(np.load(path), dtype=np.float64).reshape(-1, len(PARAM_KEYS))
+    with open(path, 'r') as f:
+        first = f.readline()
+    names = [name.strip().strip('"').lower() for name in first.split(',')]
+    has_header = any(name in PARAM_KEYS for name in names)
+    data = np.loadtxt(path, delimiter=',', skiprows=1 if has_header else 0, ndmin=2)
+    if not has_header:
+        if data.shape[1] != len(PARAM_KEYS):
+            raise ValueError(f"{path}: expected {len(PARAM_KEYS)} columns, got {data.shape[1]}")
+        return data
+    array = np.zeros((data.shape[0], len(PARAM_KEYS)))
+    for col, name in enumerate(names):
+        if name in PARAM_KEYS:
+            array[:, PARAM_KEYS.index(name)] = data[:, col]
+    return array
+
+
+class StepTableModel(QAbstractTableModel):
+    """Sweep steps backed by one (n, 9) float array.
+
+    Styling comes from data roles, so nothing is stored per cell, and bulk
+    operations (set_array, insert_steps, move_step) emit a single model signal.
+    Step numbers are derived from the row, so they never need rewriting.
+    Per-step keys the table does not show (e.g. 'repeats') are kept alongside
+    the rows and written back unchanged.
+    """
+
+    # Emitted after any change to the steps (edit, insert, remove, move, reset)
+    stepsChanged = pyqtSignal()
+
+    BACKGROUNDS = {
+        'step': QColor('#22232a'),
+        'spacer': QColor('#18191c'),
+        'ch1': QColor('#232b36'),  # blueish dark
+        'ch2': QColor('#233026'),  # greenish dark
+        'ch3': QColor('#2b2323'),  # reddish dark
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._array = np.zeros((0, len(PARAM_KEYS)))
+        self._extras = []  # per row: the step's other keys
+        # view column -> array column (None for the step number and spacers)
+        self._param_col = [PARAM_KEYS.index(k) if k in PARAM_KEYS else None for k, _ in STEP_COLUMNS]
+        self._group = [k if k == 'step' else 'spacer' if k.startswith('spacer') else k[:3]
+                       for k, _ in STEP_COLUMNS]
+        self._backgrounds = {g: QBrush(c) for g, c in self.BACKGROUNDS.items()}
+        self._step_fg = QBrush(QColor('#b0b0b0'))
+        self._step_font = QFont("Segoe UI", 13, QFont.Bold)
+        self._tooltips = []
+        for key, _ in STEP_COLUMNS:
+            if key == "step":
+                self._tooltips.append("Step number (auto)")
+            elif key.startswith("spacer"):
+                self._tooltips.append("")
+            else:
+                ch, param = key.split('_')
+                self._tooltips.append(f"Channel {ch[-1]} {param.upper()}")
+        for signal in (self.dataChanged, self.rowsInserted, self.rowsRemoved, self.rowsMoved, self.modelReset):
+            signal.connect(self.stepsChanged)
+
+    # --- Qt model interface ---
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._array.shape[0]
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(STEP_COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, col = index.row(), index.column()
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            param_col = self._param_col[col]
+            if param_col is not None:
+                return str(self._array[row, param_col])
+            return str(row + 1) if col == 0 else ""
+        if role == Qt.BackgroundRole:
+            return self._backgrounds[self._group[col]]
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        if col == 0:
+            if role == Qt.ForegroundRole:
+                return self._step_fg
+            if role == Qt.FontRole:
+                return self._step_font
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            if role == Qt.DisplayRole:
+                return STEP_COLUMNS[section][1]
+            if role == Qt.ToolTipRole:
+                return self._tooltips[section]
+        elif role == Qt.DisplayRole:
+            return str(section + 1)
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        if self._param_col[index.column()] is None:
+            return Qt.ItemIsSelectable | Qt.ItemIsEnabled
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or not index.isValid():
+            return False
+        param_col = self._param_col[index.column()]
+        if param_col is None:
+            return False
+        text = str(value).strip()
+        try:
+            number = float(text) if text else 0.0
+        except ValueError:
+            return False
+        self._array[index.row(), param_col] = number
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return True
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        if count <= 0 or row < 0 or row + count > self.rowCount():
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        self._array = np.delete(self._array, np.s_[row:row + count], axis=0)
+        del self._extras[row:row + count]
+        self.endRemoveRows()
+        return True
+
+    # --- Bulk operations ---
+    def array(self):
+        """Copy of the backing (n, 9) array in PARAM_KEYS order."""
+        return self._array.copy()
+
+    def snapshot(self):
+        """(array copy, extras copy) for encode_steps"""
+        return self._array.copy(), list(self._extras)
+
+    def set_array(self, array, extras=None):
+        self.beginResetModel()
+        self._array = np.array(array, dtype=np.float64).reshape(-1, len(PARAM_KEYS))
+        self._extras = list(extras) if extras is not None else [{} for _ in range(len(self._array))]
+        self.endResetModel()
+
+    def set_steps(self, steps):
+        self.set_array(steps_to_array(steps), step_extras(steps))
+
+    def steps(self):
+        return array_to_steps(self._array, self._extras)
+
+    def insert_steps(self, row, values=None, count=1):
+        """Insert count steps (zeros, or the rows of values) before row in one batch."""
+        if values is not None:
+            values = np.asarray(values, dtype=np.float64).reshape(-1, len(PARAM_KEYS))
+            count = values.shape[0]
+        else:
+            values = np.zeros((count, len(PARAM_KEYS)))
+        if count == 0:
+            return
+        row = max(0, min(row, self.rowCount()))
+        self.beginInsertRows(QModelIndex(), row, row + count - 1)
+        self._array = np.concatenate([self._array[:row], values, self._array[row:]])
+        self._extras[row:row] = [{} for _ in range(count)]
+        self.endInsertRows()
+
+    def append_steps(self, values=None, count=1):
+        self.insert_steps(self.rowCount(), values, count)
+
+    def move_step(self, source, target):
+        """Move one step so it ends up at index target."""
+        n = self.rowCount()
+        if source == target or not (0 <= source < n and 0 <= target < n):
+            return False
+        # Qt's destination is the row the item is inserted before, in pre-move coordinates
+        destination = target + 1 if target > source else target
+        self.beginMoveRows(QModelIndex(), source, source, QModelIndex(), destination)
+        row = self._array[source].copy()
+        self._array = np.insert(np.delete(self._array, source, axis=0), target, row, axis=0)
+        self._extras.insert(target, self._extras.pop(source))
+        self.endMoveRows()
+        return True
@@ -0,0 +1,66 @@
+import logging
+import queue
+import threading
+
+log = logging.getLogger('pzt.pipeline')
+
+
+class StepPipeline:
+    """Runs post-acquisition handlers for finished steps on a worker thread.
+
+    Handlers are called as handler(counter, step_dir, config) in the order they
+    were added, one step at a time, so later handlers see the results of earlier
+    ones. Acquisition of the next step is never blocked by them.
+    """
+
+    def __init__(self):
+        self.handlers = []
+        self.errors = []
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def add(self, handler):
+        self.handlers.append(handler)
+
+    def __bool__(self):
+        return bool(self.handlers)
+
+    def submit(self, counter, step_dir, config):
+        if not self.handlers:
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='step-pipeline', daemon=True)
+            self._thread.start()
+        self._queue.put((counter, step_dir, config))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            counter, step_dir, config = item
+            for handler in self.handlers:
+                try:
+                    handler(counter, step_dir, config)
+                except Exception as e:
+                    log.error('%s failed on %s: %s', getattr(handler, '__name__', handler), step_dir, e)
+                    self.errors.append((step_dir, str(e)))
+            self._queue.task_done()
+
+    def drain(self):
+        """Wait until every submitted step has been through all handlers."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Finish pending steps, stop the worker and close handlers that need it."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        for handler in self.handlers:
+            if hasattr(handler, 'close'):
+                try:
+                    handler.close()
+                except Exception as e:
+                    log.error('Failed to close %s: %s', handler, e)
@@ -0,0 +1,123 @@
+import numpy as np
+from PyQt5.QtWidgets import (QDialog, QGridLayout, QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
+                             QDoubleSpinBox, QSpinBox, QDialogButtonBox, QRadioButton)
+
+from step_model import PARAM_KEYS
+
+
+def axis_values(start, stop, points):
+    """points evenly spaced values from start to stop inclusive (one point gives start)."""
+    points = int(points)
+    if points < 1:
+        raise ValueError("points must be at least 1")
+    return np.linspace(start, stop, points) if points > 1 else np.array([float(start)])
+
+
+def generate_sweep(axes, base=None):
+    """Nested product of parameter axes as an (n, 9) step array.
+
+    axes is a list of (param_key, values) from the outermost loop to the innermost,
+    so the last axis changes fastest (1_1_1, 1_1_2, ... 1_2_1 ...). Parameters
+    without an axis take their value from base (a PARAM_KEYS dict or 9-vector), else 0.
+    """
+    if isinstance(base, dict):
+        row = np.array([float(base.get(key, 0.0)) for key in PARAM_KEYS])
+    elif base is not None:
+        row = np.asarray(base, dtype=np.float64).reshape(len(PARAM_KEYS))
+    else:
+        row = np.zeros(len(PARAM_KEYS))
+    keys = [key for key, _ in axes]
+    if len(set(keys)) != len(keys):
+        raise ValueError("each parameter can only be swept once")
+    grids = np.meshgrid(*[np.asarray(values, dtype=np.float64) for _, values in axes], indexing='ij')
+    n = grids[0].size if grids else 1
+    array = np.tile(row, (n, 1))
+    for key, grid in zip(keys, grids):
+        array[:, PARAM_KEYS.index(key)] = grid.ravel()
+    return array
+
+
+class SweepGeneratorDialog(QDialog):
+    """Builds a nested sweep over any of the nine channel parameters.
+
+    Each parameter is either fixed or swept from start to stop in a number of
+    points; 'Loop' sets the nesting order (1 = outermost loop).
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Generate Sweep")
+        self.rows = {}
+        grid = QGridLayout()
+        for col, title in enumerate(["Parameter", "Mode", "Start / Value", "Stop", "Points", "Loop"]):
+            grid.addWidget(QLabel(title), 0, col)
+        for i, key in enumerate(PARAM_KEYS, start=1):
+            ch, param = key.split('_')
+            mode = QComboBox()
+            mode.addItems(["Fixed", "Sweep"])
+            start, stop = self._spin(), self._spin()
+            points = QSpinBox()
+            points.setRange(1, 100000)
+            points.setValue(9)
+            order = QSpinBox()
+            order.setRange(1, len(PARAM_KEYS))
+            order.setValue(i)
+            for widget in (stop, points, order):
+                widget.setEnabled(False)
+                mode.currentIndexChanged.connect(lambda index, w=widget: w.setEnabled(index == 1))
+            mode.currentIndexChanged.connect(self._update_count)
+            points.valueChanged.connect(self._update_count)
+            for col, widget in enumerate([QLabel(f"Channel {ch[-1]} {param.upper()}"), mode, start, stop, points, order]):
+                grid.addWidget(widget, i, col)
+            self.rows[key] = (mode, start, stop, points, order)
+        self.replace_radio = QRadioButton("Replace steps")
+        self.append_radio = QRadioButton("Append to steps")
+        self.replace_radio.setChecked(True)
+        self.count_label = QLabel("")
+        options = QHBoxLayout()
+        options.addWidget(self.replace_radio)
+        options.addWidget(self.append_radio)
+        options.addStretch()
+        options.addWidget(self.count_label)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout = QVBoxLayout()
+        layout.addLayout(grid)
+        layout.addLayout(options)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+        self._update_count()
+
+    @staticmethod
+    def _spin():
+        spin = QDoubleSpinBox()
+        spin.setRange(-1e9, 1e9)
+        spin.setDecimals(4)
+        return spin
+
+    def set_base(self, base):
+        """Prefill fixed values from a PARAM_KEYS dict (e.g. the selected step)."""
+        for key, value in base.items():
+            if key in self.rows:
+                self.rows[key][1].setValue(float(value))
+
+    def _update_count(self, *args):
+        count = 1
+        for mode, _, _, points, _ in self.rows.values():
+            if mode.currentIndex() == 1:
+                count *= points.value()
+        self.count_label.setText(f"{count} steps")
+
+    def axes(self):
+        swept = [(order.value(), PARAM_KEYS.index(key), key, axis_values(start.value(), stop.value(), points.value()))
+                 for key, (mode, start, stop, points, order) in self.rows.items() if mode.currentIndex() == 1]
+        swept.sort(key=lambda item: item[:2])
+        return [(key, values) for _, _, key, values in swept]
+
+    def steps(self):
+        base = {key: start.value() for key, (_, start, _, _, _) in self.rows.items()}
+        return generate_sweep(self.axes(), base)
+
+    def replace(self):
+        return self.replace_radio.isChecked()
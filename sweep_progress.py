@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger('pzt.progress')
+
+
+class SweepProgress:
+    """Turns runner milestones into structured progress events.
+
+    Events are dicts with a 'type' key, passed to callback(event):
+      {'type': 'start', 'total', 'time'}
+      {'type': 'stage', 'index', 'total', 'stage', 'params'}
+      {'type': 'step', 'index', 'total', 'params', 'timings', 'files', 'bytes',
+       'elapsed', 'eta', 'steps_per_hour', 'bytes_per_s'}
+      {'type': 'finish', 'status', 'elapsed', 'completed'}
+    Without a callback every method is a no-op.
+    """
+
+    def __init__(self, callback=None, total=0):
+        self.callback = callback
+        self.total = total
+        self.completed = 0
+        self.bytes = 0
+        self.t0 = time.monotonic()
+        # (step index, stage) the runner is in, read by samplers on other threads
+        self.position = (None, None)
+
+    def _emit(self, event):
+        if self.callback is not None:
+            try:
+                self.callback(event)
+            except Exception as e:
+                log.error('progress callback failed: %s', e)
+
+    def start(self, total=None):
+        if total is not None:
+            self.total = total
+        self.t0 = time.monotonic()
+        self._emit({'type': 'start', 'total': self.total, 'time': time.time()})
+
+    def stage(self, index, stage, params=None):
+        self.position = (index, stage)
+        if self.callback is None:
+            return
+        self._emit({'type': 'stage', 'index': index, 'total': self.total, 'stage': stage,
+                    'params': _channel_params(params)})
+
+    def step_done(self, index, params, timings, files=()):
+        self.completed += 1
+        step_bytes = sum(f.get('size', 0) for f in files)
+        self.bytes += step_bytes
+        if self.callback is None:
+            return
+        elapsed = time.monotonic() - self.t0
+        per_step = elapsed / self.completed
+        self._emit({
+            'type': 'step', 'index': index, 'total': self.total,
+            'params': _channel_params(params), 'timings': dict(timings),
+            'files': len(files), 'bytes': step_bytes,
+            'elapsed': elapsed,
+            'eta': per_step * max(self.total - index, 0),
+            'steps_per_hour': 3600.0 / per_step if per_step > 0 else 0.0,
+            'bytes_per_s': self.bytes / elapsed if elapsed > 0 else 0.0,
+        })
+
+    def finish(self, status):
+        self.position = (None, None)
+        self._emit({'type': 'finish', 'status': status, 'completed': self.completed,
+                    'elapsed': time.monotonic() - self.t0})
+
+
+def _channel_params(params):
+    if not params:
+        return {}
+    return {k: params[k] for k in ('ch1', 'ch2', 'ch3', 'wave_type') if k in params}
+
+
+class EventThrottle:
+    """Batches events and delivers them at most once per interval.
+
+    deliver(batch) is called with the list of events gathered since the previous
+    delivery, from a timer thread, so a burst of events costs one delivery and the
+    last events of a burst are never held back longer than interval.
+    """
+
+    def __init__(self, deliver, interval=0.2):
+        self.deliver = deliver
+        self.interval = interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+        self._last = 0.0
+
+    def __call__(self, event):
+        with self._lock:
+            self._pending.append(event)
+            if self._timer is not None:
+                return
+            delay = max(0.0, self._last + self.interval - time.monotonic())
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._pending = self._pending, []
+            self._last = time.monotonic()
+        if batch:
+            self.deliver(batch)
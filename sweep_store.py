@@ -0,0 +1,308 @@
+import json
+import lzma
+import mmap
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+from das_capture import capture_layout, list_captures, open_capture
+from repeat_stacking import STACK_MEAN, STACK_VAR, has_stack, open_stack
+
+# Container layout (little endian):
+#   header   MAGIC, u32 version
+#   chunk*   CHUNK_MAGIC, CHUNK_HEADER, payload
+#   trailer  TRAILER_MAGIC, u64 json length, json (meta, steps, index), u64 trailer offset, END_MAGIC
+# Every chunk is self-describing, so the index can be rebuilt by scanning if the
+# trailer is missing (e.g. the run was killed before close()).
+MAGIC = b'DASSTORE'
+VERSION = 1
+CHUNK_MAGIC = b'CHNK'
+CHUNK_HEADER = struct.Struct('<IIIII8sBQQ')
+TRAILER_MAGIC = b'INDX'
+END_MAGIC = b'DASEND!!'
+STORE_EXT = '.dasstore'
+
+CODECS = {'none': 0, 'zlib': 1, 'lzma': 2}
+CODEC_NAMES = {v: k for k, v in CODECS.items()}
+
+
+class SweepStoreError(Exception):
+    pass
+
+
+def store_path(prefix, stamp=None):
+    """Default container for a run: {prefix}/{prefix}_{stamp}.dasstore.
+
+    Step counters start at 1 in every run, so each run gets its own container;
+    without an explicit stamp, a container that already exists (a run started
+    in the same second) is never picked.
+    """
+    base = os.path.join(prefix, os.path.basename(os.path.normpath(prefix)))
+    if stamp:
+        return f'{base}_{stamp}{STORE_EXT}'
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    path, n = f'{base}_{stamp}{STORE_EXT}', 1
+    while os.path.exists(path):
+        n += 1
+        path = f'{base}_{stamp}_{n}{STORE_EXT}'
+    return path
+
+
+def _compress(raw, codec, level):
+    if codec == 'zlib':
+        return zlib.compress(raw, level)
+    if codec == 'lzma':
+        return lzma.compress(raw, preset=level)
+    return raw
+
+
+def _decompress(payload, codec):
+    if codec == 'zlib':
+        return zlib.decompress(payload)
+    if codec == 'lzma':
+        return lzma.decompress(payload)
+    return payload
+
+
+class SweepStoreWriter:
+    """Appends every step's reflectograms to one chunked container per run.
+
+    Each capture file is cut into chunks of chunk_traces reflectograms that are
+    compressed independently, so any (step, file, trace) slice can later be read by
+    decompressing only the chunks that cover it. A stacked step stores its mean
+    (and variance) rows in the stack's dtype instead. Reopening an existing container
+    continues appending to it; a step number that is already stored is refused.
+    """
+
+    def __init__(self, path, line_length, dtype='uint8', codec='zlib', level=1, chunk_traces=256):
+        if codec not in CODECS:
+            raise SweepStoreError(f'Unknown codec {codec!r}, expected one of {sorted(CODECS)}')
+        self.path = path
+        self.line_length = int(line_length)
+        self.dtype = np.dtype(dtype)
+        self.codec = codec
+        self.level = level
+        self.chunk_traces = chunk_traces
+        self.steps = []
+        self.index = []
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with SweepStoreReader(path) as existing:
+                self.steps = existing.steps
+                self.index = existing.index
+                end = existing.data_end
+            self._f = open(path, 'r+b')
+            self._f.truncate(end)
+            self._f.seek(end)
+        else:
+            self._f = open(path, 'wb')
+            self._f.write(MAGIC + struct.pack('<I', VERSION))
+
+    @classmethod
+    def from_config(cls, config, path=None):
+        line_length, dtype, _ = capture_layout(config)
+        return cls(
+            path or store_path(config.get('prefix', 'experiment')),
+            line_length, dtype,
+            codec=config.get('store_codec', 'zlib'),
+            level=int(config.get('store_level', 1)),
+        )
+
+    def append_step(self, step, params, paths):
+        """Append a step's capture files; params is the step's channel/wave settings."""
+        self._append(step, params, ((os.path.basename(path), open_capture(path, self.line_length, self.dtype))
+                                    for path in paths), self.dtype)
+
+    def append_stack(self, step, params, step_dir):
+        """Append a stacked step: a file per row of its mean, then per row of its variance if kept.
+
+        The files are named like batch_postprocess names them ('stack_mean.npy[0]', ...)
+        and the step's entry records the stack's dtype.
+        """
+        mean, var = open_stack(step_dir)
+        arrays = [(f'{STACK_MEAN}[{i}]', rows) for i, rows in enumerate(mean)]
+        if var is not None:
+            arrays += [(f'{STACK_VAR}[{i}]', rows) for i, rows in enumerate(var)]
+        self._append(step, params, arrays, mean.dtype)
+
+    def _append(self, step, params, arrays, dtype):
+        if any(s['step'] == step for s in self.steps):
+            raise SweepStoreError(f'{self.path} already holds step {step}')
+        dtype = np.dtype(dtype)
+        samples = self.line_length // self.dtype.itemsize
+        files = []
+        for file_idx, (name, data) in enumerate(arrays):
+            for start in range(0, data.shape[0], self.chunk_traces):
+                block = np.ascontiguousarray(data[start:start + self.chunk_traces])
+                raw = block.tobytes()
+                payload = _compress(raw, self.codec, self.level)
+                offset = self._f.tell() + len(CHUNK_MAGIC) + CHUNK_HEADER.size
+                self._f.write(CHUNK_MAGIC + CHUNK_HEADER.pack(
+                    step, file_idx, start, block.shape[0], samples,
+                    dtype.str.encode(), CODECS[self.codec], len(raw), len(payload)))
+                self._f.write(payload)
+                self.index.append([step, file_idx, start, block.shape[0], offset,
+                                   len(payload), len(raw), CODECS[self.codec]])
+            files.append({'name': name, 'nrefls': int(data.shape[0])})
+        entry = {'step': step, 'params': params, 'files': files}
+        if dtype != self.dtype:
+            entry['dtype'] = dtype.str
+        self.steps.append(entry)
+        self._f.flush()
+
+    def __call__(self, counter, step_dir, config):
+        params = {k: config[k] for k in ('ch1', 'ch2', 'ch3', 'wave_type') if k in config}
+        params['folder'] = os.path.basename(os.path.normpath(step_dir))
+        if config.get('reused'):
+            # step_dir is the earlier result's folder; its data is copied so every
+            # run's container holds all of its steps
+            params['reused_from'] = config['reused']
+        paths = list_captures(step_dir)
+        if paths:
+            self.append_step(counter, params, paths)
+        elif has_stack(step_dir):
+            self.append_stack(counter, params, step_dir)
+        else:
+            raise SweepStoreError(f'{step_dir} not stored: no captures')
+
+    def close(self):
+        """Write the step table and index trailer."""
+        if self._f.closed:
+            return
+        trailer_offset = self._f.tell()
+        meta = {'version': VERSION, 'line_length': self.line_length,
+                'dtype': self.dtype.str, 'samples': self.line_length // self.dtype.itemsize}
+        body = json.dumps({'meta': meta, 'steps': self.steps, 'index': self.index}).encode()
+        self._f.write(TRAILER_MAGIC + struct.pack('<Q', len(body)) + body)
+        self._f.write(struct.pack('<Q', trailer_offset) + END_MAGIC)
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SweepStoreReader:
+    """Memory-mapped random access into a sweep container."""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise SweepStoreError(f'{path} is not a sweep store')
+        self.meta = {}
+        self.steps = []
+        self.index = []
+        if not self._read_trailer():
+            self._scan()
+        # (step, file) -> index rows ordered by first trace
+        self._by_file = {}
+        for row in self.index:
+            self._by_file.setdefault((row[0], row[1]), []).append(row)
+        for rows in self._by_file.values():
+            rows.sort(key=lambda r: r[2])
+
+    def _read_trailer(self):
+        mm = self._mm
+        if len(mm) < 16 or mm[-len(END_MAGIC):] != END_MAGIC:
+            return False
+        (trailer_offset,) = struct.unpack_from('<Q', mm, len(mm) - len(END_MAGIC) - 8)
+        if mm[trailer_offset:trailer_offset + 4] != TRAILER_MAGIC:
+            return False
+        (length,) = struct.unpack_from('<Q', mm, trailer_offset + 4)
+        body = json.loads(mm[trailer_offset + 12:trailer_offset + 12 + length])
+        self.meta, self.steps, self.index = body['meta'], body['steps'], body['index']
+        self.data_end = trailer_offset
+        return True
+
+    def _scan(self):
+        """Rebuild the index from chunk headers (no trailer, e.g. interrupted run)."""
+        mm = self._mm
+        pos = len(MAGIC) + 4
+        steps, dtypes = {}, {}
+        while pos + 4 + CHUNK_HEADER.size <= len(mm) and mm[pos:pos + 4] == CHUNK_MAGIC:
+            step, file_idx, start, n, samples, dtype, codec, raw_len, comp_len = \
+                CHUNK_HEADER.unpack_from(mm, pos + 4)
+            offset = pos + 4 + CHUNK_HEADER.size
+            if offset + comp_len > len(mm):
+                break
+            self.index.append([step, file_idx, start, n, offset, comp_len, raw_len, codec])
+            dtypes[step] = dtype.rstrip(b'\0').decode()
+            if not self.meta:
+                self.meta = {'version': VERSION, 'dtype': dtypes[step], 'samples': samples}
+            files = steps.setdefault(step, {})
+            files[file_idx] = max(files.get(file_idx, 0), start + n)
+            pos = offset + comp_len
+        # Without the step table it is unknown which steps are stacked; each keeps its chunks' dtype
+        self.steps = [{'step': s, 'params': {}, 'dtype': dtypes[s],
+                       'files': [{'name': None, 'nrefls': files[i]} for i in sorted(files)]}
+                      for s, files in sorted(steps.items())]
+        self.data_end = pos
+
+    @property
+    def dtype(self):
+        return np.dtype(self.meta['dtype'])
+
+    def step_dtype(self, step):
+        """Sample dtype of a step: the container's, or its stack's for a stacked step"""
+        for s in self.steps:
+            if s['step'] == step and 'dtype' in s:
+                return np.dtype(s['dtype'])
+        return self.dtype
+
+    def step_params(self):
+        """Step-parameter table: list of (step, params) in acquisition order."""
+        return [(s['step'], s['params']) for s in self.steps]
+
+    def read(self, step, file=0, traces=None):
+        """Reflectograms of (step, file) as a (n, samples) array; traces is a slice or int.
+
+        Uncompressed chunks are returned as zero-copy views of the mapping when the
+        request falls inside a single chunk.
+        """
+        rows = self._by_file.get((step, file))
+        if not rows:
+            raise KeyError((step, file))
+        dtype = self.step_dtype(step)
+        total = rows[-1][2] + rows[-1][3]
+        if isinstance(traces, int):
+            traces = slice(traces, traces + 1)
+        start, stop, stride = (traces or slice(None)).indices(total)
+        if stride != 1:
+            return self.read(step, file, slice(start, stop))[::stride]
+        samples = self.meta['samples']
+        parts = []
+        for row_step, row_file, c_start, n, offset, comp_len, raw_len, codec in rows:
+            c_stop = c_start + n
+            if c_stop <= start or c_start >= stop:
+                continue
+            if CODEC_NAMES[codec] == 'none':
+                block = np.frombuffer(self._mm, dtype=dtype, count=n * samples, offset=offset)
+            else:
+                raw = _decompress(self._mm[offset:offset + comp_len], CODEC_NAMES[codec])
+                block = np.frombuffer(raw, dtype=dtype)
+            block = block.reshape(n, samples)
+            parts.append(block[max(start, c_start) - c_start:min(stop, c_stop) - c_start])
+        if not parts:
+            return np.zeros((0, samples), dtype=dtype)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def close(self):
+        try:
+            self._mm.close()
+        except BufferError:
+            # zero-copy arrays returned by read() still reference the mapping;
+            # it is released once they are garbage collected
+            pass
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
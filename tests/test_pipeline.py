@@ -0,0 +1,336 @@
+# tests/test_pipeline.py -- step processing, storage and control of the sweep runner
+# Run from the repository root: python -m pytest -q tests/test_pipeline.py
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from adaptive_sweep import AdaptiveRefiner
+from continuous_capture import read_markers, step_bounds, StepMarkerLog, StreamSplitter
+from das_capture import file_checksum, list_captures, open_capture
+from feedback_control import PIController
+from piezo_control_service import claim_step_folder
+from reflectogram_reduction import StepReducer
+from repeat_stacking import open_stack, StackAccumulator
+from step_archive import archive_step, restore_step
+from step_cache import acquisition_settings, step_hash, StepIndex
+from step_manifest import read_manifest, write_manifest
+from sweep_store import store_path, SweepStoreError, SweepStoreReader, SweepStoreWriter
+
+STEP = {'ch1': {'v': 1.0, 'b': 2.0, 'f': 3.0}, 'ch2': {'v': 0, 'b': 0, 'f': 0},
+        'ch3': {'v': 0, 'b': 0, 'f': 0}, 'wave_type': 'Z'}
+
+
+class TempDirTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def write_capture(self, folder, name, data):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, name)
+        np.ascontiguousarray(data).tofile(path)
+        return path
+
+
+class TestStepReducer(unittest.TestCase):
+    def test_moments_and_drive_amplitude(self):
+        rate, f, n, samples = 1000.0, 50.0, 2000, 16
+        t = np.arange(n)[:, None] / rate
+        amp = np.linspace(1.0, 4.0, samples)
+        offset = np.linspace(-2.0, 2.0, samples)
+        data = offset + amp * np.sin(2 * np.pi * f * t)
+        reducer = StepReducer(samples * 8, 'float64', rate, chunk_traces=300)
+        # Two files with a chunk size that does not divide them: the merge must not care
+        result = reducer.reduce_arrays([data[:1100], data[1100:]], [f, 0.0, 0.0])
+        np.testing.assert_allclose(result['mean'], data.mean(axis=0), atol=1e-9)
+        np.testing.assert_allclose(result['var'], data.var(axis=0), rtol=1e-9)
+        np.testing.assert_allclose(result['rms'], np.sqrt((data ** 2).mean(axis=0)), rtol=1e-9)
+        np.testing.assert_allclose(result['amp'][0], amp, rtol=1e-6)
+        self.assertTrue(np.isnan(result['amp'][1:]).all())
+        self.assertEqual(result['n_traces'], n)
+
+    def test_no_traces_gives_nan(self):
+        result = StepReducer(4, 'uint8').reduce_arrays([np.zeros((0, 4), np.uint8)], [1.0, 0.0, 0.0])
+        self.assertEqual(result['n_traces'], 0)
+        self.assertTrue(np.isnan(result['mean']).all())
+
+
+class TestSweepStore(TempDirTest):
+    def test_two_runs_round_trip_into_own_containers(self):
+        rng = np.random.default_rng(0)
+        runs = []
+        for _ in range(2):
+            step_dir = os.path.join(self.tmp, 'step')
+            shutil.rmtree(step_dir, ignore_errors=True)
+            data = [rng.integers(0, 256, (700, 32), dtype=np.uint8) for _ in range(2)]
+            for i, d in enumerate(data):
+                self.write_capture(step_dir, f'DASdata_{i:08d}.bin', d)
+            path = store_path(self.tmp)
+            with SweepStoreWriter(path, 32, chunk_traces=256) as writer:
+                writer(1, step_dir, STEP)
+                with self.assertRaises(SweepStoreError):
+                    writer(1, step_dir, STEP)
+            runs.append((path, data))
+        self.assertNotEqual(runs[0][0], runs[1][0])
+        for path, data in runs:
+            with SweepStoreReader(path) as reader:
+                self.assertEqual([s for s, _ in reader.step_params()], [1])
+                for i, d in enumerate(data):
+                    np.testing.assert_array_equal(reader.read(1, i), d)
+                np.testing.assert_array_equal(reader.read(1, 1, slice(250, 520)), data[1][250:520])
+
+    def test_stacked_step_stores_mean_and_variance(self):
+        step_dir = os.path.join(self.tmp, 'stacked')
+        stack = StackAccumulator(step_dir, 2, 300, 32)
+        rng = np.random.default_rng(3)
+        for repeat in range(3):
+            paths = [self.write_capture(os.path.join(self.tmp, f'r{repeat}'), f'DASdata_{i:08d}.bin',
+                                        rng.integers(0, 256, (300, 32), dtype=np.uint8)) for i in range(2)]
+            stack.add(paths)
+        stack.finish()
+        mean, var = open_stack(step_dir)
+        path = os.path.join(self.tmp, 's.dasstore')
+        with SweepStoreWriter(path, 32, chunk_traces=128) as writer:
+            writer(1, step_dir, STEP)
+        with SweepStoreReader(path) as reader:
+            self.assertEqual([f['name'] for f in reader.steps[0]['files']],
+                             ['stack_mean.npy[0]', 'stack_mean.npy[1]', 'stack_var.npy[0]', 'stack_var.npy[1]'])
+            self.assertEqual(reader.step_dtype(1), np.float16)
+            np.testing.assert_array_equal(reader.read(1, 1), mean[1])
+            np.testing.assert_array_equal(reader.read(1, 2, slice(100, 200)), var[0, 100:200])
+
+    def test_step_without_captures_is_refused(self):
+        os.makedirs(os.path.join(self.tmp, 'empty'))
+        with SweepStoreWriter(os.path.join(self.tmp, 's.dasstore'), 32) as writer:
+            with self.assertRaises(SweepStoreError):
+                writer(1, os.path.join(self.tmp, 'empty'), STEP)
+
+
+class TestContinuousCapture(TempDirTest):
+    def test_new_log_replaces_markers_of_an_earlier_run(self):
+        path = os.path.join(self.tmp, 'markers.jsonl')
+        for steps in ([1, 2, 3], [1, 2]):
+            log = StepMarkerLog(path)
+            log.mark('start')
+            for step in steps:
+                log.mark('configure', step, STEP)
+            log.mark('end')
+            log.close()
+        self.assertEqual([s[0] for s in step_bounds(read_markers(path))], [1, 2])
+
+    def test_bounds_use_markers_after_the_last_start(self):
+        markers = [{'time': 1.0, 'event': 'start', 'step': None},
+                   {'time': 2.0, 'event': 'configure', 'step': 1},
+                   {'time': 3.0, 'event': 'end', 'step': None},
+                   {'time': 10.0, 'event': 'start', 'step': None},
+                   {'time': 11.0, 'event': 'configure', 'step': 1},
+                   {'time': 11.5, 'event': 'settled', 'step': 1},
+                   {'time': 12.0, 'event': 'end', 'step': None}]
+        self.assertEqual(step_bounds(markers), [(1, {}, 11.0, 11.5, 12.0)])
+
+    def test_final_split_reads_the_short_last_file(self):
+        stream = os.path.join(self.tmp, 'stream')
+        t0 = time.time() - 100
+        # 10 traces per second: two full files and a short one cut off by the stop
+        for i, (n, t) in enumerate(((10, 1.0), (10, 2.0), (5, 2.5))):
+            path = self.write_capture(stream, f'DASdata_{i:08d}.bin', np.full((n, 4), i, np.uint8))
+            os.utime(path, (t0 + t, t0 + t))
+        with open(os.path.join(stream, 'markers.jsonl'), 'w') as f:
+            for t, event, step in ((0.0, 'start', None), (0.0, 'configure', 1), (0.2, 'settled', 1),
+                                   (1.45, 'configure', 2), (2.5, 'end', None)):
+                f.write(json.dumps({'time': t0 + t, 'event': event, 'step': step}) + '\n')
+        config = {'nrefls': 10, 'line_length': 4, 'trace_rate': 10}
+        splitter = StreamSplitter(stream, config)
+        folder_for = lambda step, params: os.path.join(self.tmp, str(step))
+        self.assertEqual([s for s, *_ in splitter.split_ready(folder_for)], [1])
+        written = splitter.split_ready(folder_for, final=True)
+        self.assertEqual([s for s, *_ in written], [2])
+        self.assertEqual(written[0][3]['segment']['n_traces'], 10)
+        traces = np.concatenate([open_capture(p, 4) for p in list_captures(written[0][2])])
+        self.assertEqual(traces[-5:, 0].tolist(), [2] * 5)
+        self.assertFalse(splitter.failed)
+
+
+class TestStackAccumulator(TempDirTest):
+    def stack(self, dtype, variance):
+        rng = np.random.default_rng(1)
+        info = np.iinfo(dtype)
+        repeats = [rng.integers(info.min, info.max, (2, 300, 24), dtype=dtype, endpoint=True)
+                   for _ in range(5)]
+        step_dir = os.path.join(self.tmp, f'{np.dtype(dtype).name} {variance}')
+        acc = StackAccumulator(step_dir, 2, 300, 24 * np.dtype(dtype).itemsize, dtype, variance, chunk_traces=64)
+        for r, data in enumerate(repeats):
+            acc.add([self.write_capture(os.path.join(self.tmp, f'r{r}'), f'DASdata_{i:08d}.bin', d)
+                     for i, d in enumerate(data)])
+        files = acc.finish()
+        return np.stack(repeats).astype(np.float64), open_stack(step_dir), files, step_dir
+
+    def test_welford_matches_numpy(self):
+        raw, (mean, var), files, step_dir = self.stack(np.int16, True)
+        self.assertEqual(mean.dtype, np.float32)
+        np.testing.assert_allclose(mean, raw.mean(axis=0), atol=1e-2)
+        np.testing.assert_allclose(var, raw.var(axis=0, ddof=1), rtol=1e-4, atol=1e-2)
+        self.assertEqual(sorted(os.listdir(step_dir)), sorted(f['name'] for f in files))
+
+    def test_byte_samples_store_float16_mean_only(self):
+        raw, (mean, var), files, step_dir = self.stack(np.uint8, False)
+        self.assertEqual(mean.dtype, np.float16)
+        self.assertIsNone(var)
+        np.testing.assert_allclose(mean, raw.mean(axis=0), atol=0.125)
+        self.assertEqual(os.listdir(step_dir), ['stack_mean.npy'])
+
+
+class FixedResponses:
+    metric = 'amp'
+
+    def __init__(self, steps, responses):
+        from adaptive_sweep import params_array
+        self.params = params_array(steps)
+        self.responses = np.asarray(responses, dtype=np.float64)
+
+    def results(self):
+        return self.params, self.responses
+
+
+class TestAdaptiveRefiner(unittest.TestCase):
+    def coarse(self, values):
+        return [dict(STEP, ch1={'v': v, 'b': 2.0, 'f': 3.0}) for v in values]
+
+    def test_splits_the_steepest_segment_first(self):
+        steps = self.coarse([0.0, 2.0, 4.0, 6.0, 8.0, 10.0])
+        refiner = AdaptiveRefiner({}, steps, FixedResponses(steps, [0, 0, 0, 1, 1, 1]), budget=3, batch=1)
+        first = refiner.propose()
+        self.assertEqual([s['ch1']['v'] for s in first], [5.0])
+        self.assertEqual((first[0]['ch1']['b'], first[0]['adaptive_round']), (2.0, 1))
+        # Proposed but not measured yet: not proposed again
+        self.assertNotEqual([s['ch1']['v'] for s in refiner.propose()], [5.0])
+
+    def test_budget_and_min_spacing(self):
+        steps = self.coarse([0.0, 1.0])
+        refiner = AdaptiveRefiner({}, steps, FixedResponses(steps, [0, 1]), budget=5, batch=8, min_spacing=0.3)
+        self.assertEqual(len(refiner.propose()), 1)
+        self.assertEqual(refiner.propose(), [])
+        refiner = AdaptiveRefiner({}, self.coarse(np.linspace(0, 10, 11)),
+                                  FixedResponses(self.coarse(np.linspace(0, 10, 11)), np.arange(11) % 2),
+                                  budget=3, batch=8)
+        self.assertEqual(len(refiner.propose()), 3)
+        self.assertEqual((refiner.remaining, refiner.propose()), (0, []))
+
+    def test_nothing_varied_nothing_proposed(self):
+        steps = self.coarse([1.0, 1.0])
+        self.assertEqual(AdaptiveRefiner({}, steps, FixedResponses(steps, [0, 1]), budget=4).propose(), [])
+
+
+class TestPIController(unittest.TestCase):
+    def test_output_clamped_and_recovers_from_saturation(self):
+        for ki in (0.5, -0.5):
+            pi = PIController(setpoint=10.0, kp=0.0, ki=ki, output=5.0, low=0.0, high=10.0)
+            far = -100.0 if ki > 0 else 100.0  # drives the output into the high limit
+            outputs = [pi.update(far, 1.0)[0] for _ in range(100)]
+            self.assertTrue(all(0.0 <= o <= 10.0 for o in outputs))
+            self.assertEqual(outputs[-1], 10.0)
+            # No wind-up: the integral holds the output at the limit, not beyond it
+            self.assertAlmostEqual(pi.base + pi.ki * pi.integral, 10.0)
+            output, _ = pi.update(10.0 + (12.0 if ki > 0 else -12.0), 1.0)
+            self.assertLess(output, 10.0)
+
+    def test_integral_moves_out_of_a_limit(self):
+        pi = PIController(setpoint=0.0, kp=1.0, ki=1.0, output=0.0, low=-1.0, high=1.0)
+        self.assertEqual(pi.update(-5.0, 0.1)[0], 1.0)
+        self.assertEqual(pi.update(5.0, 0.1)[0], -1.0)
+        self.assertAlmostEqual(pi.update(0.0, 0.1)[0], pi.integral)
+
+    def test_non_finite_measurement_keeps_the_last_output(self):
+        pi = PIController(setpoint=1.0, kp=0.5, ki=2.0, output=5.0, low=0.0, high=10.0)
+        output, _ = pi.update(0.0, 0.1)
+        integral = pi.integral
+        for measurement in (float('nan'), float('inf')):
+            held, error = pi.update(measurement, 0.1)
+            self.assertEqual(held, output)
+            self.assertTrue(np.isnan(error))
+            self.assertEqual(pi.integral, integral)
+        self.assertTrue(np.isfinite(pi.update(0.5, 0.1)[0]))
+
+
+class TestStepCache(TempDirTest):
+    def setUp(self):
+        super().setUp()
+        self.settings = acquisition_settings({'nfiles': 1, 'nrefls': 10, 'line_length': 4})
+
+    def result(self, name, step, valid=True):
+        step_dir = os.path.join(self.tmp, name)
+        path = self.write_capture(step_dir, 'DASdata_00000000.bin', np.zeros((10, 4), np.uint8))
+        digest = step_hash(step, self.settings)
+        write_manifest(step_dir, {'step': 1, 'step_hash': digest, 'valid': valid,
+                                  'files': [{'name': 'DASdata_00000000.bin', 'size': 40}]})
+        return digest, path
+
+    def test_hash_covers_parameters_repeats_and_settings(self):
+        digest = step_hash(STEP, self.settings)
+        self.assertEqual(digest, step_hash(json.loads(json.dumps(STEP)), self.settings))
+        self.assertNotEqual(digest, step_hash(dict(STEP, ch2={'v': 0.5}), self.settings))
+        self.assertNotEqual(digest, step_hash(dict(STEP, repeats=3), self.settings))
+        other = acquisition_settings({'nfiles': 1, 'nrefls': 20, 'line_length': 4})
+        self.assertNotEqual(digest, step_hash(STEP, other))
+
+    def test_lookup_invalidated_by_changes_on_disk(self):
+        digest, path = self.result('1 a', STEP)
+        bad, _ = self.result('2 a', dict(STEP, ch3={'v': 1.0}), valid=False)
+        index = StepIndex(self.tmp)
+        self.assertEqual(index.lookup(digest)[0], '1 a')
+        self.assertIsNone(index.lookup(bad))
+        with open(path, 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(index.lookup(digest))
+        # The folder acquired again with other parameters
+        self.result('1 a', dict(STEP, ch1={'v': 9.0}))
+        self.assertIsNone(index.lookup(digest))
+
+    def test_reference_never_overwrites_a_kept_result(self):
+        digest, _ = self.result('1 a', STEP)
+        other, _ = self.result('2 a', dict(STEP, ch3={'v': 1.0}))
+        index = StepIndex(self.tmp)
+        self.assertEqual(index.sources, {'1 a', '2 a'})
+        dest = os.path.join(self.tmp, '2 a')
+        self.assertEqual(claim_step_folder(dest, digest, set(), index), f'{dest} {digest[:8]}')
+        self.assertEqual(claim_step_folder(dest, digest, {'2 a'}), f'{dest} {digest[:8]}')
+        # A fresh run without the index only keeps what it reuses
+        self.assertEqual(claim_step_folder(dest, digest, set()), dest)
+        self.assertEqual(claim_step_folder(os.path.join(self.tmp, '3 a'), other, set(), index),
+                         os.path.join(self.tmp, '3 a'))
+
+
+class TestStepArchive(TempDirTest):
+    def test_archive_restore_round_trip(self):
+        step_dir = os.path.join(self.tmp, '1 a')
+        rng = np.random.default_rng(2)
+        data = [rng.integers(0, 8, (500, 16), dtype=np.uint8) for _ in range(2)]
+        paths = [self.write_capture(step_dir, f'DASdata_{i:08d}.bin', d) for i, d in enumerate(data)]
+        crcs = [file_checksum(p) for p in paths]
+        write_manifest(step_dir, {'step': 1, 'files': [
+            {'name': os.path.basename(p), 'size': os.path.getsize(p), 'checksum': None} for p in paths]})
+        original, archived = archive_step(step_dir, 'zlib', 6)
+        self.assertEqual(original, sum(d.nbytes for d in data))
+        self.assertLess(archived, original)
+        self.assertFalse(any(os.path.exists(p) for p in paths))
+        manifest = read_manifest(step_dir)
+        self.assertEqual([f['checksum'] for f in manifest['files']], crcs)
+        # Readers see the archives as captures
+        archives = list_captures(step_dir)
+        self.assertEqual(archives, [p + '.zz' for p in paths])
+        for path, d in zip(archives, data):
+            np.testing.assert_array_equal(open_capture(path, 16), d)
+        self.assertEqual(restore_step(step_dir), 2)
+        self.assertEqual([file_checksum(p) for p in paths], crcs)
+        self.assertNotIn('archive', read_manifest(step_dir))
+        self.assertEqual(list_captures(step_dir), paths)
+
+
+if __name__ == "__main__":
+    unittest.main()
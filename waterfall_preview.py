@@ -0,0 +1,159 @@
+import os
+import time
+import numpy as np
+from PyQt5.QtWidgets import QWidget, QSizePolicy
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QImage, QPainter, QColor
+
+from das_capture import capture_layout, expected_capture_size, list_captures, read_capture
+
+
+def ptp_decimate(traces, rows, cols):
+    """Reduce a (n, samples) block to about (rows, cols) by peak-to-peak per tile.
+
+    Each output pixel is max - min over its group of reflectograms and fibre
+    positions, so a vibration confined to one trace or one sample still shows up
+    (block averaging would wash it out).
+    """
+    n, samples = traces.shape
+    if n == 0 or samples == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    k = max(1, n // rows)
+    m = max(1, samples // cols)
+    g, w = n // k, samples // m
+    tiles = np.asarray(traces[n - g * k:, :w * m]).reshape(g, k, w, m)
+    return tiles.max(axis=(1, 3)).astype(np.float32) - tiles.min(axis=(1, 3))
+
+
+def _colormap():
+    """256-entry ARGB lookup table, dark blue -> cyan -> yellow -> white."""
+    stops = np.array([[0.0, 20, 24, 36], [0.35, 30, 90, 200], [0.6, 40, 200, 200],
+                      [0.85, 240, 220, 60], [1.0, 255, 255, 255]])
+    x = np.linspace(0.0, 1.0, 256)
+    rgb = [np.interp(x, stops[:, 0], stops[:, i]).astype(np.uint32) for i in (1, 2, 3)]
+    return (0xFF000000 | (rgb[0] << 16) | (rgb[1] << 8) | rgb[2]).astype(np.uint32)
+
+
+class PreviewWorker(QThread):
+    """Tails the newest capture and produces decimated waterfall rows.
+
+    Runs at the lowest thread priority, reads each capture into memory (no
+    mapping stays open while the runner moves or removes it) and decimates at
+    most max_fps files per second. Acquisition never waits on it: a file that
+    is moved away mid-read is simply skipped.
+    """
+
+    # (rows, cols) uint8 intensities for the new rows, and the source file name
+    frame = pyqtSignal(object, str)
+
+    def __init__(self, config, cols=800, rows_per_file=48, max_fps=4.0, parent=None):
+        super().__init__(parent)
+        self.line_length, self.dtype, _ = capture_layout(config)
+        self.udp_dir = config.get('dir', 'refls1')
+        self.prefix = config.get('prefix', 'experiment')
+        try:
+            self.expected_size = expected_capture_size(int(float(config.get('nrefls', 0))), self.line_length)
+        except ValueError:
+            self.expected_size = 0
+        self.cols = cols
+        self.rows_per_file = rows_per_file
+        self.min_interval = 1.0 / max_fps
+        self._running = True
+        self._last_mtime_ns = 0
+        self._scale = None
+
+    def stop(self):
+        self._running = False
+
+    def _newest_step_dir(self):
+        try:
+            dirs = [e for e in os.scandir(self.prefix) if e.is_dir()]
+        except OSError:
+            return None
+        return max(dirs, key=lambda e: e.stat().st_mtime).path if dirs else None
+
+    def _newest_capture(self):
+        candidates = list_captures(self.udp_dir)
+        step_dir = self._newest_step_dir()
+        if step_dir:
+            candidates += list_captures(step_dir)
+        best = None
+        for path in candidates:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # moved away between listing and stat
+            if self.expected_size and st.st_size != self.expected_size:
+                continue  # still being written
+            # Only files newer than the last one shown; a rename keeps the mtime, so a
+            # file moved into its step folder is not shown twice, and a backlog is skipped
+            if st.st_mtime_ns > self._last_mtime_ns and (best is None or st.st_mtime_ns > best[0]):
+                best = (st.st_mtime_ns, path)
+        return best
+
+    def run(self):
+        self.setPriority(QThread.LowestPriority)
+        while self._running:
+            started = time.monotonic()
+            newest = self._newest_capture()
+            if newest is not None:
+                mtime_ns, path = newest
+                try:
+                    tile = ptp_decimate(read_capture(path, self.line_length, self.dtype),
+                                        self.rows_per_file, self.cols)
+                except (OSError, ValueError):
+                    tile = None
+                if tile is not None and tile.size:
+                    self._last_mtime_ns = mtime_ns
+                    # Slowly adapting colour scale so one burst doesn't blank the picture
+                    top = float(np.percentile(tile, 99.5)) or 1.0
+                    self._scale = top if self._scale is None else 0.8 * self._scale + 0.2 * top
+                    image = np.clip(tile * (255.0 / self._scale), 0, 255).astype(np.uint8)
+                    self.frame.emit(image, os.path.basename(path))
+            self.msleep(int(max(self.min_interval - (time.monotonic() - started), 0.05) * 1000))
+
+
+class WaterfallView(QWidget):
+    """Scrolling waterfall: newest rows at the top, fibre position along x."""
+
+    def __init__(self, height=480, width=800, parent=None):
+        super().__init__(parent)
+        self._lut = _colormap()
+        self._buffer = np.zeros((height, width), dtype=np.uint8)
+        self._image = None
+        self.title = ""
+        self.setMinimumHeight(240)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
+    def clear(self):
+        self._buffer[:] = 0
+        self._image = None
+        self.title = ""
+        self.update()
+
+    def add_rows(self, rows, title=""):
+        rows = rows[::-1]  # newest trace first
+        n = min(rows.shape[0], self._buffer.shape[0])
+        if rows.shape[1] != self._buffer.shape[1]:
+            # Resample columns to the buffer width (nearest)
+            idx = np.linspace(0, rows.shape[1] - 1, self._buffer.shape[1]).astype(int)
+            rows = rows[:, idx]
+        self._buffer = np.roll(self._buffer, n, axis=0)
+        self._buffer[:n] = rows[:n]
+        argb = np.ascontiguousarray(self._lut[self._buffer])
+        h, w = argb.shape
+        # QImage does not own the memory, keep the array alive alongside it
+        self._argb = argb
+        self._image = QImage(argb.data, w, h, 4 * w, QImage.Format_ARGB32)
+        self.title = title
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('#14161b'))
+        if self._image is not None:
+            painter.drawImage(self.rect(), self._image)
+        if self.title:
+            painter.setPen(QColor('#e0e6f0'))
+            painter.drawText(8, 16, self.title)
+        painter.end()